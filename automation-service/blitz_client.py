@@ -1,16 +1,85 @@
+import asyncio
 import httpx
-from typing import Optional, Dict, Any
+import json
+from collections import OrderedDict
+from typing import Optional, Dict, Any, AsyncIterator, Awaitable, Callable, List, Tuple
 import logging
+import random
 import secrets
+import time
+from urllib.parse import urlparse
+
+from circuit_breaker import CircuitBreaker, get_circuit_breaker
+from config_renderer import ConfigRenderer
+from http_pool import HttpPool, get_http_pool
+from rate_limiter import PRIORITY_DEACTIVATE, PRIORITY_GRANT, PRIORITY_READ, RateLimiter, get_rate_limiter
 
 logger = logging.getLogger(__name__)
 
 class BlitzClient:
     """Client for Blitz Panel Hysteria2 management API"""
     
-    def __init__(self, base_url: str, api_token: str):
+    # Per-operation read timeouts (seconds): lookups should fail fast,
+    # mutations may legitimately take longer on a busy panel
+    DEFAULT_LOOKUP_TIMEOUT = 10.0
+    DEFAULT_MUTATE_TIMEOUT = 30.0
+    DEFAULT_CACHE_TTL = 15.0
+    MAX_CACHED_LOOKUPS = 10000
+
+    # Idempotent calls (GET/PUT/DELETE) are retried on transport errors and
+    # 429/5xx with full-jitter exponential backoff; POST is never retried
+    IDEMPOTENT_METHODS = ("GET", "PUT", "DELETE")
+    DEFAULT_RETRY_ATTEMPTS = 3
+    DEFAULT_RETRY_BASE_DELAY = 0.2
+    DEFAULT_RETRY_MAX_DELAY = 2.0
+
+    # Bulk operations fan out single calls under a concurrency limit. The Blitz
+    # API has no batch endpoints; a panel that adds some can have them
+    # configured per operation (see parse_batch_endpoints)
+    DEFAULT_BULK_CONCURRENCY = 16
+    DEFAULT_BULK_RETRIES = 2
+    BULK_RETRY_DELAY = 0.5
+    DEFAULT_PAGE_SIZE = 500
+    BATCH_OPERATIONS = ("create", "status", "delete")
+
+    def __init__(self, base_url: str, api_token: str, *, http: Optional[HttpPool] = None,
+                 lookup_timeout: float = DEFAULT_LOOKUP_TIMEOUT,
+                 mutate_timeout: float = DEFAULT_MUTATE_TIMEOUT,
+                 cache_ttl: float = DEFAULT_CACHE_TTL,
+                 breaker: Optional[CircuitBreaker] = None,
+                 retry_attempts: int = DEFAULT_RETRY_ATTEMPTS,
+                 retry_base_delay: float = DEFAULT_RETRY_BASE_DELAY,
+                 retry_max_delay: float = DEFAULT_RETRY_MAX_DELAY,
+                 renderer: Optional[ConfigRenderer] = None,
+                 limiter: Optional[RateLimiter] = None,
+                 batch_endpoints: Optional[Dict[str, str]] = None):
         self.base_url = base_url.rstrip('/')
         self.api_token = api_token
+        # hy2 URLs and client configs are rendered locally; without a renderer
+        # from the app, the panel host stands in for the public server address
+        self.renderer = renderer or ConfigRenderer(urlparse(self.base_url).hostname or "localhost")
+        # Shared keep-alive client, opened and closed by the app lifespan
+        self.http = http or get_http_pool("blitz")
+        self.lookup_timeout = lookup_timeout
+        self.mutate_timeout = mutate_timeout
+        # Shared with HealthMonitor and every other client of the same panel
+        self.breaker = breaker or get_circuit_breaker("blitz")
+        # Paces calls so bursts never crowd out the panel's Hysteria2 auth hook
+        self.limiter = limiter or get_rate_limiter("blitz")
+        self.retry_attempts = max(1, retry_attempts)
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        # Lookup cache: concurrent identical GETs share one in-flight request and
+        # the result is kept for `cache_ttl` seconds. Writes invalidate by
+        # bumping the generation, so a lookup that raced a write is not cached.
+        self.cache_ttl = cache_ttl
+        self._cache: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._generation = 0
+        self._cache_stats = {"hits": 0, "misses": 0, "coalesced": 0, "invalidations": 0}
+        # operation -> configured batch path; an operation whose path turns out
+        # to be missing from the panel is dropped
+        self.batch_endpoints: Dict[str, str] = dict(batch_endpoints or {})
 
     def _public_base_url(self) -> str:
         return self.base_url[:-4] if self.base_url.endswith("/api") else self.base_url
@@ -19,7 +88,17 @@ class BlitzClient:
         """Get authentication token from Blitz panel"""
         return self.api_token
                 
-    async def _make_request(self, method: str, endpoint: str, data: Dict = None) -> Dict[str, Any]:
+    @staticmethod
+    def _priority(method: str, endpoint: str, data: Optional[Dict]) -> int:
+        # Cutting access goes first; background reads wait behind grants
+        if method == "DELETE" or (data is not None and data.get("enable") is False):
+            return PRIORITY_DEACTIVATE
+        if method == "GET" and (endpoint.endswith("/stats") or endpoint.startswith("/users?")):
+            return PRIORITY_READ
+        return PRIORITY_GRANT
+
+    async def _make_request(self, method: str, endpoint: str, data: Dict = None,
+                            timeout: Optional[float] = None, priority: Optional[int] = None) -> Dict[str, Any]:
         """Make authenticated request to Blitz API"""
         token = await self._get_token()
         
@@ -29,34 +108,129 @@ class BlitzClient:
         }
         
         url = f"{self.base_url}{endpoint}"
-        
-        async with httpx.AsyncClient() as client:
+        if method not in ("GET", "POST", "PUT", "DELETE"):
+            raise ValueError(f"Unsupported method: {method}")
+        if timeout is None:
+            timeout = self.lookup_timeout if method == "GET" else self.mutate_timeout
+        attempts = self.retry_attempts if method in self.IDEMPOTENT_METHODS else 1
+        if priority is None:
+            priority = self._priority(method, endpoint, data)
+
+        for attempt in range(1, attempts + 1):
+            # Every attempt, retries included, takes a token
+            await self.limiter.acquire(priority)
+            # Fails fast with CircuitOpenError while the panel is known to be down
+            self.breaker.before_call()
             try:
-                if method == "GET":
-                    response = await client.get(url, headers=headers)
-                elif method == "POST":
-                    response = await client.post(url, json=data, headers=headers)
-                elif method == "PUT":
-                    response = await client.put(url, json=data, headers=headers)
-                elif method == "DELETE":
-                    response = await client.delete(url, headers=headers)
-                else:
-                    raise ValueError(f"Unsupported method: {method}")
-                    
+                response = await self.http.request(
+                    method, url, headers=headers, read_timeout=timeout,
+                    json=data if method in ("POST", "PUT") else None,
+                )
                 response.raise_for_status()
-                return response.json() if response.content else {}
-                
+                body = response.json() if response.content else {}
+                self.breaker.record_success()
+                return body
+
             except httpx.HTTPStatusError as e:
+                status = e.response.status_code
+                if status < 500:
+                    # The panel answered; a client error says nothing about its health
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+                if attempt < attempts and (status == 429 or status in (502, 503, 504)):
+                    await self._backoff(attempt, method, endpoint, f"status {status}")
+                    continue
                 logger.error(f"Blitz API error: {e.response.text}")
                 raise
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                if attempt < attempts:
+                    await self._backoff(attempt, method, endpoint, repr(e))
+                    continue
+                raise
+            except asyncio.CancelledError:
+                # The call was abandoned, not answered: free a half-open trial slot
+                self.breaker.release()
+                raise
+            except Exception:
+                # e.g. a reply that is not JSON: the panel is not healthy
+                self.breaker.record_failure()
+                raise
 
-    async def create_user(self, username: str, expiry_days: int = 0, data_limit_gb: int = 0) -> Dict[str, Any]:
-        """Create Hysteria2 user in Blitz panel"""
-        
-        # Generate Hysteria2 authentication key
-        auth_key = secrets.token_urlsafe(32)
+    async def _backoff(self, attempt: int, method: str, endpoint: str, reason: str):
+        # Full jitter keeps retries from many coroutines from arriving in lockstep
+        delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempt - 1)))
+        logger.warning(f"Blitz {method} {endpoint} failed ({reason}); retry {attempt} in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    async def _single_flight(self, key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._cache.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                self._cache_stats["hits"] += 1
+                return self._copy(entry[1])
+            del self._cache[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self._cache_stats["coalesced"] += 1
+        else:
+            self._cache_stats["misses"] += 1
+            generation = self._generation
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+
+            def _done(t: asyncio.Task):
+                self._inflight.pop(key, None)
+                if t.cancelled() or t.exception() is not None:
+                    return
+                if generation == self._generation:
+                    self._store(key, t.result())
+
+            task.add_done_callback(_done)
+        # shield: one cancelled caller must not cancel the request the others await
+        return self._copy(await asyncio.shield(task))
+
+    @staticmethod
+    def _copy(value: Any) -> Any:
+        # Callers get their own copy so they cannot mutate the cached user
+        return dict(value) if isinstance(value, dict) else value
+
+    def _store(self, key: str, value: Any):
+        if self.cache_ttl <= 0:
+            return
+        self._cache[key] = (time.monotonic() + self.cache_ttl, self._copy(value))
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.MAX_CACHED_LOOKUPS:
+            self._cache.popitem(last=False)
+
+    def invalidate(self, username: Optional[str] = None):
+        """Drop cached lookups for one user, or everything when no username is given."""
+        self._generation += 1
+        self._cache_stats["invalidations"] += 1
+        if username is None:
+            self._cache.clear()
+            return
+        for key in (f"/users/{username}", f"/users/{username}/stats"):
+            self._cache.pop(key, None)
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return {
+            **self._cache_stats,
+            "size": len(self._cache),
+            "in_flight": len(self._inflight),
+            "ttl_seconds": self.cache_ttl,
+        }
+
+    @staticmethod
+    def _new_user_payload(username: str, expiry_days: int = 0, data_limit_gb: int = 0,
+                          auth_key: Optional[str] = None) -> Dict[str, Any]:
+        # Generate Hysteria2 authentication key unless an existing one is being restored
+        auth_key = auth_key or secrets.token_urlsafe(32)
         
-        payload = {
+        return {
             "username": username,
             "auth_key": auth_key,
             "expiry_time": expiry_days * 24 * 60 * 60 if expiry_days > 0 else 0,  # Convert to seconds
@@ -64,57 +238,72 @@ class BlitzClient:
             "enable": True,
             "protocol": "hysteria2"
         }
-        
-        return await self._make_request("POST", "/users", payload)
+
+    def _remember_created(self, payload: Dict[str, Any], created: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        # Prime the lookup cache so the follow-up get_hy2_url costs no round trip
+        user = {**payload, **(created or {})}
+        self.invalidate(payload["username"])
+        self._store(f"/users/{payload['username']}", user)
+        return user
+
+    async def create_user(self, username: str, expiry_days: int = 0, data_limit_gb: int = 0,
+                          auth_key: Optional[str] = None) -> Dict[str, Any]:
+        """Create Hysteria2 user in Blitz panel"""
+        payload = self._new_user_payload(username, expiry_days, data_limit_gb, auth_key)
+        created = await self._make_request("POST", "/users", payload)
+        return self._remember_created(payload, created)
 
     async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
         """Get user information from Blitz panel"""
-        try:
-            users = await self._make_request("GET", f"/users/{username}")
-            return users if users else None
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 404:
-                return None
-            raise
+        async def load() -> Optional[Dict[str, Any]]:
+            try:
+                users = await self._make_request("GET", f"/users/{username}")
+                return users if users else None
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code == 404:
+                    return None
+                raise
 
-    async def get_user_config(self, username: str) -> Dict[str, Any]:
-        """Get Hysteria2 configuration for user"""
+        return await self._single_flight(f"/users/{username}", load)
+
+    async def _auth_key(self, username: str) -> str:
         user = await self.get_user(username)
         if not user:
             raise ValueError(f"User {username} not found")
-            
-        # Generate Hysteria2 configuration
-        config = {
-            "server": f"{self.base_url.replace('http://', '').replace('https://', '').split(':')[0]}:443",
-            "auth": user.get("auth_key", ""),
-            "tls": {
-                "sni": user.get("sni", "dl.google.com"),
-                "insecure": False
-            },
-            "bandwidth": {
-                "up": "100 mbps",
-                "down": "100 mbps"
-            },
-            "masquerade": {
-                "type": "proxy",
-                "proxy": {
-                    "url": "https://dl.google.com",
-                    "rewriteHost": True
-                }
-            },
-            "acl": {
-                "inline": [
-                    "# Corporate networks",
-                    "192.168.0.0/16",
-                    "10.0.0.0/8",
-                    "# Block other private networks",
-                    "!172.16.0.0/12",
-                    "*"
-                ]
-            }
-        }
-        
-        return config
+        return user.get("auth_key", "")
+
+    async def list_users(self, offset: int = 0, limit: int = DEFAULT_PAGE_SIZE) -> List[Dict[str, Any]]:
+        """One page of panel users. Not cached: used for full scans.
+
+        Raises ValueError for a payload that is not a user list, so a bad
+        listing is never mistaken for an empty panel.
+        """
+        data = await self._make_request("GET", f"/users?offset={offset}&limit={limit}")
+        if isinstance(data, dict):
+            data = next((data[field] for field in ("users", "items") if isinstance(data.get(field), list)), None)
+        if not isinstance(data, list):
+            raise ValueError("Unrecognised Blitz user listing")
+        return data
+
+    async def iter_user_pages(self, page_size: int = DEFAULT_PAGE_SIZE) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield every panel user, one page at a time."""
+        offset = 0
+        while True:
+            page = await self.list_users(offset, page_size)
+            if page:
+                yield page
+            if len(page) != page_size:
+                # A short page is the last one; a longer one means the panel ignores paging
+                return
+            offset += page_size
+
+    async def get_user_config(self, username: str) -> Dict[str, Any]:
+        """Get Hysteria2 configuration for user.
+
+        Prefer ConfigRenderer.render with the locally stored auth key; this
+        costs a (cached) panel lookup to find the key.
+        """
+        return self.renderer.render(username, await self._auth_key(username))
 
     async def delete_user(self, username: str) -> bool:
         """Delete user from Blitz panel"""
@@ -125,15 +314,23 @@ class BlitzClient:
             if e.response.status_code == 404:
                 return False
             raise
+        finally:
+            self.invalidate(username)
 
     async def update_user_status(self, username: str, enabled: bool) -> Dict[str, Any]:
         """Enable/disable user"""
         payload = {"enable": enabled}
-        return await self._make_request("PUT", f"/users/{username}/status", payload)
+        try:
+            return await self._make_request("PUT", f"/users/{username}/status", payload)
+        finally:
+            self.invalidate(username)
 
     async def get_user_stats(self, username: str) -> Dict[str, Any]:
         """Get user traffic statistics"""
-        return await self._make_request("GET", f"/users/{username}/stats")
+        return await self._single_flight(
+            f"/users/{username}/stats",
+            lambda: self._make_request("GET", f"/users/{username}/stats"),
+        )
 
     async def get_subscription_url(self, username: str) -> str:
         """Get subscription URL for user"""
@@ -141,12 +338,177 @@ class BlitzClient:
 
     async def get_hy2_url(self, username: str) -> str:
         """Get Hysteria2 URL for direct connection"""
-        user = await self.get_user(username)
-        if not user:
-            raise ValueError(f"User {username} not found")
-            
-        server_domain = self.base_url.replace('http://', '').replace('https://', '').split(':')[0]
-        auth_key = user.get("auth_key", "")
-        
-        # Generate hy2:// URL
-        return f"hy2://{auth_key}@{server_domain}:443/?sni=dl.google.com&insecure=0#CorporateVPN_{username}"
+        return self.renderer.hy2_url(username, await self._auth_key(username))
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code == 429 or error.response.status_code >= 500
+        return isinstance(error, httpx.TransportError)
+
+    async def _fan_out(self, items: List[str], op: Callable[[str], Awaitable[Dict[str, Any]]],
+                       concurrency: int, retries: int) -> AsyncIterator[Dict[str, Any]]:
+        """Run `op` per item under a semaphore and yield each item's final result
+        as soon as it is known. Only failed items are retried."""
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run(item: str) -> Dict[str, Any]:
+            attempts = 0
+            while True:
+                attempts += 1
+                async with semaphore:
+                    try:
+                        result = await op(item)
+                        return {"username": item, "ok": True, "attempts": attempts, "error": None, **result}
+                    except Exception as e:
+                        error = e
+                if attempts > retries or not self._is_retryable(error):
+                    return {"username": item, "ok": False, "attempts": attempts, "error": str(error)}
+                await asyncio.sleep(self.BULK_RETRY_DELAY * attempts)
+
+        tasks = [asyncio.ensure_future(run(item)) for item in dict.fromkeys(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # The consumer may stop early (e.g. a dropped streaming response)
+            for task in tasks:
+                task.cancel()
+
+    async def _try_batch(self, op: str, data: Dict[str, Any], idempotent: bool = True) -> bool:
+        """POST to the configured batch endpoint for `op`. Returns False when the
+        caller should fall back to single calls.
+
+        A missing route (404/405/501) never reached a handler, so falling back
+        is always safe. Any other failure may have been partly applied: for a
+        non-idempotent operation the error is raised instead of falling back.
+        """
+        endpoint = self.batch_endpoints.get(op)
+        if endpoint is None:
+            return False
+        try:
+            await self._make_request("POST", endpoint, data)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in (404, 405, 501):
+                logger.warning(f"Blitz has no batch endpoint {endpoint}; using concurrent single calls")
+                self.batch_endpoints.pop(op, None)
+                return False
+            if not idempotent:
+                raise
+            logger.warning(f"Blitz batch {op} failed ({e.response.status_code}); using single calls")
+            return False
+        except httpx.TransportError as e:
+            if not idempotent:
+                raise
+            logger.warning(f"Blitz batch {op} failed ({e}); using single calls")
+            return False
+        return True
+
+    async def bulk_create_users(self, usernames: List[str], expiry_days: int = 0, data_limit_gb: int = 0,
+                                concurrency: int = DEFAULT_BULK_CONCURRENCY,
+                                retries: int = DEFAULT_BULK_RETRIES,
+                                auth_keys: Optional[Dict[str, str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Make sure every username exists in the panel, yielding one result per user
+        as it completes: {username, ok, created, user, error, attempts}.
+
+        Existing users are found through the (coalesced, cached) lookup and left
+        untouched; only the missing ones are created, with the key from
+        `auth_keys` when one is given for them. A failed create is checked
+        with a lookup before it is retried, so a POST is never repeated for a
+        user the panel already has.
+        """
+        async def lookup(username: str) -> Dict[str, Any]:
+            return {"user": await self.get_user(username)}
+
+        missing = []
+        async for result in self._fan_out(usernames, lookup, concurrency, retries):
+            if result["ok"] and result["user"] is None:
+                missing.append(result["username"])
+            else:
+                yield {**result, "created": False}
+        if not missing:
+            return
+
+        auth_keys = auth_keys or {}
+        payloads = {u: self._new_user_payload(u, expiry_days, data_limit_gb, auth_keys.get(u)) for u in missing}
+        try:
+            batched = await self._try_batch("create", {"users": list(payloads.values())}, idempotent=False)
+        except httpx.HTTPError as e:
+            # Some users may exist now; the next lookup or reconciliation finds them
+            for username in missing:
+                self.invalidate(username)
+                yield {"username": username, "ok": False, "attempts": 1, "error": str(e),
+                       "created": False, "user": None}
+            return
+        if batched:
+            for payload in payloads.values():
+                user = self._remember_created(payload, None)
+                yield {"username": payload["username"], "ok": True, "attempts": 1, "error": None,
+                       "created": True, "user": user}
+            return
+
+        async def create(username: str) -> Dict[str, Any]:
+            try:
+                created = await self._make_request("POST", "/users", payloads[username])
+            except httpx.HTTPError:
+                # The POST may have been applied with its reply lost, or another
+                # caller created the user first: a user that exists now is done.
+                # Only a confirmed-missing user goes back to _fan_out for a retry.
+                self.invalidate(username)
+                user = await self.get_user(username)
+                if user is None:
+                    raise
+                return {"created": True, "user": user}
+            return {"created": True, "user": self._remember_created(payloads[username], created)}
+
+        async for result in self._fan_out(missing, create, concurrency, retries):
+            yield {"created": False, "user": None, **result}
+
+    async def bulk_set_status(self, usernames: List[str], enabled: bool,
+                              concurrency: int = DEFAULT_BULK_CONCURRENCY,
+                              retries: int = DEFAULT_BULK_RETRIES) -> AsyncIterator[Dict[str, Any]]:
+        """Enable or disable many users, yielding {username, ok, error, attempts} per user."""
+        usernames = list(dict.fromkeys(usernames))
+        if await self._try_batch("status", {"usernames": usernames, "enable": enabled}):
+            for username in usernames:
+                self.invalidate(username)
+                yield {"username": username, "ok": True, "attempts": 1, "error": None}
+            return
+
+        async def set_status(username: str) -> Dict[str, Any]:
+            await self.update_user_status(username, enabled)
+            return {}
+
+        async for result in self._fan_out(usernames, set_status, concurrency, retries):
+            yield result
+
+    async def bulk_delete(self, usernames: List[str], concurrency: int = DEFAULT_BULK_CONCURRENCY,
+                          retries: int = DEFAULT_BULK_RETRIES) -> AsyncIterator[Dict[str, Any]]:
+        """Delete many users, yielding {username, ok, deleted, error, attempts} per user.
+        A user that was already gone counts as ok with deleted=False."""
+        usernames = list(dict.fromkeys(usernames))
+        if await self._try_batch("delete", {"usernames": usernames}):
+            for username in usernames:
+                self.invalidate(username)
+                yield {"username": username, "ok": True, "deleted": True, "attempts": 1, "error": None}
+            return
+
+        async def delete(username: str) -> Dict[str, Any]:
+            return {"deleted": await self.delete_user(username)}
+
+        async for result in self._fan_out(usernames, delete, concurrency, retries):
+            yield {"deleted": False, **result}
+
+
+def parse_batch_endpoints(spec: str) -> Dict[str, str]:
+    """BLITZ_BATCH_ENDPOINTS: a JSON object mapping bulk operations (create,
+    status, delete) to panel paths, e.g. {"status": "/users/bulk/status"}."""
+    endpoints = json.loads(spec) if spec.strip() else {}
+    if not isinstance(endpoints, dict):
+        raise ValueError("BLITZ_BATCH_ENDPOINTS must be a JSON object")
+    for op, path in endpoints.items():
+        if op not in BlitzClient.BATCH_OPERATIONS:
+            raise ValueError(f"Unknown Blitz batch operation: {op}")
+        if not isinstance(path, str) or not path.startswith("/"):
+            raise ValueError(f"Blitz batch endpoint for {op} must be a path: {path}")
+    return endpoints
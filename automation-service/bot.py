@@ -3,14 +3,14 @@ from aiogram.filters import Command
 from aiogram.types import Message
 import logging
 from config import get_settings
-from database import Database
+from database import get_database
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
 bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
 dp = Dispatcher()
-db = Database(settings.DB_PATH)
+db = get_database(settings.DB_PATH)
 
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
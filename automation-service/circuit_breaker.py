@@ -0,0 +1,129 @@
+import logging
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+DEFAULT_HALF_OPEN_MAX_CALLS = 1
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose breaker is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one backend.
+
+    After `failure_threshold` consecutive failures the breaker opens and calls
+    fail immediately with CircuitOpenError. Once `reset_timeout` has passed it
+    goes half-open and lets `half_open_max_calls` trial calls through: a success
+    closes it, a failure opens it again. A trial that ends without an outcome
+    (e.g. cancelled) must hand its slot back with release(), or the breaker
+    rejects every call from then on. HealthMonitor feeds its probe results
+    into the same breaker, so failed probes count toward the threshold too.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout: float = DEFAULT_RESET_TIMEOUT,
+                 half_open_max_calls: int = DEFAULT_HALF_OPEN_MAX_CALLS):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._stats = {"opened": 0, "rejected": 0, "successes": 0, "failures": 0}
+
+    def configure(self, failure_threshold: Optional[int] = None, reset_timeout: Optional[float] = None,
+                  half_open_max_calls: Optional[int] = None):
+        if failure_threshold is not None:
+            self.failure_threshold = max(1, failure_threshold)
+        if reset_timeout is not None:
+            self.reset_timeout = reset_timeout
+        if half_open_max_calls is not None:
+            self.half_open_max_calls = max(1, half_open_max_calls)
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._half_open_calls = 0
+            logger.info(f"Circuit for {self.name} half-open, allowing trial calls")
+        return self._state
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call must not go out right now."""
+        state = self.state
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+            self._half_open_calls += 1
+            return
+        self._stats["rejected"] += 1
+        raise CircuitOpenError(self.name, self.retry_after())
+
+    def release(self):
+        """Give back the trial slot of a call that ended with neither success nor failure."""
+        if self._state == HALF_OPEN and self._half_open_calls > 0:
+            self._half_open_calls -= 1
+
+    def record_success(self):
+        self._stats["successes"] += 1
+        if self._state != CLOSED:
+            logger.info(f"Circuit for {self.name} closed")
+        self._state = CLOSED
+        self._failures = 0
+
+    def record_failure(self):
+        self._stats["failures"] += 1
+        self._failures += 1
+        if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+            self.trip()
+
+    def trip(self):
+        """Open the breaker now, regardless of the failure count."""
+        if self._state != OPEN:
+            self._stats["opened"] += 1
+            logger.warning(f"Circuit for {self.name} opened after {self._failures} failures")
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        state = self.state
+        return {
+            "state": state,
+            "consecutive_failures": self._failures,
+            "retry_after": round(self.retry_after(), 3) if state == OPEN else 0.0,
+            **self._stats,
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Process-wide breaker per backend, shared by its clients and HealthMonitor."""
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(name)
+    return _breakers[name]
+
+
+def circuit_breaker_stats() -> Dict[str, Any]:
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
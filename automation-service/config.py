@@ -7,6 +7,35 @@ class Settings(BaseSettings):
     BLITZ_ADMIN_USERNAME: str = "admin"
     BLITZ_ADMIN_PASSWORD: str
     BLITZ_SECRET_KEY: str = "your-secret-key-here"
+    BLITZ_LOOKUP_TIMEOUT: float = 10.0
+    BLITZ_MUTATE_TIMEOUT: float = 30.0
+    # Panel lookups are coalesced and cached this long; writes invalidate them
+    BLITZ_CACHE_TTL_SECONDS: float = 15.0
+    # Concurrent panel calls per bulk grant/deactivate request
+    BLITZ_BULK_CONCURRENCY: int = 16
+    # Total attempts for idempotent panel calls (GET/PUT/DELETE)
+    BLITZ_RETRY_ATTEMPTS: int = 3
+    # Panel batch endpoints as a JSON object, e.g. {"status": "/users/bulk/status"}
+    # (see blitz_client.parse_batch_endpoints); empty uses single calls only
+    BLITZ_BATCH_ENDPOINTS: str = ""
+    # Consecutive failures that open the breaker, and how long it stays open
+    BLITZ_BREAKER_FAILURE_THRESHOLD: int = 5
+    BLITZ_BREAKER_RESET_SECONDS: float = 30.0
+    # Outbound pacing per panel (0 disables): deactivations go first, then
+    # grants, then stats reads. Only deactivations queue past MAX_QUEUE.
+    BLITZ_RATE_LIMIT_PER_SECOND: float = 50.0
+    BLITZ_RATE_LIMIT_BURST: int = 20
+    BLITZ_RATE_LIMIT_MAX_QUEUE: int = 1000
+
+    # Outbound HTTP: one shared keep-alive client per panel backend
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE: int = 20
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP_READ_TIMEOUT: float = 15.0
+    # Needs the h2 package (httpx[http2] in requirements.txt); without it the
+    # pools log a warning and stay on HTTP/1.1
+    HTTP2_ENABLED: bool = False
     
     # Telegram Configuration
     TELEGRAM_BOT_TOKEN: str
@@ -15,16 +44,81 @@ class Settings(BaseSettings):
     # Corporate Security
     CORPORATE_SECRET: str
     WEBHOOK_SECRET: str = "your-webhook-secret"
+    WEBHOOK_MAX_ATTEMPTS: int = 5
     
     # Domain Configuration
     DOMAIN: str = "your-domain.com"
     
     # Database Configuration
     DB_PATH: str = "/app/data/users.db"
+    # Logs, traffic history and webhook events; empty means <DB_PATH stem>_telemetry.db
+    TELEMETRY_DB_PATH: str = ""
+    DB_POOL_READERS: int = 4
+    DB_MMAP_SIZE: int = 256 * 1024 * 1024
+    DB_CACHE_SIZE_KB: int = 16 * 1024
+    DB_WRITE_BATCH_SIZE: int = 500
+    DB_WRITE_BATCH_MS: int = 50
+    DB_WRITE_QUEUE_SIZE: int = 10000
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL_SECONDS: float = 60.0
+
+    # QR codes: in-memory LRU entries, optional PNG cache directory (e.g.
+    # /app/data/qr; empty disables it) and the pool that renders misses
+    QR_CACHE_SIZE: int = 1000
+    QR_CACHE_DIR: str = ""
+    QR_RENDER_WORKERS: int = 2
+    QR_RENDER_EXECUTOR: str = "thread"
+    # Every cached image holds an auth key: the retention run deletes files
+    # older than this and the oldest ones beyond the size limit (0 disables)
+    QR_CACHE_MAX_AGE_DAYS: int = 30
+    QR_CACHE_MAX_MB: int = 512
+
+    # How long /access/grant replays a response stored under an Idempotency-Key
+    IDEMPOTENCY_TTL_SECONDS: int = 86400
+
+    # Retention (days, 0 keeps rows forever)
+    RETENTION_AUTH_LOGS_DAYS: int = 180
+    RETENTION_MONITOR_EVENTS_DAYS: int = 30
+    RETENTION_TRAFFIC_STATS_DAYS: int = 90
+    # Hourly rollups outlive the raw samples; daily rollups are kept forever
+    RETENTION_TRAFFIC_HOURLY_DAYS: int = 400
+    RETENTION_WEBHOOK_EVENTS_DAYS: int = 30
+    RETENTION_INTERVAL_SECONDS: int = 3600
+    RETENTION_CHUNK_SIZE: int = 500
+
+    # Users table <-> Blitz reconciliation (0 disables the periodic pass)
+    RECONCILE_INTERVAL_SECONDS: int = 3600
+    RECONCILE_PAGE_SIZE: int = 500
+    RECONCILE_CONCURRENCY: int = 16
+    # Only report drift from the periodic pass, without repairing it
+    RECONCILE_DRY_RUN: bool = True
+    # Refuse to apply a plan restoring more than this share of local users to the panel
+    RECONCILE_MAX_RESTORE_FRACTION: float = 0.25
     
     # Hysteria2 Configuration
     HYSTERIA2_PORT: int = 443
     HYSTERIA2_SERVER: str = "your-domain.com:443"
+    # trafficStats API of the Hysteria2 server, e.g. http://127.0.0.1:9090 (empty: use Blitz stats)
+    HYSTERIA2_TRAFFIC_URL: str = ""
+    HYSTERIA2_TRAFFIC_SECRET: str = ""
+    TRAFFIC_SYNC_INTERVAL_SECONDS: int = 300
+    TRAFFIC_SYNC_CONCURRENCY: int = 8
+    # Client configs are rendered locally for DOMAIN:HYSTERIA2_PORT from configs/ templates
+    HYSTERIA2_SNI: str = "dl.google.com"
+    HYSTERIA2_UPLOAD_SPEED: str = "100 mbps"
+    HYSTERIA2_DOWNLOAD_SPEED: str = "100 mbps"
+    # Empty means configs/ next to the code or at the repository root
+    CONFIG_TEMPLATES_DIR: str = ""
+    CONFIG_CACHE_SIZE: int = 10000
+
+    # Fleet: JSON list of panel nodes (see fleet.parse_nodes); empty means one
+    # node for BLITZ_API_URL serving DOMAIN:HYSTERIA2_PORT
+    FLEET_NODES: str = ""
+    # Nodes each new user is created on: the least-loaded one plus failover replicas
+    FLEET_REPLICAS: int = 2
+    FLEET_LOAD_TTL_SECONDS: float = 60.0
+    FLEET_REBALANCE_THRESHOLD: float = 0.25
+    FLEET_REBALANCE_MAX_MOVES: int = 100
     
     # WireGuard Configuration
     WIREGUARD_ENDPOINT: str = "office.example.com:51820"
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# Client config templates under configs/, by the name clients ask for
+TEMPLATE_FILES = {
+    "hysteria2": "hysteria2_client_template.json",
+    "singbox": "singbox_hysteria2_template.json",
+}
+DEFAULT_TEMPLATE = "hysteria2"
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_SNI = "dl.google.com"
+DEFAULT_SPEED = "100 mbps"
+
+PLACEHOLDER = re.compile(r"\{\{(\w+)\}\}")
+SPEED = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmg]?)bps\s*$", re.IGNORECASE)
+MBPS_PER_UNIT = {"k": 0.001, "": 0.000001, "m": 1, "g": 1000}
+
+
+def speed_mbps(speed: str) -> Optional[int]:
+    """Whole Mbit/s for a Hysteria2 bandwidth string like "100 mbps"; None if unparseable."""
+    match = SPEED.match(speed)
+    if not match:
+        return None
+    return max(1, round(float(match.group(1)) * MBPS_PER_UNIT[match.group(2).lower()]))
+
+
+def default_templates_dir() -> str:
+    """configs/ next to the code (Docker mount) or at the repository root."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    for candidate in (os.path.join(here, "configs"), os.path.join(here, os.pardir, "configs")):
+        if os.path.isdir(candidate):
+            return os.path.normpath(candidate)
+    return os.path.join(here, "configs")
+
+
+class CompiledTemplate:
+    """A JSON template split once into literal text and placeholder slots."""
+
+    def __init__(self, name: str, source: str):
+        json.loads(source)  # fail at startup, not on the first request
+        self.name = name
+        self.version = hashlib.sha256(source.encode()).hexdigest()[:16]
+        # Even indexes are literal text, odd indexes placeholder names
+        self.parts: List[str] = PLACEHOLDER.split(source)
+        self.placeholders = sorted(set(self.parts[1::2]))
+
+    def render(self, values: Dict[str, str]) -> str:
+        parts = list(self.parts)
+        for i in range(1, len(parts), 2):
+            # Placeholders sit inside JSON strings, so escape without the quotes
+            parts[i] = json.dumps(values.get(parts[i], ""))[1:-1]
+        return "".join(parts)
+
+
+class ConfigRenderer:
+    """Renders hy2:// URLs and client configs from local data.
+
+    Templates are parsed once by load(); the server address and TLS settings
+    are fixed at construction. Rendered output is memoized per user, auth key
+    and template version in a bounded LRU, so repeated config requests cost a
+    dict lookup and never a panel round trip.
+    """
+
+    def __init__(self, host: str, port: int = 443, sni: str = DEFAULT_SNI,
+                 upload_speed: str = DEFAULT_SPEED, download_speed: str = DEFAULT_SPEED,
+                 templates_dir: Optional[str] = None, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.host = host
+        self.port = port
+        self.sni = sni
+        self.upload_speed = upload_speed
+        self.download_speed = download_speed
+        self.templates_dir = templates_dir or default_templates_dir()
+        self.cache_size = max(0, cache_size)
+
+        self.templates: Dict[str, CompiledTemplate] = {}
+        self._cache: "OrderedDict[Tuple[str, ...], Tuple[str, Any]]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0}
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def load(self) -> Dict[str, str]:
+        """(Re)read every template; returns name -> version. Clears memoized output."""
+        templates = {}
+        for name, filename in TEMPLATE_FILES.items():
+            path = os.path.join(self.templates_dir, filename)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    templates[name] = CompiledTemplate(name, f.read())
+            except FileNotFoundError:
+                logger.warning(f"Config template {path} not found; {name} configs are unavailable")
+        self.templates = templates
+        self._cache.clear()
+        logger.info(f"Loaded config templates from {self.templates_dir}: {', '.join(templates) or 'none'}")
+        return {name: t.version for name, t in templates.items()}
+
+    def _template(self, name: str) -> CompiledTemplate:
+        if not self.templates:
+            self.load()
+        template = self.templates.get(name)
+        if template is None:
+            raise ValueError(f"Unknown config template: {name}")
+        return template
+
+    def _values(self, template: str, auth_key: str, host: str, port: int) -> Dict[str, str]:
+        return {
+            # sing-box takes the port in a separate server_port field
+            "server": host if template == "singbox" else f"{host}:{port}",
+            "auth_key": auth_key,
+            "sni": self.sni,
+            "upload_speed": self.upload_speed,
+            "download_speed": self.download_speed,
+        }
+
+    def _set_singbox_numbers(self, config: Dict[str, Any], port: int):
+        up, down = speed_mbps(self.upload_speed), speed_mbps(self.download_speed)
+        for outbound in config.get("outbounds", []):
+            if outbound.get("type") != "hysteria2":
+                continue
+            outbound["server_port"] = port
+            if up is not None:
+                outbound["up_mbps"] = up
+            if down is not None:
+                outbound["down_mbps"] = down
+
+    def _memoized(self, key: Tuple[str, ...], build):
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self._stats["hits"] += 1
+            return cached
+        self._stats["misses"] += 1
+        value = build()
+        if self.cache_size:
+            self._cache[key] = value
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return value
+
+    def hy2_url(self, username: str, auth_key: str, host: Optional[str] = None, port: Optional[int] = None,
+                label: str = "") -> str:
+        """hy2:// URL for the default server, or for `host`:`port` of another fleet node.
+
+        `label` is appended to the entry name so several servers in one
+        subscription stay distinguishable.
+        """
+        host, port = host or self.host, port or self.port
+
+        def build():
+            name = f"CorporateVPN_{username}" + (f"_{label}" if label else "")
+            return (f"hy2://{quote(auth_key, safe='')}@{host}:{port}/"
+                    f"?sni={quote(self.sni)}&insecure=0#{quote(name)}")
+
+        return self._memoized(("hy2", username, auth_key, host, str(port), label), build)
+
+    def render_text(self, username: str, auth_key: str, template: str = DEFAULT_TEMPLATE,
+                    host: Optional[str] = None, port: Optional[int] = None) -> str:
+        """The rendered config as JSON text, e.g. for a file download."""
+        return self._render(username, auth_key, template, host, port)[0]
+
+    def render(self, username: str, auth_key: str, template: str = DEFAULT_TEMPLATE,
+               host: Optional[str] = None, port: Optional[int] = None) -> Dict[str, Any]:
+        """The rendered config as a dict. Shared between callers; do not mutate it."""
+        return self._render(username, auth_key, template, host, port)[1]
+
+    def _render(self, username: str, auth_key: str, template: str,
+                host: Optional[str], port: Optional[int]) -> Tuple[str, Any]:
+        compiled = self._template(template)
+        host, port = host or self.host, port or self.port
+
+        def build():
+            text = compiled.render(self._values(template, auth_key, host, port))
+            config = json.loads(text)
+            if template == "singbox":
+                # Numeric fields cannot hold string placeholders; set them on the parsed config
+                self._set_singbox_numbers(config, port)
+                text = json.dumps(config, indent=2, ensure_ascii=False)
+            return text, config
+
+        return self._memoized((template, compiled.version, username, auth_key, host, str(port)), build)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "size": len(self._cache),
+            "max_size": self.cache_size,
+            "templates": {name: t.version for name, t in self.templates.items()},
+        }
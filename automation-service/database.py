@@ -1,140 +1,272 @@
-import aiosqlite
-from pathlib import Path
+import base64
+import json
+import logging
+import os
+import sqlite3
+import uuid
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from functools import lru_cache
+from itertools import islice
+from typing import Optional, Dict, Any, AsyncIterator, Iterable, List, Tuple
+
+from db_pool import ConnectionPool, DEFAULT_READERS, DEFAULT_MMAP_SIZE, DEFAULT_CACHE_SIZE_KB
+from id_index import IssuedIdIndex, generate_corporate_id
+from migrations import (
+    HOT_SCHEMA, MIGRATIONS, TELEMETRY_MIGRATIONS, TELEMETRY_SCHEMA, apply_migrations, backfill_traffic_rollups,
+)
+from user_cache import UserCache, DEFAULT_MAX_SIZE as DEFAULT_USER_CACHE_SIZE, DEFAULT_TTL_SECONDS as DEFAULT_USER_CACHE_TTL
+from write_behind import WriteBehindQueue
+
+logger = logging.getLogger(__name__)
+
+ID_STATUSES = ("issued", "active", "revoked", "archived")
+
+# Tables available to the streaming export API, mapped to their time column
+EXPORT_TABLES = {"auth_logs": "created_at", "traffic_stats": "timestamp"}
+
+def _encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def _decode_cursor(cursor: str) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid search cursor")
+    if not isinstance(values, list) or len(values) != 3:
+        raise ValueError("Invalid search cursor")
+    return values
+
+def _chunked(items: Iterable, size: int) -> Iterable[List]:
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def purge_sql(table: str, time_column: str, extra_where: str = "", key: str = "rowid") -> str:
+    """One retention chunk: the oldest rows past a ('-N days', limit) cutoff.
+
+    `key` names the columns that identify a row, e.g. the primary key of a
+    WITHOUT ROWID table.
+    """
+    condition = f"{time_column} < datetime('now', ?)"
+    if extra_where:
+        condition += f" AND {extra_where}"
+    return f"""
+        DELETE FROM {table}
+        WHERE ({key}) IN (
+            SELECT {key} FROM {table} WHERE {condition} ORDER BY {time_column} LIMIT ?
+        )
+    """
+
+# Rollup reads: (corporate_id, days) and (corporate_id, hours)
+TRAFFIC_DAILY_SQL = """
+    SELECT day as date,
+           upload_bytes as total_upload,
+           download_bytes as total_download,
+           samples as connection_count
+    FROM traffic_daily
+    WHERE corporate_id = ? AND day >= date('now', '-' || ? || ' days')
+    ORDER BY day DESC
+"""
+
+TRAFFIC_HOURLY_SQL = """
+    SELECT hour,
+           upload_bytes as total_upload,
+           download_bytes as total_download,
+           samples as connection_count
+    FROM traffic_hourly
+    WHERE corporate_id = ? AND hour >= strftime('%Y-%m-%d %H:00:00', 'now', '-' || ? || ' hours')
+    ORDER BY hour DESC
+"""
+
+def search_ids_sql(query: str, after: Optional[List[Any]] = None) -> Tuple[str, List[Any]]:
+    """One page of search_ids_page, ending in LIMIT ?; the caller appends the limit."""
+    query = query.strip()
+    if query.lower() in ID_STATUSES:
+        # Every row of a status matches equally, so page newest-first on
+        # the (status, issued_at) index instead of ranking
+        sql = """
+            SELECT *, rowid AS _rowid, 0 AS _tier, issued_at AS _rank
+            FROM id_registry WHERE status = ?
+        """
+        params: List[Any] = [query.lower()]
+        if after:
+            sql += " AND (issued_at, rowid) < (?, ?)"
+            params.extend(after[1:])
+        sql += " ORDER BY issued_at DESC, rowid DESC LIMIT ?"
+        return sql, params
+
+    if len(query) >= 3:
+        # Quoted so the trigram tokenizer does a plain substring match
+        sql = """
+            SELECT r.*, r.rowid AS _rowid,
+                   CASE WHEN r.id = upper(?) THEN 0
+                        WHEN r.id LIKE ? || '%' THEN 1
+                        ELSE 2 END AS _tier,
+                   bm25(id_registry_fts) AS _rank
+            FROM id_registry_fts
+            JOIN id_registry r ON r.rowid = id_registry_fts.rowid
+            WHERE id_registry_fts MATCH ?
+        """
+        params = [query, query, '"' + query.replace('"', '""') + '"']
+    else:
+        # Trigrams need 3 characters; shorter input is an ID prefix range scan
+        prefix = query.upper()
+        sql = """
+            SELECT *, rowid AS _rowid, 1 AS _tier, 0.0 AS _rank
+            FROM id_registry WHERE id >= ? AND id < ?
+        """
+        params = [prefix, prefix + "\uffff"]
+
+    sql = f"SELECT * FROM ({sql})"
+    if after:
+        sql += " WHERE (_tier, _rank, _rowid) > (?, ?, ?)"
+        params.extend(after)
+    sql += " ORDER BY _tier, _rank, _rowid LIMIT ?"
+    return sql, params
+
+def telemetry_path_for(db_path: str) -> str:
+    """Default telemetry file next to the main one: users.db -> users_telemetry.db."""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_telemetry{ext or '.db'}"
+
 
 class Database:
-    def __init__(self, db_path: str):
+    """Users and the ID registry live in `db_path` (the hot file, `self.pool`);
+    logs, traffic history, webhook events and the ID audit trail live in a
+    separate telemetry file (`self.telemetry_pool`). Each file has its own
+    writer, and each is ATTACHed to the other's connections for cross-file reads.
+    """
+
+    def __init__(self, db_path: str, readers: int = DEFAULT_READERS,
+                 mmap_size: int = DEFAULT_MMAP_SIZE, cache_size_kb: int = DEFAULT_CACHE_SIZE_KB,
+                 user_cache_size: int = DEFAULT_USER_CACHE_SIZE,
+                 user_cache_ttl: float = DEFAULT_USER_CACHE_TTL,
+                 telemetry_db_path: Optional[str] = None):
         self.db_path = db_path
+        self.telemetry_db_path = telemetry_db_path or telemetry_path_for(db_path)
+        self.pool = ConnectionPool(db_path, readers=readers, mmap_size=mmap_size,
+                                   cache_size_kb=cache_size_kb,
+                                   attach={TELEMETRY_SCHEMA: self.telemetry_db_path})
+        self.telemetry_pool = ConnectionPool(self.telemetry_db_path, readers=readers, mmap_size=mmap_size,
+                                             cache_size_kb=cache_size_kb,
+                                             attach={HOT_SCHEMA: db_path})
+        # Append-only log inserts are batched instead of committed one by one
+        self.write_behind = WriteBehindQueue(self.telemetry_pool)
+        self.user_cache = UserCache(user_cache_size, user_cache_ttl)
+        self.issued_ids = IssuedIdIndex()
 
-    async def init_db(self):
-        # Ensure directory exists
-        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
-        
-        async with aiosqlite.connect(self.db_path) as db:
-            # Users table - updated for Hysteria2
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    corporate_id TEXT PRIMARY KEY,
-                    blitz_username TEXT,
-                    hy2_auth_key TEXT,
-                    subscription_url TEXT,
-                    hy2_url TEXT,
-                    telegram_id TEXT UNIQUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT 1,
-                    last_access TIMESTAMP,
-                    auth_attempts INTEGER DEFAULT 0,
-                    locked_until TIMESTAMP,
-                    total_upload BIGINT DEFAULT 0,
-                    total_download BIGINT DEFAULT 0
-                )
-            """)
-            
-            # Authentication logs table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS auth_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    corporate_id TEXT,
-                    telegram_id TEXT,
-                    action TEXT,
-                    ip_address TEXT,
-                    user_agent TEXT,
-                    success BOOLEAN,
-                    error_message TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (corporate_id) REFERENCES users(corporate_id)
-                )
-            """)
-            
-            # Webhook events table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS webhook_events (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    event_type TEXT,
-                    corporate_id TEXT,
-                    event_data TEXT,
-                    processed BOOLEAN DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    processed_at TIMESTAMP
-                )
-            """)
-            
-            # Traffic statistics table
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS traffic_stats (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    corporate_id TEXT,
-                    username TEXT,
-                    upload_bytes BIGINT,
-                    download_bytes BIGINT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (corporate_id) REFERENCES users(corporate_id)
-                )
-            """)
+    async def connect(self, readers: Optional[int] = None, mmap_size: Optional[int] = None,
+                      cache_size_kb: Optional[int] = None, write_batch_size: Optional[int] = None,
+                      write_batch_ms: Optional[int] = None, write_queue_size: Optional[int] = None,
+                      user_cache_size: Optional[int] = None, user_cache_ttl: Optional[float] = None,
+                      telemetry_db_path: Optional[str] = None):
+        """Open both connection pools. Methods also open them lazily on first use."""
+        if telemetry_db_path and not self.pool.is_open and not self.telemetry_pool.is_open:
+            self.telemetry_db_path = telemetry_db_path
+            self.telemetry_pool.db_path = telemetry_db_path
+            self.pool.attach[TELEMETRY_SCHEMA] = telemetry_db_path
+        for pool in (self.pool, self.telemetry_pool):
+            if pool.is_open:
+                continue
+            if readers is not None:
+                pool.readers = max(1, readers)
+            if mmap_size is not None:
+                pool.mmap_size = mmap_size
+            if cache_size_kb is not None:
+                pool.cache_size_kb = cache_size_kb
+        if write_batch_size is not None:
+            self.write_behind.batch_size = max(1, write_batch_size)
+        if write_batch_ms is not None:
+            self.write_behind.batch_ms = max(0, write_batch_ms)
+        if write_queue_size is not None:
+            self.write_behind.queue_size = max(1, write_queue_size)
+        if user_cache_size is not None:
+            self.user_cache.max_size = user_cache_size
+        if user_cache_ttl is not None:
+            self.user_cache.ttl_seconds = user_cache_ttl
+        await self.telemetry_pool.open()
+        await self.pool.open()
 
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS monitor_events (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    component TEXT,
-                    level TEXT,
-                    message TEXT,
-                    details TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+    async def close(self):
+        await self.write_behind.close()
+        await self.pool.close()
+        await self.telemetry_pool.close()
 
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS id_registry (
-                    id TEXT PRIMARY KEY,
-                    owner TEXT,
-                    status TEXT CHECK(status IN ('issued','active','revoked','archived')) DEFAULT 'issued',
-                    issued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP
-                )
-            """)
+    async def flush(self):
+        """Commit every queued write-behind row."""
+        await self.write_behind.flush()
 
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS id_audit (
-                    audit_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    id TEXT,
-                    action TEXT,
-                    actor TEXT,
-                    details TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY(id) REFERENCES id_registry(id)
-                )
-            """)
-            
-            await db.commit()
+    def pool_stats(self) -> Dict[str, Any]:
+        return {
+            **self.pool.stats(),
+            "telemetry": self.telemetry_pool.stats(),
+            "write_behind": self.write_behind.stats(),
+        }
+
+    async def init_db(self):
+        """Apply pending schema migrations, flush the traffic outbox and load the issued-ID index."""
+        # The telemetry schema must exist before the hot file moves its old
+        # telemetry tables across (hot migration 7)
+        await apply_migrations(self.telemetry_pool, TELEMETRY_MIGRATIONS)
+        await apply_migrations(self.pool, MIGRATIONS)
+        # Samples a crash left between the two files
+        await self.flush_traffic_outbox()
+        await self.load_issued_ids()
+
+    async def load_issued_ids(self):
+        self.issued_ids.reset()
+        async with self.pool.read() as db:
+            async with db.execute("SELECT id FROM id_registry") as cursor:
+                while True:
+                    rows = await cursor.fetchmany(10000)
+                    if not rows:
+                        break
+                    self.issued_ids.update(row[0] for row in rows)
 
     async def add_user(self, corporate_id: str, blitz_username: str, subscription_url: str, 
                       hy2_url: str, hy2_auth_key: str, telegram_id: Optional[str] = None):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             await db.execute("""
                 INSERT OR REPLACE INTO users (corporate_id, blitz_username, hy2_auth_key, 
                 subscription_url, hy2_url, telegram_id, created_at, is_active)
                 VALUES (?, ?, ?, ?, ?, ?, ?, 1)
             """, (corporate_id, blitz_username, hy2_auth_key, subscription_url, hy2_url, 
                   telegram_id, datetime.now()))
-            await db.commit()
+        self.user_cache.invalidate(corporate_id, telegram_id)
 
     async def get_user(self, corporate_id: str) -> Optional[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        cached = self.user_cache.get(corporate_id)
+        if cached is not None:
+            return cached
+        generation = self.user_cache.generation
+        async with self.pool.read() as db:
             async with db.execute("SELECT * FROM users WHERE corporate_id = ?", (corporate_id,)) as cursor:
                 row = await cursor.fetchone()
-                return dict(row) if row else None
+        if not row:
+            return None
+        user = dict(row)
+        self.user_cache.put(user, generation)
+        return user
                 
     async def get_user_by_telegram_id(self, telegram_id: str) -> Optional[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        cached = self.user_cache.get_by_telegram_id(telegram_id)
+        if cached is not None:
+            return cached
+        generation = self.user_cache.generation
+        async with self.pool.read() as db:
             async with db.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,)) as cursor:
                 row = await cursor.fetchone()
-                return dict(row) if row else None
+        if not row:
+            return None
+        user = dict(row)
+        self.user_cache.put(user, generation)
+        return user
 
     async def link_telegram_to_corporate(self, telegram_id: str, corporate_id: str) -> bool:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             # Check if telegram_id is already linked to another corporate_id
             async with db.execute("SELECT corporate_id FROM users WHERE telegram_id = ? AND corporate_id != ?", (telegram_id, corporate_id)) as cursor:
                 existing = await cursor.fetchone()
@@ -143,59 +275,304 @@ class Database:
             
             # Link telegram_id to corporate_id
             await db.execute("UPDATE users SET telegram_id = ? WHERE corporate_id = ?", (telegram_id, corporate_id))
-            await db.commit()
-            return True
+        self.user_cache.invalidate(corporate_id, telegram_id)
+        return True
 
     async def deactivate_user(self, corporate_id: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             await db.execute("UPDATE users SET is_active = 0 WHERE corporate_id = ?", (corporate_id,))
-            await db.commit()
-
-    async def update_traffic_stats(self, corporate_id: str, upload_bytes: int, download_bytes: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            user = await self.get_user(corporate_id)
-            if user:
-                new_upload = user.get('total_upload', 0) + upload_bytes
-                new_download = user.get('total_download', 0) + download_bytes
-                
+        self.user_cache.invalidate(corporate_id)
+
+    async def update_traffic_stats(self, corporate_id: str, upload_bytes: int,
+                                   download_bytes: int) -> Optional[Dict[str, Any]]:
+        """Add one traffic delta atomically and return the new totals, or None for unknown users.
+
+        The raw traffic_stats row follows as in bulk_update_traffic_stats.
+        """
+        async with self.pool.write() as db:
+            await db.execute("BEGIN")
+            # Increment in SQL so concurrent reporters can never lose an update
+            async with db.execute("""
+                UPDATE users
+                SET total_upload = total_upload + ?, total_download = total_download + ?, last_access = ?
+                WHERE corporate_id = ?
+                RETURNING blitz_username, total_upload, total_download
+            """, (upload_bytes, download_bytes, datetime.now(), corporate_id)) as cursor:
+                row = await cursor.fetchone()
+            if row:
                 await db.execute("""
-                    UPDATE users 
-                    SET total_upload = ?, total_download = ?, last_access = ?
+                    INSERT INTO traffic_outbox (batch_id, seq, corporate_id, username, upload_bytes, download_bytes)
+                    VALUES (?, 0, ?, ?, ?, ?)
+                """, (uuid.uuid4().hex, corporate_id, row[0], upload_bytes, download_bytes))
+        if not row:
+            return None
+        self.user_cache.invalidate(corporate_id)
+        await self._flush_traffic_samples()
+        return {"corporate_id": corporate_id, "total_upload": row[1], "total_download": row[2]}
+
+    async def bulk_update_traffic_stats(self, deltas: Iterable[Tuple[str, int, int]],
+                                        chunk_size: int = 5000,
+                                        counters: Iterable[Tuple[str, str, int, int]] = (),
+                                        drop_sources: Iterable[str] = ()) -> int:
+        """Apply many (corporate_id, upload_bytes, download_bytes) deltas.
+
+        User totals are updated in one hot-file transaction. Unknown corporate
+        IDs are skipped. `counters` are (source, username, tx, rx) snapshots a
+        traffic sync computed the deltas from; they commit together with the
+        totals so a crash can never apply the same delta twice. Snapshots of
+        `drop_sources` are deleted in the same transaction. Returns the number
+        of users updated.
+
+        The raw traffic_stats rows commit to the hot traffic_outbox in that
+        transaction too, and reach the telemetry file through
+        flush_traffic_outbox afterwards, so this never holds the telemetry lock
+        while holding the hot one.
+        """
+        now = datetime.now()
+        batch_id = uuid.uuid4().hex
+        updated = 0
+        touched = set()
+        deltas = list(deltas)
+        async with self.pool.write() as db:
+            await db.execute("BEGIN")
+            for source in drop_sources:
+                await db.execute("DELETE FROM traffic_counters WHERE source = ?", (source,))
+            for chunk in _chunked(counters, chunk_size):
+                await db.executemany("""
+                    INSERT INTO traffic_counters (source, username, tx, rx, updated_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (source, username) DO UPDATE SET
+                        tx = excluded.tx, rx = excluded.rx, updated_at = excluded.updated_at
+                """, [(source, username, tx, rx, now) for source, username, tx, rx in chunk])
+            for start in range(0, len(deltas), chunk_size):
+                chunk = deltas[start:start + chunk_size]
+                before = db.total_changes
+                await db.executemany("""
+                    UPDATE users
+                    SET total_upload = total_upload + ?, total_download = total_download + ?, last_access = ?
                     WHERE corporate_id = ?
-                """, (new_upload, new_download, datetime.now(), corporate_id))
-                
-                # Insert traffic record
-                await db.execute("""
-                    INSERT INTO traffic_stats (corporate_id, username, upload_bytes, download_bytes)
-                    VALUES (?, ?, ?, ?)
-                """, (corporate_id, user['blitz_username'], upload_bytes, download_bytes))
-                
-                await db.commit()
+                """, [(up, down, now, cid) for cid, up, down in chunk])
+                updated += db.total_changes - before
+                touched.update(cid for cid, _, _ in chunk)
+                # INSERT ... SELECT drops rows for unknown users without a lookup round trip
+                await db.executemany("""
+                    INSERT INTO traffic_outbox (batch_id, seq, corporate_id, username, upload_bytes, download_bytes)
+                    SELECT ?, ?, corporate_id, blitz_username, ?, ? FROM users WHERE corporate_id = ?
+                """, [(batch_id, start + i, up, down, cid) for i, (cid, up, down) in enumerate(chunk)])
+        for corporate_id in touched:
+            self.user_cache.invalidate(corporate_id)
+        if deltas:
+            await self._flush_traffic_samples()
+        return updated
 
-    async def log_auth_attempt(self, corporate_id: str, telegram_id: str, action: str, 
-                             ip_address: str, user_agent: str, success: bool, 
-                             error_message: Optional[str] = None):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT INTO auth_logs (corporate_id, telegram_id, action, ip_address, user_agent, success, error_message)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (corporate_id, telegram_id, action, ip_address, user_agent, success, error_message))
-            await db.commit()
+    async def flush_traffic_outbox(self, chunk_size: int = 500) -> int:
+        """Copy the raw traffic samples in the hot outbox into telemetry traffic_stats.
+
+        One telemetry transaction copies every committed batch, then one hot
+        transaction deletes those batches. Samples keep their (batch_id, seq)
+        key, which the copy skips if it is already present, so a copy re-run
+        after a crash between the two commits never books a sample twice.
+        Returns the number of samples copied.
+        """
+        copied = 0
+        async with self.telemetry_pool.write() as db:
+            await db.execute("BEGIN")
+            async with db.execute(f"SELECT DISTINCT batch_id FROM {HOT_SCHEMA}.traffic_outbox") as cursor:
+                batches = [row[0] for row in await cursor.fetchall()]
+            for chunk in _chunked(batches, chunk_size):
+                marks = ", ".join("?" * len(chunk))
+                await db.execute(f"""
+                    INSERT OR IGNORE INTO traffic_stats
+                        (batch_id, batch_seq, corporate_id, username, upload_bytes, download_bytes, timestamp)
+                    SELECT batch_id, seq, corporate_id, username, upload_bytes, download_bytes, timestamp
+                    FROM {HOT_SCHEMA}.traffic_outbox WHERE batch_id IN ({marks})
+                    ORDER BY timestamp, batch_id, seq
+                """, chunk)
+                async with db.execute("SELECT changes()") as cursor:
+                    copied += (await cursor.fetchone())[0]
+        if not batches:
+            return 0
+        async with self.pool.write() as db:
+            await db.execute("BEGIN")
+            for chunk in _chunked(batches, chunk_size):
+                marks = ", ".join("?" * len(chunk))
+                await db.execute(f"DELETE FROM traffic_outbox WHERE batch_id IN ({marks})", chunk)
+        return copied
+
+    async def _flush_traffic_samples(self):
+        try:
+            await self.flush_traffic_outbox()
+        except sqlite3.Error as e:
+            # The totals are committed; the samples wait in the outbox for the next flush
+            logger.warning(f"Traffic samples stay in the outbox until the next flush: {e}")
+
+    async def get_traffic_counters(self, source: str) -> Dict[str, Tuple[int, int]]:
+        """Last (tx, rx) counter snapshot per username for one traffic source."""
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT username, tx, rx FROM traffic_counters WHERE source = ?", (source,)
+            ) as cursor:
+                return {row[0]: (row[1], row[2]) for row in await cursor.fetchall()}
+
+    async def get_username_map(self, active_only: bool = False) -> Dict[str, str]:
+        """blitz_username -> corporate_id for every user."""
+        sql = "SELECT blitz_username, corporate_id FROM users"
+        if active_only:
+            sql += " WHERE is_active = 1"
+        async with self.pool.read() as db:
+            async with db.execute(sql) as cursor:
+                return {row[0]: row[1] for row in await cursor.fetchall() if row[0]}
+
+    async def get_user_index(self, node: Optional[str] = None,
+                             include_unassigned: bool = False) -> Dict[str, Dict[str, Any]]:
+        """blitz_username -> the fields a panel user is compared on.
+
+        Covers every user, or with `node` only the users placed on that fleet
+        node (plus users without any placement when `include_unassigned`).
+        """
+        sql = "SELECT blitz_username, corporate_id, is_active, hy2_auth_key FROM users u"
+        params: Tuple[Any, ...] = ()
+        if node is not None:
+            sql += " WHERE EXISTS (SELECT 1 FROM user_nodes n WHERE n.corporate_id = u.corporate_id AND n.node = ?)"
+            params = (node,)
+            if include_unassigned:
+                sql += " OR NOT EXISTS (SELECT 1 FROM user_nodes n WHERE n.corporate_id = u.corporate_id)"
+        async with self.pool.read() as db:
+            async with db.execute(sql, params) as cursor:
+                return {
+                    row[0]: {"corporate_id": row[1], "is_active": bool(row[2]), "hy2_auth_key": row[3]}
+                    for row in await cursor.fetchall() if row[0]
+                }
+
+    async def set_user_nodes(self, corporate_id: str, nodes: List[str]):
+        """Replace a user's fleet placement; the first node is the primary."""
+        async with self.pool.write() as db:
+            await db.execute("BEGIN")
+            await db.execute("DELETE FROM user_nodes WHERE corporate_id = ?", (corporate_id,))
+            await db.executemany(
+                "INSERT INTO user_nodes (corporate_id, node, position) VALUES (?, ?, ?)",
+                [(corporate_id, node, position) for position, node in enumerate(nodes)],
+            )
+
+    async def get_nodes_for(self, corporate_ids: Iterable[str]) -> Dict[str, List[str]]:
+        """corporate_id -> placed nodes in order; users without placement are left out."""
+        nodes: Dict[str, List[str]] = {}
+        async with self.pool.read() as db:
+            for chunk in _chunked(corporate_ids, 500):
+                placeholders = ",".join("?" * len(chunk))
+                async with db.execute(
+                    f"SELECT corporate_id, node FROM user_nodes WHERE corporate_id IN ({placeholders}) "
+                    "ORDER BY corporate_id, position", chunk
+                ) as cursor:
+                    for corporate_id, node in await cursor.fetchall():
+                        nodes.setdefault(corporate_id, []).append(node)
+        return nodes
+
+    async def get_user_nodes(self, corporate_id: str) -> List[str]:
+        return (await self.get_nodes_for([corporate_id])).get(corporate_id, [])
+
+    async def assign_default_node(self, node: str) -> int:
+        """Place every user that has no placement yet on `node`."""
+        async with self.pool.write() as db:
+            cursor = await db.execute("""
+                INSERT INTO user_nodes (corporate_id, node, position)
+                SELECT corporate_id, ?, 0 FROM users u
+                WHERE NOT EXISTS (SELECT 1 FROM user_nodes n WHERE n.corporate_id = u.corporate_id)
+            """, (node,))
+            return cursor.rowcount
+
+    async def get_node_user_counts(self) -> Dict[str, int]:
+        """node -> number of active users placed on it."""
+        async with self.pool.read() as db:
+            async with db.execute("""
+                SELECT n.node, COUNT(*) FROM user_nodes n
+                JOIN users u ON u.corporate_id = n.corporate_id
+                WHERE u.is_active = 1
+                GROUP BY n.node
+            """) as cursor:
+                return {row[0]: row[1] for row in await cursor.fetchall()}
+
+    async def get_node_users(self, node: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """Active users placed on `node`, most recently created first."""
+        async with self.pool.read() as db:
+            async with db.execute("""
+                SELECT u.corporate_id, u.blitz_username, u.hy2_auth_key FROM user_nodes n
+                JOIN users u ON u.corporate_id = n.corporate_id
+                WHERE n.node = ? AND u.is_active = 1
+                ORDER BY u.created_at DESC
+                LIMIT ?
+            """, (node, limit)) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
 
-    async def log_monitor_event(self, component: str, level: str, message: str, details: str = ""):
-        async with aiosqlite.connect(self.db_path) as db:
+    async def move_user_node(self, corporate_id: str, source: str, target: str) -> bool:
+        """Swap one node of a user's placement for another, keeping its position."""
+        async with self.pool.write() as db:
+            cursor = await db.execute(
+                "UPDATE user_nodes SET node = ?, created_at = ? WHERE corporate_id = ? AND node = ?",
+                (target, datetime.now(), corporate_id, source),
+            )
+            return cursor.rowcount > 0
+
+    async def get_idempotent_response(self, scope: str, key: str) -> Optional[Dict[str, Any]]:
+        """The unexpired response stored under `key`: {fingerprint, status_code, response}."""
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT fingerprint, status_code, response FROM idempotency_keys "
+                "WHERE scope = ? AND idempotency_key = ? AND expires_at > ?",
+                (scope, key, datetime.now()),
+            ) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+
+    async def save_idempotent_response(self, scope: str, key: str, fingerprint: str, status_code: int,
+                                       response: str, ttl_seconds: int, purge_limit: int = 100) -> bool:
+        """Store a response unless one is already stored under `key`. Returns True if stored.
+
+        Also purges up to `purge_limit` expired keys, so the table needs no
+        separate cleanup job.
+        """
+        now = datetime.now()
+        async with self.pool.write() as db:
+            await db.execute("BEGIN")
+            await db.execute("""
+                DELETE FROM idempotency_keys WHERE (scope, idempotency_key) IN (
+                    SELECT scope, idempotency_key FROM idempotency_keys WHERE expires_at <= ? LIMIT ?
+                )
+            """, (now, purge_limit))
+            # An expired row under the same key may survive the capped purge
             await db.execute(
-                """
-                INSERT INTO monitor_events (component, level, message, details)
-                VALUES (?, ?, ?, ?)
-                """,
-                (component, level, message, details),
+                "DELETE FROM idempotency_keys WHERE scope = ? AND idempotency_key = ? AND expires_at <= ?",
+                (scope, key, now),
             )
-            await db.commit()
+            cursor = await db.execute("""
+                INSERT OR IGNORE INTO idempotency_keys
+                    (scope, idempotency_key, fingerprint, status_code, response, created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (scope, key, fingerprint, status_code, response, now, now + timedelta(seconds=ttl_seconds)))
+            return cursor.rowcount > 0
+
+    async def log_auth_attempt(self, corporate_id: str, telegram_id: str, action: str, 
+                             ip_address: str, user_agent: str, success: bool, 
+                             error_message: Optional[str] = None, durable: bool = False):
+        await self.write_behind.enqueue("""
+            INSERT INTO auth_logs (corporate_id, telegram_id, action, ip_address, user_agent, success, error_message)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (corporate_id, telegram_id, action, ip_address, user_agent, success, error_message),
+            durable=durable)
+
+    async def log_monitor_event(self, component: str, level: str, message: str, details: str = "",
+                                durable: bool = False):
+        await self.write_behind.enqueue(
+            """
+            INSERT INTO monitor_events (component, level, message, details)
+            VALUES (?, ?, ?, ?)
+            """,
+            (component, level, message, details),
+            durable=durable,
+        )
 
     async def get_user_auth_logs(self, corporate_id: str, limit: int = 10) -> list:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.telemetry_pool.read() as db:
             async with db.execute("""
                 SELECT * FROM auth_logs 
                 WHERE corporate_id = ? 
@@ -206,70 +583,162 @@ class Database:
                 return [dict(row) for row in rows]
 
     async def get_user_traffic_stats(self, corporate_id: str, days: int = 30) -> list:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT DATE(timestamp) as date, 
-                       SUM(upload_bytes) as total_upload,
-                       SUM(download_bytes) as total_download,
-                       COUNT(*) as connection_count
-                FROM traffic_stats 
-                WHERE corporate_id = ? AND timestamp >= datetime('now', '-' || ? || ' days')
-                GROUP BY DATE(timestamp)
-                ORDER BY date DESC
-            """, (corporate_id, days)) as cursor:
+        # Served from the daily rollup, so cost depends on days requested, not raw samples
+        async with self.telemetry_pool.read() as db:
+            async with db.execute(TRAFFIC_DAILY_SQL, (corporate_id, days)) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
-    async def create_webhook_event(self, event_type: str, corporate_id: str, event_data: str):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT INTO webhook_events (event_type, corporate_id, event_data)
-                VALUES (?, ?, ?)
-            """, (event_type, corporate_id, event_data))
-            await db.commit()
-
-    async def get_pending_webhook_events(self) -> list:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+    async def get_user_hourly_traffic(self, corporate_id: str, hours: int = 24) -> list:
+        async with self.telemetry_pool.read() as db:
+            async with db.execute(TRAFFIC_HOURLY_SQL, (corporate_id, hours)) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+
+    async def get_user_traffic_summary(self, corporate_id: str, days: int = 30) -> Dict[str, Any]:
+        daily = await self.get_user_traffic_stats(corporate_id, days)
+        return {
+            "upload": sum(row["total_upload"] for row in daily),
+            "download": sum(row["total_download"] for row in daily),
+            "period_days": days,
+            "daily": daily,
+        }
+
+    async def backfill_traffic_rollups(self) -> int:
+        """Re-derive rollups from retained raw traffic rows (one-off repair job)."""
+        async with self.telemetry_pool.write() as db:
+            await db.execute("BEGIN")
+            return await backfill_traffic_rollups(db)
+
+    async def create_webhook_event(self, event_type: str, corporate_id: str, event_data: str,
+                                   durable: bool = False):
+        await self.write_behind.enqueue("""
+            INSERT INTO webhook_events (event_type, corporate_id, event_data)
+            VALUES (?, ?, ?)
+        """, (event_type, corporate_id, event_data), durable=durable)
+
+    async def get_pending_webhook_events(self, limit: int = 100) -> list:
+        async with self.telemetry_pool.read() as db:
             async with db.execute("""
                 SELECT * FROM webhook_events 
                 WHERE processed = 0 
                 ORDER BY created_at ASC
-            """) as cursor:
+                LIMIT ?
+            """, (limit,)) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
     async def mark_webhook_event_processed(self, event_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.telemetry_pool.write() as db:
             await db.execute("""
                 UPDATE webhook_events 
-                SET processed = 1, processed_at = ? 
+                SET processed = 1, processed_at = ?, lease_owner = NULL, lease_expires_at = NULL
                 WHERE id = ?
             """, (datetime.now(), event_id))
-            await db.commit()
+
+    async def claim_webhook_events(self, consumer: str, limit: int = 10,
+                                   visibility_timeout: int = 60,
+                                   max_attempts: int = 5) -> List[Dict[str, Any]]:
+        """Atomically lease up to `limit` pending events to `consumer`.
+
+        Leased events are invisible to other consumers until acked, nacked or
+        the lease expires. Events whose lease expired `max_attempts` times are
+        dead-lettered (processed = 2) instead of being handed out again.
+        """
+        now = datetime.now()
+        async with self.telemetry_pool.write() as db:
+            await db.execute("BEGIN")
+            await db.execute("""
+                UPDATE webhook_events
+                SET processed = 2, lease_owner = NULL, lease_expires_at = NULL,
+                    last_error = COALESCE(last_error, 'lease expired too many times')
+                WHERE processed = 0 AND attempts >= ? AND lease_expires_at < ?
+            """, (max_attempts, now))
+            async with db.execute("""
+                UPDATE webhook_events
+                SET lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM webhook_events
+                    WHERE processed = 0 AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                    ORDER BY created_at ASC
+                    LIMIT ?
+                )
+                RETURNING id, event_type, corporate_id, event_data, created_at, attempts, lease_expires_at
+            """, (consumer, now + timedelta(seconds=visibility_timeout), now, limit)) as cursor:
+                columns = [d[0] for d in cursor.description]
+                rows = [dict(zip(columns, row)) for row in await cursor.fetchall()]
+        return sorted(rows, key=lambda row: row["id"])
+
+    async def ack_webhook_events(self, consumer: str, event_ids: List[int]) -> List[int]:
+        """Mark events leased by `consumer` as processed. Returns the ids acknowledged."""
+        if not event_ids:
+            return []
+        placeholders = ",".join("?" * len(event_ids))
+        async with self.telemetry_pool.write() as db:
+            async with db.execute(f"""
+                UPDATE webhook_events
+                SET processed = 1, processed_at = ?, lease_owner = NULL, lease_expires_at = NULL
+                WHERE id IN ({placeholders}) AND lease_owner = ? AND processed = 0
+                RETURNING id
+            """, (datetime.now(), *event_ids, consumer)) as cursor:
+                return sorted(row[0] for row in await cursor.fetchall())
+
+    async def nack_webhook_events(self, consumer: str, event_ids: List[int], error: str = "",
+                                  retry_delay: int = 0, max_attempts: int = 5) -> List[int]:
+        """Release events leased by `consumer` for a retry after `retry_delay` seconds.
+
+        Events that already used `max_attempts` attempts are dead-lettered.
+        Returns the ids released.
+        """
+        if not event_ids:
+            return []
+        placeholders = ",".join("?" * len(event_ids))
+        async with self.telemetry_pool.write() as db:
+            async with db.execute(f"""
+                UPDATE webhook_events
+                SET lease_owner = NULL,
+                    lease_expires_at = ?,
+                    last_error = ?,
+                    processed = CASE WHEN attempts >= ? THEN 2 ELSE 0 END
+                WHERE id IN ({placeholders}) AND lease_owner = ? AND processed = 0
+                RETURNING id
+            """, (datetime.now() + timedelta(seconds=retry_delay), error, max_attempts,
+                  *event_ids, consumer)) as cursor:
+                return sorted(row[0] for row in await cursor.fetchall())
+
+    async def webhook_queue_stats(self) -> Dict[str, int]:
+        async with self.telemetry_pool.read() as db:
+            async with db.execute("""
+                SELECT
+                    SUM(processed = 0 AND (lease_expires_at IS NULL OR lease_expires_at < ?)),
+                    SUM(processed = 0 AND lease_owner IS NOT NULL AND lease_expires_at >= ?),
+                    SUM(processed = 2)
+                FROM webhook_events WHERE processed != 1
+            """, (datetime.now(), datetime.now())) as cursor:
+                row = await cursor.fetchone()
+        return {"available": row[0] or 0, "leased": row[1] or 0, "dead_lettered": row[2] or 0}
 
     async def increment_auth_attempts(self, corporate_id: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             await db.execute("""
                 UPDATE users 
                 SET auth_attempts = auth_attempts + 1 
                 WHERE corporate_id = ?
             """, (corporate_id,))
-            await db.commit()
+        self.user_cache.invalidate(corporate_id)
 
     async def lock_user(self, corporate_id: str, duration_minutes: int = 30):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             locked_until = datetime.now() + timedelta(minutes=duration_minutes)
             await db.execute("""
                 UPDATE users 
                 SET locked_until = ? 
                 WHERE corporate_id = ?
             """, (locked_until, corporate_id))
-            await db.commit()
+        self.user_cache.invalidate(corporate_id)
 
     async def is_user_locked(self, corporate_id: str) -> bool:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.read() as db:
             async with db.execute("SELECT locked_until FROM users WHERE corporate_id = ?", (corporate_id,)) as cursor:
                 row = await cursor.fetchone()
                 if row and row[0]:
@@ -278,53 +747,278 @@ class Database:
                 return False
 
     async def reset_auth_attempts(self, corporate_id: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             await db.execute("""
                 UPDATE users 
                 SET auth_attempts = 0, locked_until = NULL 
                 WHERE corporate_id = ?
             """, (corporate_id,))
-            await db.commit()
+        self.user_cache.invalidate(corporate_id)
+
+    async def purge_older_than(self, table: str, time_column: str, days: int,
+                               limit: int, extra_where: str = "", key: str = "rowid") -> int:
+        """Delete up to `limit` of the oldest rows older than `days`. Returns rows deleted.
+
+        `table`, `time_column`, `extra_where` and `key` are interpolated and must
+        come from trusted constants, never from request data.
+        """
+        async with self.telemetry_pool.write() as db:
+            async with db.execute(purge_sql(table, time_column, extra_where, key),
+                                  (f"-{int(days)} days", limit)) as cursor:
+                return cursor.rowcount
+
+    async def storage_stats(self, pool: Optional[ConnectionPool] = None) -> Dict[str, int]:
+        """Page usage of one file, the telemetry file by default."""
+        async with (pool or self.telemetry_pool).read() as db:
+            stats = {}
+            for pragma in ("page_size", "page_count", "freelist_count"):
+                async with db.execute(f"PRAGMA {pragma}") as cursor:
+                    stats[pragma] = (await cursor.fetchone())[0]
+            stats["file_bytes"] = stats["page_size"] * stats["page_count"]
+            stats["free_bytes"] = stats["page_size"] * stats["freelist_count"]
+            return stats
+
+    async def reclaim_space(self, max_pages: int = 0, pool: Optional[ConnectionPool] = None) -> int:
+        """Return free pages to the filesystem via incremental_vacuum. Returns bytes reclaimed.
+
+        Retention only deletes telemetry rows, so the telemetry file is the default.
+        """
+        pool = pool or self.telemetry_pool
+        before = await self.storage_stats(pool)
+        async with pool.write() as db:
+            # incremental_vacuum with no argument frees the whole freelist
+            pages = f"({int(max_pages)})" if max_pages > 0 else ""
+            async with db.execute(f"PRAGMA incremental_vacuum{pages}") as cursor:
+                await cursor.fetchall()
+        after = await self.storage_stats(pool)
+        return max(0, before["file_bytes"] - after["file_bytes"])
+
+    async def iter_export_rows(self, table: str, since: Optional[str] = None,
+                               until: Optional[str] = None, after_id: int = 0,
+                               batch_size: int = 1000) -> AsyncIterator[Tuple[List[str], List[tuple]]]:
+        """Yield (columns, rows) pages of an exportable table in id order.
+
+        Keyset pagination on id keeps memory bounded and releases the reader
+        between pages; `after_id` resumes an interrupted export.
+        """
+        time_column = EXPORT_TABLES[table]
+        async with self.telemetry_pool.read() as db:
+            # Narrow the id range with the time index so a filtered export never
+            # walks rows outside [since, until)
+            if since:
+                async with db.execute(f"SELECT MIN(id) FROM {table} WHERE {time_column} >= ?", (since,)) as cur:
+                    first = (await cur.fetchone())[0]
+                if first is None:
+                    return
+                after_id = max(after_id, first - 1)
+            max_id = None
+            if until:
+                async with db.execute(f"SELECT MAX(id) FROM {table} WHERE {time_column} < ?", (until,)) as cur:
+                    max_id = (await cur.fetchone())[0]
+                if max_id is None:
+                    return
+
+        conditions = ["id > ?"]
+        if since:
+            conditions.append(f"{time_column} >= ?")
+        if until:
+            conditions.append(f"{time_column} < ?")
+            conditions.append("id <= ?")
+        sql = f"SELECT * FROM {table} WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?"
+
+        while True:
+            params: List[Any] = [after_id]
+            if since:
+                params.append(since)
+            if until:
+                params.extend([until, max_id])
+            params.append(batch_size)
+            async with self.telemetry_pool.read() as db:
+                async with db.execute(sql, params) as cur:
+                    columns = [d[0] for d in cur.description]
+                    rows = [tuple(row) for row in await cur.fetchall()]
+            if not rows:
+                return
+            yield columns, rows
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1][0]
+
+    async def _upsert_chunk(self, db, sql: str, rows: List[Tuple[int, tuple]]) -> List[Tuple[int, str]]:
+        """executemany the chunk; if any row violates a constraint, redo it row by
+        row under savepoints so only the offending rows are rejected."""
+        await db.execute("SAVEPOINT bulk_chunk")
+        try:
+            await db.executemany(sql, [values for _, values in rows])
+            await db.execute("RELEASE bulk_chunk")
+            return []
+        except sqlite3.Error:
+            await db.execute("ROLLBACK TO bulk_chunk")
+            await db.execute("RELEASE bulk_chunk")
+
+        errors = []
+        for line, values in rows:
+            await db.execute("SAVEPOINT bulk_row")
+            try:
+                await db.execute(sql, values)
+            except sqlite3.Error as e:
+                await db.execute("ROLLBACK TO bulk_row")
+                errors.append((line, str(e)))
+            await db.execute("RELEASE bulk_row")
+        return errors
+
+    async def bulk_upsert_users(self, rows: List[Tuple[int, tuple]]) -> List[Tuple[int, str]]:
+        """Upsert (line, (corporate_id, blitz_username, hy2_auth_key, subscription_url,
+        hy2_url, telegram_id, is_active)) rows in one transaction. Returns (line, error) pairs.
+
+        None fields keep an existing user's value; a None is_active makes a new user active.
+        """
+        async with self.pool.write() as db:
+            await db.execute("BEGIN")
+            # ?7 is read again in the UPDATE: excluded.is_active already has the default applied
+            errors = await self._upsert_chunk(db, """
+                INSERT INTO users (corporate_id, blitz_username, hy2_auth_key, subscription_url,
+                                   hy2_url, telegram_id, is_active)
+                VALUES (?1, ?2, ?3, ?4, ?5, ?6, COALESCE(?7, 1))
+                ON CONFLICT (corporate_id) DO UPDATE SET
+                    blitz_username = excluded.blitz_username,
+                    hy2_auth_key = COALESCE(excluded.hy2_auth_key, users.hy2_auth_key),
+                    subscription_url = COALESCE(excluded.subscription_url, users.subscription_url),
+                    hy2_url = COALESCE(excluded.hy2_url, users.hy2_url),
+                    telegram_id = COALESCE(excluded.telegram_id, users.telegram_id),
+                    is_active = COALESCE(?7, users.is_active)
+            """, rows)
+        self.user_cache.clear()
+        return errors
+
+    async def bulk_upsert_ids(self, rows: List[Tuple[int, tuple]], actor: str = "import") -> List[Tuple[int, str]]:
+        """Upsert (line, (id, owner, status)) rows in one transaction, then queue their audit rows."""
+        now = datetime.now()
+        async with self.pool.write() as db:
+            await db.execute("BEGIN")
+            errors = await self._upsert_chunk(db, """
+                INSERT INTO id_registry (id, owner, status, issued_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    owner = excluded.owner,
+                    status = excluded.status,
+                    updated_at = excluded.issued_at
+                WHERE owner IS NOT excluded.owner OR status IS NOT excluded.status
+            """, [(line, values + (now,)) for line, values in rows])
+        failed = {line for line, _ in errors}
+        await self.write_behind.enqueue_many("""
+            INSERT INTO id_audit (id, action, actor, details) VALUES (?, 'import', ?, ?)
+        """, [(values[0], actor, values[1]) for line, values in rows if line not in failed])
+        self.issued_ids.update(values[0] for line, values in rows if line not in failed)
+        return errors
 
     async def get_id(self, id_value: str) -> Optional[Dict[str, Any]]:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        """The id_registry row, always read from the database.
+
+        IDs written by another process are missing from the in-memory index;
+        a hit here adds them so issuance no longer picks them as candidates.
+        """
+        async with self.pool.read() as db:
             async with db.execute("SELECT * FROM id_registry WHERE id = ?", (id_value,)) as cursor:
                 row = await cursor.fetchone()
-                return dict(row) if row else None
+        if not row:
+            return None
+        self.issued_ids.add(id_value)
+        return dict(row)
 
     async def create_id(self, id_value: str, owner: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             await db.execute("""
                 INSERT INTO id_registry (id, owner, status, issued_at)
                 VALUES (?, ?, 'issued', ?)
             """, (id_value, owner, datetime.now()))
-            await db.commit()
+        self.issued_ids.add(id_value)
+
+    async def issue_ids(self, owners: List[str], actor: str, max_attempts: int = 3) -> List[Tuple[str, str]]:
+        """Issue one new ID per owner in a single transaction. Returns (id, owner) pairs.
+
+        Audit rows go to the telemetry file and are committed before returning.
+
+        Candidates are checked against the in-memory index, so collisions cost
+        no database round trips; a rare clash with another process retries.
+        """
+        for attempt in range(max_attempts):
+            taken = set()
+            issued = []
+            for owner in owners:
+                new_id = generate_corporate_id()
+                while new_id in taken or new_id in self.issued_ids:
+                    new_id = generate_corporate_id()
+                taken.add(new_id)
+                issued.append((new_id, owner))
+            now = datetime.now()
+            try:
+                async with self.pool.write() as db:
+                    await db.execute("BEGIN")
+                    await db.executemany("""
+                        INSERT INTO id_registry (id, owner, status, issued_at)
+                        VALUES (?, ?, 'issued', ?)
+                    """, [(id_value, owner, now) for id_value, owner in issued])
+            except sqlite3.IntegrityError:
+                # Another process issued one of our candidates; reload and retry
+                await self.load_issued_ids()
+                continue
+            self.issued_ids.update(id_value for id_value, _ in issued)
+            await self.write_behind.enqueue_many("""
+                INSERT INTO id_audit (id, action, actor, details)
+                VALUES (?, 'issue', ?, ?)
+            """, [(id_value, actor, owner) for id_value, owner in issued], durable=True)
+            return issued
+        raise RuntimeError("Could not issue unique IDs")
 
     async def set_id_status(self, id_value: str, status: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.pool.write() as db:
             await db.execute("""
                 UPDATE id_registry SET status = ?, updated_at = ? WHERE id = ?
             """, (status, datetime.now(), id_value))
-            await db.commit()
 
     async def search_ids(self, query: str, limit: int = 20) -> list:
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            like = f"%{query}%"
-            async with db.execute("""
-                SELECT * FROM id_registry
-                WHERE id LIKE ? OR owner LIKE ? OR status LIKE ?
-                ORDER BY issued_at DESC
-                LIMIT ?
-            """, (like, like, like, limit)) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        page = await self.search_ids_page(query, limit)
+        return page["items"]
 
-    async def audit_id_action(self, id_value: str, action: str, actor: str, details: str = ""):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT INTO id_audit (id, action, actor, details)
-                VALUES (?, ?, ?, ?)
-            """, (id_value, action, actor, details))
-            await db.commit()
+    async def search_ids_page(self, query: str, limit: int = 20,
+                              cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Ranked ID/owner/status search with keyset pagination.
+
+        Exact and prefix ID matches rank first, then FTS5 bm25 relevance.
+        Returns {"items": [...], "next_cursor": str | None}; pass next_cursor
+        back to fetch the following page.
+        """
+        after = _decode_cursor(cursor) if cursor else None
+        sql, params = search_ids_sql(query, after)
+        params.append(limit + 1)
+        async with self.pool.read() as db:
+            async with db.execute(sql, params) as cur:
+                rows = [dict(row) for row in await cur.fetchall()]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = _encode_cursor([last["_tier"], last["_rank"], last["_rowid"]])
+        for row in rows:
+            for key in ("_tier", "_rank", "_rowid"):
+                row.pop(key, None)
+        return {"items": rows, "next_cursor": next_cursor}
+
+    async def rebuild_id_search_index(self):
+        async with self.pool.write() as db:
+            await db.execute("INSERT INTO id_registry_fts (id_registry_fts) VALUES ('rebuild')")
+
+    async def audit_id_action(self, id_value: str, action: str, actor: str, details: str = "",
+                              durable: bool = False):
+        await self.write_behind.enqueue("""
+            INSERT INTO id_audit (id, action, actor, details)
+            VALUES (?, ?, ?, ?)
+        """, (id_value, action, actor, details), durable=durable)
+
+
+@lru_cache()
+def get_database(db_path: str) -> Database:
+    """Process-wide Database per file, so every module shares one pool."""
+    return Database(db_path)
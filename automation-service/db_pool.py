@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_READERS = 4
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024
+DEFAULT_CACHE_SIZE_KB = 16 * 1024
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+
+
+class ConnectionPool:
+    """One writer plus N reader aiosqlite connections to a single SQLite file.
+
+    SQLite only ever allows one writer, so the writer connection is guarded by
+    a lock and every write goes through it. In WAL mode readers never block the
+    writer, so reads are spread across a small queue of read-only connections.
+    `attach` maps schema aliases to other database files ATTACHed to every
+    connection, for the few queries that read across files.
+    """
+
+    def __init__(self, db_path: str, readers: int = DEFAULT_READERS,
+                 mmap_size: int = DEFAULT_MMAP_SIZE,
+                 cache_size_kb: int = DEFAULT_CACHE_SIZE_KB,
+                 busy_timeout_ms: int = DEFAULT_BUSY_TIMEOUT_MS,
+                 attach: Optional[Dict[str, str]] = None):
+        self.db_path = db_path
+        self.readers = max(1, readers)
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.busy_timeout_ms = busy_timeout_ms
+        self.attach: Dict[str, str] = dict(attach or {})
+
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._reader_queue: Optional[asyncio.Queue] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+        self._open_lock = asyncio.Lock()
+        self._closed = True
+        self._shut_down = False
+
+        self._stats = {
+            "reads": 0,
+            "writes": 0,
+            "write_errors": 0,
+            "read_wait_ms": 0.0,
+            "write_wait_ms": 0.0,
+        }
+
+    @property
+    def is_open(self) -> bool:
+        return not self._closed
+
+    async def _configure(self, conn: aiosqlite.Connection, read_only: bool):
+        await conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        await conn.execute("PRAGMA journal_mode = WAL")
+        await conn.execute("PRAGMA synchronous = NORMAL")
+        await conn.execute("PRAGMA temp_store = MEMORY")
+        await conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        # Negative cache_size is interpreted by SQLite as KiB rather than pages
+        await conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kb)}")
+        for alias, path in self.attach.items():
+            await conn.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+        if read_only:
+            await conn.execute("PRAGMA query_only = ON")
+
+    async def _ensure_open(self):
+        if self._closed:
+            if self._shut_down:
+                raise RuntimeError(f"SQLite pool for {self.db_path} is closed")
+            await self.open()
+
+    async def open(self):
+        async with self._open_lock:
+            if not self._closed:
+                return
+            self._shut_down = False
+            Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+
+            # The writer is opened first so WAL mode is set before readers attach
+            self._writer = await aiosqlite.connect(self.db_path)
+            await self._configure(self._writer, read_only=False)
+
+            self._reader_queue = asyncio.Queue()
+            self._reader_conns = []
+            for _ in range(self.readers):
+                conn = await aiosqlite.connect(self.db_path)
+                conn.row_factory = aiosqlite.Row
+                await self._configure(conn, read_only=True)
+                self._reader_conns.append(conn)
+                self._reader_queue.put_nowait(conn)
+
+            self._closed = False
+            logger.info(f"SQLite pool opened for {self.db_path}: 1 writer, {self.readers} readers")
+
+    async def close(self):
+        async with self._open_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._shut_down = True
+            # Wait for an in-flight write transaction before closing the writer
+            async with self._write_lock:
+                if self._writer is not None:
+                    await self._writer.close()
+                    self._writer = None
+            for conn in self._reader_conns:
+                await conn.close()
+            self._reader_conns = []
+            self._reader_queue = None
+            logger.info(f"SQLite pool closed for {self.db_path}")
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrow a read-only connection with `aiosqlite.Row` rows."""
+        await self._ensure_open()
+        started = time.perf_counter()
+        conn = await self._reader_queue.get()
+        self._stats["read_wait_ms"] += (time.perf_counter() - started) * 1000
+        self._stats["reads"] += 1
+        queue = self._reader_queue
+        try:
+            yield conn
+        finally:
+            queue.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Hold the writer for one transaction; commit on success, rollback on error."""
+        await self._ensure_open()
+        started = time.perf_counter()
+        async with self._write_lock:
+            self._stats["write_wait_ms"] += (time.perf_counter() - started) * 1000
+            self._stats["writes"] += 1
+            conn = self._writer
+            conn.row_factory = None
+            try:
+                yield conn
+                await conn.commit()
+            except BaseException:
+                self._stats["write_errors"] += 1
+                await conn.rollback()
+                raise
+
+    def stats(self) -> Dict[str, Any]:
+        idle = self._reader_queue.qsize() if self._reader_queue is not None else 0
+        return {
+            "db_path": self.db_path,
+            "open": not self._closed,
+            "readers_total": len(self._reader_conns),
+            "readers_idle": idle,
+            "readers_in_use": len(self._reader_conns) - idle,
+            "writer_busy": self._write_lock.locked(),
+            "reads": self._stats["reads"],
+            "writes": self._stats["writes"],
+            "write_errors": self._stats["write_errors"],
+            "read_wait_ms": round(self._stats["read_wait_ms"], 3),
+            "write_wait_ms": round(self._stats["write_wait_ms"], 3),
+        }
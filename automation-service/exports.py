@@ -0,0 +1,90 @@
+from fastapi import APIRouter, HTTPException, Header, Query
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Optional
+from datetime import datetime, timezone
+import csv
+import io
+import json
+import logging
+
+from config import get_settings
+from database import EXPORT_TABLES, get_database
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/export", tags=["export"])
+settings = get_settings()
+db = get_database(settings.DB_PATH)
+
+MAX_BATCH_SIZE = 10000
+
+
+def _to_sqlite_timestamp(value: Optional[datetime]) -> Optional[str]:
+    """Match the UTC 'YYYY-MM-DD HH:MM:SS' format SQLite's CURRENT_TIMESTAMP writes."""
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+async def _ndjson_stream(table: str, since: Optional[str], until: Optional[str],
+                         after_id: int, batch_size: int) -> AsyncIterator[bytes]:
+    async for columns, rows in db.iter_export_rows(table, since, until, after_id, batch_size):
+        yield "".join(
+            json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows
+        ).encode()
+
+
+async def _csv_stream(table: str, since: Optional[str], until: Optional[str],
+                      after_id: int, batch_size: int) -> AsyncIterator[bytes]:
+    header_sent = False
+    async for columns, rows in db.iter_export_rows(table, since, until, after_id, batch_size):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not header_sent:
+            writer.writerow(columns)
+            header_sent = True
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+
+
+@router.get("/{table}")
+async def export_table(
+    table: str,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after_id: int = Query(0, ge=0),
+    batch_size: int = Query(1000, ge=1, le=MAX_BATCH_SIZE),
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    """
+    Stream a full extract of auth_logs or traffic_stats.
+
+    Rows are emitted in id order with keyset pagination, so memory stays
+    bounded regardless of size. To resume an interrupted export, pass the
+    last received `id` as `after_id` with the same filters.
+    """
+
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail="Unknown export table")
+
+    since_ts = _to_sqlite_timestamp(since)
+    until_ts = _to_sqlite_timestamp(until)
+    logger.info(f"Export of {table} requested: format={format} since={since_ts} until={until_ts} after_id={after_id}")
+
+    if format == "csv":
+        stream = _csv_stream(table, since_ts, until_ts, after_id, batch_size)
+        media_type = "text/csv"
+    else:
+        stream = _ndjson_stream(table, since_ts, until_ts, after_id, batch_size)
+        media_type = "application/x-ndjson"
+
+    return StreamingResponse(
+        stream,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'},
+    )
@@ -0,0 +1,664 @@
+"""Registry of Hysteria2 panel nodes with load-aware user placement.
+
+Used by the API for provisioning and as a CLI for rebalancing:
+
+    python fleet.py rebalance --dry-run
+"""
+import argparse
+import asyncio
+import json
+import logging
+import secrets
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from blitz_client import BlitzClient, parse_batch_endpoints
+from circuit_breaker import get_circuit_breaker
+from config import get_settings
+from config_renderer import ConfigRenderer
+from database import Database, get_database
+from http_pool import HttpPool, close_http_pools, get_http_pool
+from marzban import MarzbanClient
+from rate_limiter import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NODE = "default"
+NODE_KINDS = ("blitz", "marzban")
+DEFAULT_REPLICAS = 2
+DEFAULT_LOAD_TTL = 60.0
+# Traffic rate that weighs as much as one active session when scoring nodes
+TRAFFIC_PER_SESSION = 1024 * 1024
+DEFAULT_REBALANCE_THRESHOLD = 0.25
+DEFAULT_MAX_MOVES = 100
+
+
+class FleetNode(ABC):
+    """One panel node behind the common provisioning interface."""
+
+    kind = ""
+    supports_hy2 = False
+
+    def __init__(self, name: str, host: str, port: int = 443, weight: float = 1.0, placement: bool = True):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.weight = max(weight, 0.01)
+        # False drains the node: it keeps its users but gets no new ones
+        self.placement = placement
+        self.healthy = True
+        self.sessions: Optional[int] = None
+        self.traffic_bytes: Optional[int] = None
+        self.traffic_rate = 0.0
+        self.users = 0
+        self.pending = 0
+        self.sampled_at = 0.0
+
+    @abstractmethod
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def create_user(self, username: str, auth_key: Optional[str] = None) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    async def set_status(self, username: str, enabled: bool):
+        ...
+
+    @abstractmethod
+    async def delete_user(self, username: str) -> bool:
+        ...
+
+    async def fetch_load(self) -> Tuple[Optional[int], Optional[int]]:
+        """(active sessions, cumulative traffic bytes); None where the node cannot tell."""
+        return None, None
+
+    async def ensure_user(self, username: str, auth_key: Optional[str] = None) -> Dict[str, Any]:
+        """The user on this node, created with `auth_key` if it does not exist yet."""
+        return await self.get_user(username) or await self.create_user(username, auth_key)
+
+    async def _each(self, usernames: List[str], op: Callable[[str], Awaitable[Dict[str, Any]]],
+                    concurrency: int) -> AsyncIterator[Dict[str, Any]]:
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run(username: str) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    return {"username": username, "ok": True, "error": None, **await op(username)}
+                except Exception as e:
+                    return {"username": username, "ok": False, "error": str(e)}
+
+        tasks = [asyncio.ensure_future(run(u)) for u in dict.fromkeys(usernames)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def bulk_ensure_users(self, usernames: List[str], auth_keys: Dict[str, str],
+                                concurrency: int) -> AsyncIterator[Dict[str, Any]]:
+        """ensure_user for many users, yielding {username, ok, user, error} per user."""
+        async def ensure(username: str) -> Dict[str, Any]:
+            return {"user": await self.ensure_user(username, auth_keys.get(username))}
+
+        async for result in self._each(usernames, ensure, concurrency):
+            yield result
+
+    async def bulk_set_status(self, usernames: List[str], enabled: bool,
+                              concurrency: int) -> AsyncIterator[Dict[str, Any]]:
+        async def set_status(username: str) -> Dict[str, Any]:
+            await self.set_status(username, enabled)
+            return {}
+
+        async for result in self._each(usernames, set_status, concurrency):
+            yield result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "address": f"{self.host}:{self.port}",
+            "weight": self.weight,
+            "placement": self.placement,
+            "healthy": self.healthy,
+            "sessions": self.sessions,
+            "traffic_rate": round(self.traffic_rate, 1),
+            "users": self.users,
+            "pending": self.pending,
+        }
+
+
+class BlitzNode(FleetNode):
+    """A Blitz panel, with load read from its Hysteria2 trafficStats API when configured."""
+
+    kind = "blitz"
+    supports_hy2 = True
+
+    def __init__(self, name: str, client: BlitzClient, host: str, port: int = 443, weight: float = 1.0,
+                 placement: bool = True, traffic_url: str = "", traffic_secret: str = "",
+                 http: Optional[HttpPool] = None):
+        super().__init__(name, host, port, weight, placement)
+        self.client = client
+        self.traffic_url = traffic_url.rstrip("/")
+        self.traffic_secret = traffic_secret
+        self.http = http or get_http_pool("hysteria")
+
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        return await self.client.get_user(username)
+
+    async def create_user(self, username: str, auth_key: Optional[str] = None) -> Dict[str, Any]:
+        return await self.client.create_user(username, auth_key=auth_key)
+
+    async def set_status(self, username: str, enabled: bool):
+        await self.client.update_user_status(username, enabled)
+
+    async def delete_user(self, username: str) -> bool:
+        return await self.client.delete_user(username)
+
+    async def fetch_load(self) -> Tuple[Optional[int], Optional[int]]:
+        if not self.traffic_url:
+            return None, None
+        headers = {"Authorization": self.traffic_secret} if self.traffic_secret else {}
+        online = await self.http.request("GET", f"{self.traffic_url}/online", headers=headers)
+        online.raise_for_status()
+        traffic = await self.http.request("GET", f"{self.traffic_url}/traffic", headers=headers)
+        traffic.raise_for_status()
+        return (
+            sum(int(count) for count in online.json().values()),
+            sum(int(c.get("tx", 0)) + int(c.get("rx", 0)) for c in traffic.json().values()),
+        )
+
+    async def bulk_ensure_users(self, usernames: List[str], auth_keys: Dict[str, str],
+                                concurrency: int) -> AsyncIterator[Dict[str, Any]]:
+        # Uses the panel batch endpoint when one is configured
+        async for result in self.client.bulk_create_users(usernames, concurrency=concurrency, auth_keys=auth_keys):
+            yield result
+
+    async def bulk_set_status(self, usernames: List[str], enabled: bool,
+                              concurrency: int) -> AsyncIterator[Dict[str, Any]]:
+        async for result in self.client.bulk_set_status(usernames, enabled, concurrency=concurrency):
+            yield result
+
+
+class MarzbanNode(FleetNode):
+    """A Marzban panel (VLESS); its users have no hy2 auth key."""
+
+    kind = "marzban"
+
+    def __init__(self, name: str, client: MarzbanClient, host: str, port: int = 443, weight: float = 1.0,
+                 placement: bool = True):
+        super().__init__(name, host, port, weight, placement)
+        self.client = client
+
+    async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        return await self.client.get_user(username)
+
+    async def create_user(self, username: str, auth_key: Optional[str] = None) -> Dict[str, Any]:
+        return await self.client.create_user(username)
+
+    async def set_status(self, username: str, enabled: bool):
+        await self.client.set_status(username, enabled)
+
+    async def delete_user(self, username: str) -> bool:
+        return await self.client.delete_user(username)
+
+    async def fetch_load(self) -> Tuple[Optional[int], Optional[int]]:
+        system = await self.client.get_system_stats()
+        return (
+            int(system.get("online_users", 0)),
+            int(system.get("incoming_bandwidth", 0)) + int(system.get("outgoing_bandwidth", 0)),
+        )
+
+
+class Fleet:
+    """Places users on the least-loaded nodes and keeps their placement in user_nodes.
+
+    A node's load is its active sessions plus its traffic rate (one session
+    per TRAFFIC_PER_SESSION bytes/s), divided by its weight. Nodes that report
+    no sessions are scored by their number of active users instead. Loads
+    are sampled at most every `load_ttl` seconds; placements made since the
+    last sample count as one session each, so a burst of grants spreads out.
+    """
+
+    def __init__(self, nodes: List[FleetNode], db: Database, renderer: ConfigRenderer,
+                 replicas: int = DEFAULT_REPLICAS, load_ttl: float = DEFAULT_LOAD_TTL):
+        if not nodes:
+            raise ValueError("A fleet needs at least one node")
+        self.nodes: Dict[str, FleetNode] = {node.name: node for node in nodes}
+        self.db = db
+        self.renderer = renderer
+        self.replicas = max(1, replicas)
+        self.load_ttl = load_ttl
+        self._refresh_lock = asyncio.Lock()
+        self.last_rebalance: Optional[Dict[str, Any]] = None
+
+    @property
+    def default(self) -> FleetNode:
+        """The node that users placed before the fleet existed live on."""
+        return next(iter(self.nodes.values()))
+
+    def node(self, name: str) -> FleetNode:
+        if name not in self.nodes:
+            raise KeyError(f"Unknown fleet node: {name}")
+        return self.nodes[name]
+
+    async def refresh_loads(self, force: bool = False):
+        async with self._refresh_lock:
+            now = time.monotonic()
+            # A node never sampled (sampled_at 0) is always stale
+            if not force and all(n.sampled_at and now - n.sampled_at < self.load_ttl
+                                 for n in self.nodes.values()):
+                return
+            counts = await self.db.get_node_user_counts()
+            samples = await asyncio.gather(*(n.fetch_load() for n in self.nodes.values()), return_exceptions=True)
+            for node, sample in zip(self.nodes.values(), samples):
+                node.users = counts.get(node.name, 0)
+                node.pending = 0
+                if isinstance(sample, Exception):
+                    if node.healthy:
+                        logger.warning(f"Fleet node {node.name} load check failed: {sample}")
+                    node.healthy = False
+                    node.sampled_at = now
+                    continue
+                sessions, traffic = sample
+                if traffic is not None and node.traffic_bytes is not None and node.sampled_at:
+                    elapsed = max(now - node.sampled_at, 0.001)
+                    # A counter reset (node restart) reads as no traffic, not negative traffic
+                    node.traffic_rate = max(traffic - node.traffic_bytes, 0) / elapsed
+                node.sessions, node.traffic_bytes = sessions, traffic
+                node.healthy = True
+                node.sampled_at = now
+
+    def load(self, node: FleetNode) -> float:
+        """Unweighted load in session units."""
+        if node.sessions is None:
+            return float(node.users + node.pending)
+        return node.sessions + node.traffic_rate / TRAFFIC_PER_SESSION + node.pending
+
+    def score(self, node: FleetNode) -> float:
+        return self.load(node) / node.weight
+
+    def choose(self, count: int, exclude: Iterable[str] = (), hy2_only: bool = False) -> List[FleetNode]:
+        """Up to `count` placement candidates, least loaded first. Uses the last load sample."""
+        excluded = set(exclude)
+        candidates = [n for n in self.nodes.values()
+                      if n.placement and n.name not in excluded and (n.supports_hy2 or not hy2_only)]
+        healthy = [n for n in candidates if n.healthy] or candidates
+        # Ties go to the node with fewer users, then registry order
+        ranked = sorted(healthy, key=lambda n: (self.score(n), n.users / n.weight))
+        return ranked[:count]
+
+    async def place(self, count: Optional[int] = None) -> List[FleetNode]:
+        """The primary (always a Hysteria2 node, so every user gets a hy2 URL) and replicas."""
+        await self.refresh_loads()
+        primary = self.choose(1, hy2_only=True)
+        if not primary:
+            raise RuntimeError("No Hysteria2 fleet node accepts new users")
+        replicas = [n for n in self.choose(len(self.nodes)) if n is not primary[0]]
+        nodes = primary + replicas[:(count or self.replicas) - 1]
+        for node in nodes:
+            node.pending += 1
+        return nodes
+
+    async def nodes_for(self, corporate_id: str) -> List[FleetNode]:
+        names = await self.db.get_user_nodes(corporate_id)
+        return [self.nodes[n] for n in names if n in self.nodes] or [self.default]
+
+    async def provision(self, username: str, auth_key: Optional[str] = None) -> Tuple[str, List[str]]:
+        """Create the user on its primary and replica nodes with one shared auth key.
+
+        The primary is a Hysteria2 node and must succeed; a failing replica only costs failover
+        capacity. Returns (auth_key, placed node names, primary first).
+        """
+        nodes = await self.place()
+        primary, replicas = nodes[0], nodes[1:]
+        # Generated here so replicas share it even when the primary has no hy2 key
+        auth_key = auth_key or secrets.token_urlsafe(32)
+        user = await primary.ensure_user(username, auth_key)
+        auth_key = user.get("auth_key") or auth_key
+        placed = [primary.name]
+        for node, result in zip(replicas, await asyncio.gather(
+            *(n.ensure_user(username, auth_key) for n in replicas), return_exceptions=True
+        )):
+            if isinstance(result, Exception):
+                logger.warning(f"Replica of {username} on {node.name} failed: {result}")
+            else:
+                placed.append(node.name)
+        return auth_key, placed
+
+    async def bulk_provision(self, usernames: List[str], concurrency: int) -> AsyncIterator[Dict[str, Any]]:
+        """provision() for many users, yielding {username, ok, auth_key, nodes, error} as each finishes.
+
+        Primaries are created per node through the node's bulk path; each
+        user's replicas follow as soon as its primary is done.
+        """
+        usernames = list(dict.fromkeys(usernames))
+        if not usernames:
+            return
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        placement = {u: await self.place() for u in usernames}
+        keys = {u: secrets.token_urlsafe(32) for u in usernames}
+        groups: Dict[str, List[str]] = {}
+        for username, nodes in placement.items():
+            groups.setdefault(nodes[0].name, []).append(username)
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def finish(username: str, primary: Dict[str, Any]):
+            if not primary["ok"]:
+                await results.put({"username": username, "ok": False, "error": primary["error"],
+                                   "auth_key": None, "nodes": []})
+                return
+            auth_key = (primary.get("user") or {}).get("auth_key") or keys[username]
+            placed = [placement[username][0].name]
+            for node in placement[username][1:]:
+                try:
+                    async with semaphore:
+                        await node.ensure_user(username, auth_key)
+                    placed.append(node.name)
+                except Exception as e:
+                    logger.warning(f"Replica of {username} on {node.name} failed: {e}")
+            await results.put({"username": username, "ok": True, "error": None,
+                               "auth_key": auth_key, "nodes": placed})
+
+        async def run_group(node: FleetNode, group: List[str]):
+            reported = set()
+            followers = []
+            try:
+                async for result in node.bulk_ensure_users(group, keys, concurrency):
+                    reported.add(result["username"])
+                    followers.append(asyncio.ensure_future(finish(result["username"], result)))
+            except Exception as e:
+                for username in group:
+                    if username not in reported:
+                        await results.put({"username": username, "ok": False, "error": str(e),
+                                           "auth_key": None, "nodes": []})
+            await asyncio.gather(*followers)
+
+        runner = asyncio.ensure_future(asyncio.gather(
+            *(run_group(self.nodes[name], group) for name, group in groups.items())
+        ))
+        try:
+            for _ in usernames:
+                yield await results.get()
+        finally:
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+
+    async def set_status(self, corporate_id: str, username: str, enabled: bool):
+        """Enable/disable the user on every node it is placed on; raises the first failure."""
+        nodes = await self.nodes_for(corporate_id)
+        results = await asyncio.gather(*(n.set_status(username, enabled) for n in nodes), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def bulk_set_status(self, users: Dict[str, str], enabled: bool,
+                              concurrency: int) -> AsyncIterator[Dict[str, Any]]:
+        """Enable/disable users given as username -> corporate_id on all their nodes.
+
+        Yields {username, ok, error} once every node of a user has answered.
+        """
+        placements = await self.db.get_nodes_for(users.values())
+        pending: Dict[str, int] = {}
+        errors: Dict[str, List[str]] = {}
+        groups: Dict[str, List[str]] = {}
+        for username, corporate_id in users.items():
+            names = [n for n in placements.get(corporate_id, []) if n in self.nodes] or [self.default.name]
+            pending[username] = len(names)
+            for name in names:
+                groups.setdefault(name, []).append(username)
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def record(username: str, error: Optional[str]):
+            if error:
+                errors.setdefault(username, []).append(error)
+            pending[username] -= 1
+            if pending[username] == 0:
+                failed = errors.get(username)
+                await results.put({"username": username, "ok": not failed,
+                                   "error": "; ".join(failed) if failed else None})
+
+        async def run_group(node: FleetNode, group: List[str]):
+            reported = set()
+            try:
+                async for result in node.bulk_set_status(group, enabled, concurrency):
+                    reported.add(result["username"])
+                    await record(result["username"], None if result["ok"] else f"{node.name}: {result['error']}")
+            except Exception as e:
+                for username in group:
+                    if username not in reported:
+                        await record(username, f"{node.name}: {e}")
+
+        runner = asyncio.ensure_future(asyncio.gather(
+            *(run_group(self.nodes[name], group) for name, group in groups.items())
+        ))
+        try:
+            for _ in users:
+                yield await results.get()
+        finally:
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+
+    def hy2_urls_for(self, username: str, auth_key: str, node_names: List[str]) -> List[str]:
+        """One hy2:// entry per Hysteria2 node in `node_names`, in that order."""
+        nodes = [self.nodes[n] for n in node_names if n in self.nodes and self.nodes[n].supports_hy2]
+        return [
+            self.renderer.hy2_url(username, auth_key, n.host, n.port, label=n.name if i else "")
+            for i, n in enumerate(nodes)
+        ]
+
+    async def hy2_urls(self, user: Dict[str, Any]) -> List[str]:
+        """Subscription entries for a users row: its placed Hysteria2 nodes, primary first."""
+        if not user.get("hy2_auth_key"):
+            # Rows imported without a key keep their saved URL
+            return [user["hy2_url"]] if user.get("hy2_url") else []
+        nodes = await self.nodes_for(user["corporate_id"])
+        return self.hy2_urls_for(user["blitz_username"], user["hy2_auth_key"], [n.name for n in nodes])
+
+    async def plan_rebalance(self, threshold: float = DEFAULT_REBALANCE_THRESHOLD,
+                             max_moves: int = DEFAULT_MAX_MOVES) -> List[Dict[str, Any]]:
+        """Moves that bring nodes scoring above average * (1 + threshold) down toward the average."""
+        await self.db.assign_default_node(self.default.name)
+        await self.refresh_loads(force=True)
+        active = [n for n in self.nodes.values() if n.healthy]
+        if len(active) < 2:
+            return []
+        loads = {n.name: self.load(n) for n in active}
+        users = {n.name: n.users for n in active}
+
+        def score(name: str) -> float:
+            return loads[name] / self.nodes[name].weight
+
+        average = sum(score(n) for n in loads) / len(loads)
+        limit = average * (1 + threshold)
+        moves: List[Dict[str, Any]] = []
+        for source in sorted(loads, key=score, reverse=True):
+            if score(source) <= limit or not users[source]:
+                continue
+            # Moving a user sheds about an average user's share of the node's load
+            cost = loads[source] / users[source]
+            for user in await self.db.get_node_users(source, max_moves - len(moves)):
+                if score(source) <= average or len(moves) >= max_moves:
+                    break
+                placed = set(await self.db.get_user_nodes(user["corporate_id"]))
+                # Same kind only, so a user never loses its Hysteria2 slot to a Marzban node
+                targets = [t for t in loads if t not in placed and self.nodes[t].placement
+                           and self.nodes[t].kind == self.nodes[source].kind]
+                if not targets:
+                    continue
+                target = min(targets, key=score)
+                if (loads[target] + cost) / self.nodes[target].weight >= score(source):
+                    break
+                moves.append({"corporate_id": user["corporate_id"], "username": user["blitz_username"],
+                              "auth_key": user["hy2_auth_key"], "source": source, "target": target})
+                loads[source] -= cost
+                loads[target] += cost
+                users[source] -= 1
+                users[target] += 1
+        return moves
+
+    async def _move(self, move: Dict[str, Any]):
+        source, target = self.nodes[move["source"]], self.nodes[move["target"]]
+        # Create first so the user always exists somewhere; the subscription
+        # picks up the new node as soon as the placement row changes
+        await target.ensure_user(move["username"], move["auth_key"])
+        await self.db.move_user_node(move["corporate_id"], source.name, target.name)
+        await source.delete_user(move["username"])
+
+    async def rebalance(self, dry_run: bool = False, threshold: float = DEFAULT_REBALANCE_THRESHOLD,
+                        max_moves: int = DEFAULT_MAX_MOVES, concurrency: int = 8) -> Dict[str, Any]:
+        started = time.monotonic()
+        moves = await self.plan_rebalance(threshold, max_moves)
+        errors = []
+        if not dry_run and moves:
+            semaphore = asyncio.Semaphore(max(1, concurrency))
+
+            async def run(move: Dict[str, Any]):
+                async with semaphore:
+                    await self._move(move)
+
+            for move, result in zip(moves, await asyncio.gather(*(run(m) for m in moves), return_exceptions=True)):
+                if isinstance(result, Exception):
+                    errors.append({"username": move["username"], "error": str(result)})
+            await self.refresh_loads(force=True)
+        report = {
+            "dry_run": dry_run,
+            "moves": [{k: m[k] for k in ("corporate_id", "source", "target")} for m in moves],
+            "moved": 0 if dry_run else len(moves) - len(errors),
+            "failed": len(errors),
+            "errors": errors,
+            "nodes": self.stats(),
+            "duration_ms": round((time.monotonic() - started) * 1000, 1),
+        }
+        self.last_rebalance = {k: v for k, v in report.items() if k not in ("moves", "errors", "nodes")}
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: {**node.stats(), "score": round(self.score(node), 3)} for name, node in self.nodes.items()}
+
+
+def _blitz_client(suffix: str, api_url: str, api_token: str, renderer: ConfigRenderer, settings) -> BlitzClient:
+    # Configured here rather than in the app so CLI runs are paced too
+    limiter = get_rate_limiter(f"blitz{suffix}")
+    limiter.configure(
+        rate=settings.BLITZ_RATE_LIMIT_PER_SECOND,
+        burst=settings.BLITZ_RATE_LIMIT_BURST,
+        max_queue=settings.BLITZ_RATE_LIMIT_MAX_QUEUE,
+    )
+    return BlitzClient(
+        api_url,
+        api_token,
+        http=get_http_pool(f"blitz{suffix}"),
+        breaker=get_circuit_breaker(f"blitz{suffix}"),
+        lookup_timeout=settings.BLITZ_LOOKUP_TIMEOUT,
+        mutate_timeout=settings.BLITZ_MUTATE_TIMEOUT,
+        cache_ttl=settings.BLITZ_CACHE_TTL_SECONDS,
+        retry_attempts=settings.BLITZ_RETRY_ATTEMPTS,
+        renderer=renderer,
+        limiter=limiter,
+        batch_endpoints=parse_batch_endpoints(settings.BLITZ_BATCH_ENDPOINTS),
+    )
+
+
+def parse_nodes(spec: str) -> List[Dict[str, Any]]:
+    """FLEET_NODES: a JSON list of {name, kind, api_url, api_token, host, port,
+    weight, placement, traffic_url, traffic_secret} objects. `host`/`port` are
+    the public Hysteria2 address; for Marzban, `api_url` is the panel root."""
+    nodes = json.loads(spec) if spec.strip() else []
+    if not isinstance(nodes, list):
+        raise ValueError("FLEET_NODES must be a JSON list")
+    names = set()
+    for node in nodes:
+        if not node.get("name") or not node.get("api_url") or not node.get("host"):
+            raise ValueError(f"Fleet node needs name, api_url and host: {node}")
+        if node.get("kind", "blitz") not in NODE_KINDS:
+            raise ValueError(f"Unknown fleet node kind: {node.get('kind')}")
+        if node["name"] in names:
+            raise ValueError(f"Duplicate fleet node: {node['name']}")
+        names.add(node["name"])
+    if nodes and nodes[0].get("kind", "blitz") != "blitz":
+        raise ValueError("The first fleet node is the default node and must be a Blitz panel")
+    return nodes
+
+
+def build_fleet(settings, db: Database) -> Fleet:
+    """The node registry from settings; without FLEET_NODES, a single node for BLITZ_API_URL."""
+    renderer = ConfigRenderer(
+        settings.DOMAIN,
+        port=settings.HYSTERIA2_PORT,
+        sni=settings.HYSTERIA2_SNI,
+        upload_speed=settings.HYSTERIA2_UPLOAD_SPEED,
+        download_speed=settings.HYSTERIA2_DOWNLOAD_SPEED,
+        templates_dir=settings.CONFIG_TEMPLATES_DIR or None,
+        cache_size=settings.CONFIG_CACHE_SIZE,
+    )
+    specs = parse_nodes(settings.FLEET_NODES) or [{
+        "name": DEFAULT_NODE,
+        "api_url": settings.BLITZ_API_URL,
+        "api_token": settings.BLITZ_SECRET_KEY,
+        "host": settings.DOMAIN,
+        "port": settings.HYSTERIA2_PORT,
+        "traffic_url": settings.HYSTERIA2_TRAFFIC_URL,
+        "traffic_secret": settings.HYSTERIA2_TRAFFIC_SECRET,
+    }]
+    nodes: List[FleetNode] = []
+    for i, spec in enumerate(specs):
+        # The first node uses the plain "blitz"/"hysteria"/"marzban" pools and
+        # breaker (the ones HealthMonitor watches); extra nodes get their own
+        name = spec["name"]
+        suffix = "" if i == 0 else f":{name}"
+        common = {
+            "host": spec["host"],
+            "port": int(spec.get("port", 443)),
+            "weight": float(spec.get("weight", 1.0)),
+            "placement": bool(spec.get("placement", True)),
+        }
+        if spec.get("kind", "blitz") == "marzban":
+            client = MarzbanClient(spec["api_url"], spec.get("api_token", ""),
+                                   http=get_http_pool(f"marzban{suffix}"))
+            nodes.append(MarzbanNode(name, client, **common))
+        else:
+            client = _blitz_client(suffix, spec["api_url"], spec.get("api_token", ""), renderer, settings)
+            nodes.append(BlitzNode(name, client, traffic_url=spec.get("traffic_url", ""),
+                                   traffic_secret=spec.get("traffic_secret", ""),
+                                   http=get_http_pool(f"hysteria{suffix}"), **common))
+    return Fleet(nodes, db, renderer, replicas=settings.FLEET_REPLICAS, load_ttl=settings.FLEET_LOAD_TTL_SECONDS)
+
+
+@lru_cache()
+def get_fleet() -> Fleet:
+    settings = get_settings()
+    return build_fleet(settings, get_database(settings.DB_PATH))
+
+
+async def _main(args: argparse.Namespace):
+    settings = get_settings()
+    db = Database(args.db or settings.DB_PATH)
+    fleet = build_fleet(settings, db)
+    await db.connect()
+    try:
+        await db.init_db()
+        report = await fleet.rebalance(dry_run=args.dry_run, threshold=args.threshold, max_moves=args.max_moves)
+    finally:
+        await close_http_pools()
+        await db.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+def main(argv: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Fleet maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebalance = sub.add_parser("rebalance", help="Move users off nodes loaded above the fleet average")
+    rebalance.add_argument("--dry-run", action="store_true")
+    rebalance.add_argument("--threshold", type=float, default=DEFAULT_REBALANCE_THRESHOLD)
+    rebalance.add_argument("--max-moves", type=int, default=DEFAULT_MAX_MOVES)
+    rebalance.add_argument("--db", default="")
+    asyncio.run(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,193 @@
+import importlib.util
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE = 20
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 15.0
+DEFAULT_POOL_TIMEOUT = 10.0
+
+
+def http2_available() -> bool:
+    """httpx only speaks HTTP/2 when the optional `h2` package is installed."""
+    return importlib.util.find_spec("h2") is not None
+
+
+class HttpPool:
+    """One shared keep-alive httpx.AsyncClient for a single backend.
+
+    Opening a client per call costs a TCP (and TLS) handshake every time; this
+    keeps connections warm between calls, bounds how many are open at once and
+    applies default timeouts that callers can tighten per operation.
+    """
+
+    def __init__(self, name: str, max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 max_keepalive: int = DEFAULT_MAX_KEEPALIVE,
+                 keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+                 http2: bool = False,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 pool_timeout: float = DEFAULT_POOL_TIMEOUT,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.name = name
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_timeout = pool_timeout
+        # Tests inject httpx.MockTransport or a stub server transport here
+        self.transport = transport
+
+        self._client: Optional[httpx.AsyncClient] = None
+        # What the open client negotiates: http2 is only a request, h2 may be missing
+        self._http2_active = False
+        self._shut_down = False
+        self._in_flight = 0
+        self._stats = {
+            "requests": 0,
+            "errors": 0,
+            "max_in_flight": 0,
+            "total_ms": 0.0,
+        }
+
+    @property
+    def is_open(self) -> bool:
+        return self._client is not None
+
+    def timeout(self, read: Optional[float] = None, connect: Optional[float] = None) -> httpx.Timeout:
+        """Default timeouts with an optional per-operation read/connect override."""
+        read = read if read is not None else self.read_timeout
+        return httpx.Timeout(
+            connect=connect if connect is not None else self.connect_timeout,
+            read=read,
+            write=read,
+            pool=self.pool_timeout,
+        )
+
+    async def open(self, max_connections: Optional[int] = None, max_keepalive: Optional[int] = None,
+                   keepalive_expiry: Optional[float] = None, http2: Optional[bool] = None,
+                   connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None):
+        """Create the client. Overrides only apply if it is not open yet."""
+        if self._client is not None:
+            return
+        if max_connections is not None:
+            self.max_connections = max_connections
+        if max_keepalive is not None:
+            self.max_keepalive = max_keepalive
+        if keepalive_expiry is not None:
+            self.keepalive_expiry = keepalive_expiry
+        if http2 is not None:
+            self.http2 = http2
+        if connect_timeout is not None:
+            self.connect_timeout = connect_timeout
+        if read_timeout is not None:
+            self.read_timeout = read_timeout
+        http2 = self.http2
+        if http2 and not http2_available():
+            logger.warning(f"HTTP/2 requested for {self.name} but the h2 package is missing; using HTTP/1.1")
+            http2 = False
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            timeout=self.timeout(),
+            http2=http2,
+            transport=self.transport,
+        )
+        self._http2_active = http2
+        self._shut_down = False
+        logger.info(f"HTTP pool for {self.name} opened "
+                    f"(max_connections={self.max_connections}, keepalive={self.max_keepalive}, http2={http2})")
+
+    async def close(self):
+        """Close the client; the pool will not reopen lazily afterwards."""
+        self._shut_down = True
+        if self._client is None:
+            return
+        client, self._client = self._client, None
+        self._http2_active = False
+        await client.aclose()
+        logger.info(f"HTTP pool for {self.name} closed")
+
+    async def _ensure_open(self) -> httpx.AsyncClient:
+        if self._client is None:
+            if self._shut_down:
+                raise RuntimeError(f"HTTP pool for {self.name} is closed")
+            await self.open()
+        return self._client
+
+    async def request(self, method: str, url: str, *, read_timeout: Optional[float] = None,
+                      **kwargs: Any) -> httpx.Response:
+        """Send one request over the shared client. Does not raise on HTTP error statuses."""
+        client = await self._ensure_open()
+        self._in_flight += 1
+        self._stats["requests"] += 1
+        self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._in_flight)
+        started = time.perf_counter()
+        try:
+            return await client.request(method, url, timeout=self.timeout(read_timeout), **kwargs)
+        except httpx.HTTPError:
+            self._stats["errors"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            self._stats["total_ms"] += (time.perf_counter() - started) * 1000
+
+    def _connection_stats(self) -> Dict[str, int]:
+        # httpx does not expose pool occupancy publicly; read it from httpcore when we can
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return {}
+        return {
+            "connections": len(connections),
+            "connections_idle": sum(1 for c in connections if c.is_idle()),
+            "connections_http2": sum(1 for c in connections if "HTTP/2" in repr(c)),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self._stats["requests"]
+        return {
+            "name": self.name,
+            "open": self.is_open,
+            "http2": self.http2,
+            "http2_active": self._http2_active,
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            "in_flight": self._in_flight,
+            "max_in_flight": self._stats["max_in_flight"],
+            "requests": requests,
+            "errors": self._stats["errors"],
+            "avg_ms": round(self._stats["total_ms"] / requests, 3) if requests else 0.0,
+            **self._connection_stats(),
+        }
+
+
+_pools: Dict[str, HttpPool] = {}
+
+
+def get_http_pool(name: str) -> HttpPool:
+    """Process-wide pool per backend name, so every client of it shares connections."""
+    if name not in _pools:
+        _pools[name] = HttpPool(name)
+    return _pools[name]
+
+
+def http_pool_stats() -> Dict[str, Any]:
+    return {name: pool.stats() for name, pool in _pools.items()}
+
+
+async def close_http_pools():
+    for pool in _pools.values():
+        await pool.close()
@@ -0,0 +1,49 @@
+import re
+import secrets
+import string
+from typing import Iterable
+
+ID_LETTERS = "".join(c for c in string.ascii_uppercase if c not in "IO")
+ID_PATTERN = re.compile(r"^[A-HJ-NP-Z]{2}\d{6}$")
+
+
+def generate_corporate_id() -> str:
+    prefix = "".join(secrets.choice(ID_LETTERS) for _ in range(2))
+    digits = "".join(secrets.choice(string.digits) for _ in range(6))
+    return prefix + digits
+
+
+def encode_id(id_value: str) -> int:
+    """Pack an `AB123456` ID into one int (< 576M) so the index stays small."""
+    return (ID_LETTERS.index(id_value[0]) * len(ID_LETTERS) + ID_LETTERS.index(id_value[1])) * 1_000_000 \
+        + int(id_value[2:])
+
+
+class IssuedIdIndex:
+    """Exact in-memory set of every ID in id_registry.
+
+    Loaded once at startup and updated by every write path in this process,
+    it lets issuance skip taken candidates without a database round trip. IDs
+    written by another process (e.g. the import CLI) are only seen after a
+    reload, so a miss is no proof of absence: lookups go to the database.
+    """
+
+    def __init__(self):
+        self._ids = set()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, id_value: str) -> bool:
+        return ID_PATTERN.match(id_value) is not None and encode_id(id_value) in self._ids
+
+    def add(self, id_value: str):
+        if ID_PATTERN.match(id_value):
+            self._ids.add(encode_id(id_value))
+
+    def update(self, id_values: Iterable[str]):
+        for id_value in id_values:
+            self.add(id_value)
+
+    def reset(self):
+        self._ids = set()
@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = 24 * 3600
+MAX_KEY_LENGTH = 255
+
+
+class SingleFlight:
+    """Collapses concurrent work on the same key into one flight all callers await.
+
+    run() starts the work or joins the flight already running for the key.
+    begin() lets a caller that does the work itself (e.g. a bulk call) hold
+    the key and resolve the flight once its result is known.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats = {"started": 0, "joined": 0}
+
+    def _register(self, key: str, future: asyncio.Future) -> asyncio.Future:
+        self._inflight[key] = future
+        self._stats["started"] += 1
+
+        def _done(f: asyncio.Future):
+            if self._inflight.get(key) is f:
+                del self._inflight[key]
+            # Nobody may be left to await a failed flight; mark its error as seen
+            if not f.cancelled():
+                f.exception()
+
+        future.add_done_callback(_done)
+        return future
+
+    def running(self, key: str) -> Optional[asyncio.Future]:
+        return self._inflight.get(key)
+
+    def begin(self, key: str) -> Optional[asyncio.Future]:
+        """Hold `key` with a future the caller resolves; None if a flight is already running."""
+        if key in self._inflight:
+            return None
+        return self._register(key, asyncio.get_running_loop().create_future())
+
+    async def join(self, future: asyncio.Future) -> Any:
+        self._stats["joined"] += 1
+        # shield: a caller that goes away must not cancel the flight for the others
+        return await asyncio.shield(future)
+
+    async def run(self, key: str, work: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._inflight.get(key)
+        if future is not None:
+            return await self.join(future)
+        return await asyncio.shield(self._register(key, asyncio.ensure_future(work())))
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "in_flight": len(self._inflight)}
+
+
+class StoredResponse(NamedTuple):
+    status_code: int
+    body: Any
+
+
+class IdempotencyConflict(Exception):
+    """An Idempotency-Key was reused with a different request."""
+
+
+class IdempotencyStore:
+    """Responses stored under client-chosen Idempotency-Keys, replayed for `ttl_seconds`.
+
+    A key is bound to a fingerprint of the request it first came with; the
+    same key with another request is a conflict, not a replay. Only
+    responses worth replaying are stored: callers skip errors, so a retry
+    after a failure runs again.
+    """
+
+    def __init__(self, db: Database, scope: str, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        self.db = db
+        self.scope = scope
+        self.ttl_seconds = ttl_seconds
+        self._stats = {"replayed": 0, "stored": 0, "conflicts": 0}
+
+    @staticmethod
+    def validate_key(key: str):
+        if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+            raise ValueError(f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} printable characters")
+
+    @staticmethod
+    def fingerprint(request: Any) -> str:
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+    async def get(self, key: str, request: Any) -> Optional[StoredResponse]:
+        """The stored response for `key`, or None. Raises IdempotencyConflict on reuse."""
+        stored = await self.db.get_idempotent_response(self.scope, key)
+        if stored is None:
+            return None
+        if stored["fingerprint"] != self.fingerprint(request):
+            self._stats["conflicts"] += 1
+            raise IdempotencyConflict(f"Idempotency-Key {key!r} was used with a different request")
+        self._stats["replayed"] += 1
+        return StoredResponse(stored["status_code"], json.loads(stored["response"]))
+
+    async def save(self, key: str, request: Any, status_code: int, body: Any):
+        stored = await self.db.save_idempotent_response(
+            self.scope, key, self.fingerprint(request), status_code,
+            json.dumps(body, default=str), self.ttl_seconds,
+        )
+        if stored:
+            self._stats["stored"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "ttl_seconds": self.ttl_seconds}
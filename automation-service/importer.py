@@ -0,0 +1,199 @@
+"""Bulk import of users and corporate IDs from CSV or NDJSON.
+
+Used by the POST /admin/import/{kind} endpoint and as a CLI:
+
+    python importer.py ids departments.csv --db /app/data/users.db
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from database import Database, ID_STATUSES
+from id_index import ID_PATTERN
+
+logger = logging.getLogger(__name__)
+
+IMPORT_KINDS = ("users", "ids")
+DEFAULT_CHUNK_SIZE = 2000
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportReport:
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def add_error(self, line: int, error: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": error})
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "rows": self.rows,
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda e: e["line"]),
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a byte stream into decoded lines without buffering the whole body."""
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if pending:
+        yield pending.decode("utf-8-sig").rstrip("\r")
+
+
+async def iter_records(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[Tuple[int, Any]]:
+    """Yield (line_number, record) pairs; record is a dict or an error string.
+
+    CSV rows are parsed line by line, so quoted fields must not span lines.
+    """
+    header: Optional[List[str]] = None
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        if not line.strip():
+            continue
+        if fmt == "ndjson":
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, f"invalid JSON: {e}"
+                continue
+            yield line_no, record if isinstance(record, dict) else "expected a JSON object"
+        else:
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [h.strip() for h in values]
+                continue
+            if len(values) != len(header):
+                yield line_no, f"expected {len(header)} columns, got {len(values)}"
+                continue
+            yield line_no, dict(zip(header, values))
+
+
+def _clean(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def validate_user(record: Dict[str, Any]) -> Tuple[Optional[tuple], Optional[str]]:
+    corporate_id = _clean(record.get("corporate_id"))
+    if not corporate_id:
+        return None, "corporate_id is required"
+    is_active = _clean(record.get("is_active"))
+    # None (no column or an empty cell) keeps an existing user's flag; new users start active
+    active = None if is_active is None else int(is_active.lower() in ("1", "true", "yes"))
+    return (
+        corporate_id,
+        _clean(record.get("blitz_username")) or f"corp_{corporate_id}",
+        _clean(record.get("hy2_auth_key")),
+        _clean(record.get("subscription_url")),
+        _clean(record.get("hy2_url")),
+        _clean(record.get("telegram_id")),
+        active,
+    ), None
+
+
+def validate_id(record: Dict[str, Any]) -> Tuple[Optional[tuple], Optional[str]]:
+    id_value = (_clean(record.get("id")) or "").upper()
+    if not ID_PATTERN.match(id_value):
+        return None, f"invalid ID format: {id_value!r}"
+    status = (_clean(record.get("status")) or "issued").lower()
+    if status not in ID_STATUSES:
+        return None, f"invalid status: {status!r}"
+    return (id_value, _clean(record.get("owner")) or "", status), None
+
+
+async def run_import(db: Database, kind: str, lines: AsyncIterator[str], fmt: str = "csv",
+                     chunk_size: int = DEFAULT_CHUNK_SIZE, actor: str = "import") -> Dict[str, Any]:
+    """Validate and upsert records in chunked transactions, collecting per-row errors."""
+    if kind not in IMPORT_KINDS:
+        raise ValueError(f"Unknown import kind: {kind}")
+    validate = validate_user if kind == "users" else validate_id
+    report = ImportReport(kind)
+    chunk: List[Tuple[int, tuple]] = []
+
+    async def flush():
+        if kind == "users":
+            errors = await db.bulk_upsert_users(chunk)
+        else:
+            errors = await db.bulk_upsert_ids(chunk, actor)
+        for line, error in errors:
+            report.add_error(line, error)
+        report.imported += len(chunk) - len(errors)
+        chunk.clear()
+
+    async for line_no, record in iter_records(lines, fmt):
+        report.rows += 1
+        if isinstance(record, str):
+            report.add_error(line_no, record)
+            continue
+        values, error = validate(record)
+        if error:
+            report.add_error(line_no, error)
+            continue
+        chunk.append((line_no, values))
+        if len(chunk) >= chunk_size:
+            await flush()
+    if chunk:
+        await flush()
+
+    logger.info(f"Import of {kind}: {report.imported}/{report.rows} rows, {report.failed} errors")
+    return report.as_dict()
+
+
+async def _file_lines(path: str) -> AsyncIterator[str]:
+    with open(path, encoding="utf-8-sig") as f:
+        for i, line in enumerate(f):
+            yield line.rstrip("\r\n")
+            if i % 10000 == 0:
+                # Let the write-behind flusher and other tasks run
+                await asyncio.sleep(0)
+
+
+def _detect_format(path: str) -> str:
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+async def _main(args: argparse.Namespace):
+    db = Database(args.db)
+    await db.connect()
+    try:
+        await db.init_db()
+        report = await run_import(db, args.kind, _file_lines(args.path),
+                                  args.format or _detect_format(args.path), args.chunk_size, actor="cli")
+    finally:
+        await db.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+def main(argv: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Bulk import users or corporate IDs")
+    parser.add_argument("kind", choices=IMPORT_KINDS)
+    parser.add_argument("path", help="CSV or NDJSON file")
+    parser.add_argument("--format", choices=("csv", "ndjson"))
+    parser.add_argument("--db", default="/app/data/users.db")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    asyncio.run(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,18 +1,29 @@
-from fastapi import FastAPI, HTTPException, Header, Depends
+from fastapi import FastAPI, HTTPException, Header, Depends, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from contextlib import asynccontextmanager
 import asyncio
+import json
 import logging
-from typing import Optional
+from typing import AsyncIterator, Dict, List, Optional
 from pydantic import BaseModel
-import qrcode
-import io
 import base64
+import hashlib
 
 from config import get_settings
-from database import Database
-from blitz_client import BlitzClient
+from database import get_database
+from config_renderer import TEMPLATE_FILES
+from circuit_breaker import CircuitOpenError, circuit_breaker_stats
+from fleet import BlitzNode, get_fleet
+from http_pool import close_http_pools, get_http_pool, http_pool_stats
+from rate_limiter import RateLimitedError, rate_limiter_stats
 from telegram_2fa import Telegram2FA
 from monitor import HealthMonitor
+from reconcile import ReconciliationEngine
+from retention import RetentionEngine, default_policies
+from idempotency import IdempotencyConflict, IdempotencyStore, SingleFlight
+from importer import IMPORT_KINDS, iter_lines, run_import
+from qr_service import FORMATS as QR_FORMATS, get_qr_service
+from traffic_sync import TrafficSyncEngine
 
 from logger import setup_logging
 
@@ -21,18 +32,105 @@ setup_logging()
 logger = logging.getLogger(__name__)
 
 settings = get_settings()
-db = Database(settings.DB_PATH)
-blitz = BlitzClient(
-    settings.BLITZ_API_URL,
-    settings.BLITZ_SECRET_KEY
-)
+db = get_database(settings.DB_PATH)
+fleet = get_fleet()
+renderer = fleet.renderer
+# One provisioning flow per corporate ID at a time, shared by all its callers
+grant_flights = SingleFlight()
+idempotency = IdempotencyStore(db, "access/grant", ttl_seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+qr = get_qr_service()
+# The default node's client: subscription URLs and the lookup cache metrics
+blitz = fleet.default.client
+blitz_nodes = [node for node in fleet.nodes.values() if isinstance(node, BlitzNode)]
+
+async def _forget_qr(user: dict):
+    # Cached QR codes encode the auth key; drop them once it no longer grants access
+    for url in await fleet.hy2_urls(user):
+        await qr.forget(url)
+
+# One traffic sync and reconciliation pass per Blitz node
+traffic_syncs = {
+    node.name: TrafficSyncEngine(
+        db,
+        node.client,
+        traffic_url=node.traffic_url,
+        traffic_secret=node.traffic_secret,
+        interval_seconds=settings.TRAFFIC_SYNC_INTERVAL_SECONDS,
+        concurrency=settings.TRAFFIC_SYNC_CONCURRENCY,
+        http=node.http,
+        node=node.name,
+        default_node=node is fleet.default,
+    )
+    for node in blitz_nodes
+}
+reconcilers = {
+    node.name: ReconciliationEngine(
+        db,
+        node.client,
+        page_size=settings.RECONCILE_PAGE_SIZE,
+        concurrency=settings.RECONCILE_CONCURRENCY,
+        dry_run=settings.RECONCILE_DRY_RUN,
+        max_restore_fraction=settings.RECONCILE_MAX_RESTORE_FRACTION,
+        on_revoked=_forget_qr,
+        interval_seconds=settings.RECONCILE_INTERVAL_SECONDS,
+        node=node.name,
+        default_node=node is fleet.default,
+    )
+    for node in blitz_nodes
+}
+for node in blitz_nodes:
+    node.client.breaker.configure(
+        failure_threshold=settings.BLITZ_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=settings.BLITZ_BREAKER_RESET_SECONDS,
+    )
 telegram_2fa = Telegram2FA()
+retention = RetentionEngine(
+    db,
+    default_policies(
+        auth_logs_days=settings.RETENTION_AUTH_LOGS_DAYS,
+        monitor_events_days=settings.RETENTION_MONITOR_EVENTS_DAYS,
+        traffic_stats_days=settings.RETENTION_TRAFFIC_STATS_DAYS,
+        webhook_events_days=settings.RETENTION_WEBHOOK_EVENTS_DAYS,
+        traffic_hourly_days=settings.RETENTION_TRAFFIC_HOURLY_DAYS,
+    ),
+    chunk_size=settings.RETENTION_CHUNK_SIZE,
+    interval_seconds=settings.RETENTION_INTERVAL_SECONDS,
+    pruners={"qr_cache": qr.prune},
+)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Initializing Database...")
+    await db.connect(
+        readers=settings.DB_POOL_READERS,
+        mmap_size=settings.DB_MMAP_SIZE,
+        cache_size_kb=settings.DB_CACHE_SIZE_KB,
+        write_batch_size=settings.DB_WRITE_BATCH_SIZE,
+        write_batch_ms=settings.DB_WRITE_BATCH_MS,
+        write_queue_size=settings.DB_WRITE_QUEUE_SIZE,
+        user_cache_size=settings.USER_CACHE_SIZE,
+        user_cache_ttl=settings.USER_CACHE_TTL_SECONDS,
+        telemetry_db_path=settings.TELEMETRY_DB_PATH or None,
+    )
     await db.init_db()
+    renderer.load()
+    # Users granted before the fleet existed live on the default node
+    await db.assign_default_node(fleet.default.name)
+
+    logger.info("Opening panel HTTP pools...")
+    pools = {get_http_pool(backend) for backend in ("blitz", "marzban", "hysteria")}
+    pools.update(node.client.http for node in fleet.nodes.values())
+    pools.update(node.http for node in blitz_nodes)
+    for pool in pools:
+        await pool.open(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive=settings.HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            http2=settings.HTTP2_ENABLED,
+            connect_timeout=settings.HTTP_CONNECT_TIMEOUT,
+            read_timeout=settings.HTTP_READ_TIMEOUT,
+        )
     
     logger.info("Starting Telegram Bot...")
     # Run bot in background
@@ -40,115 +138,189 @@ async def lifespan(app: FastAPI):
     logger.info("Starting Health Monitor...")
     monitor = HealthMonitor(db, telegram_2fa)
     await monitor.start()
+    await retention.start()
+    for engine in (*traffic_syncs.values(), *reconcilers.values()):
+        await engine.start()
     
     yield
     
     # Shutdown
     logger.info("Shutting down...")
+    await monitor.stop()
+    await retention.stop()
+    for engine in (*traffic_syncs.values(), *reconcilers.values()):
+        await engine.stop()
+    await close_http_pools()
+    qr.close()
+    await db.close()
 
 app = FastAPI(lifespan=lifespan)
 
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    # Shed load while the panel is down instead of waiting on timeouts
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, int(exc.retry_after)))},
+    )
+
+@app.exception_handler(RateLimitedError)
+async def rate_limited_handler(request: Request, exc: RateLimitedError):
+    # Too many panel calls already queued; the caller should come back later
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, int(exc.retry_after)))},
+    )
+
 class GrantAccessRequest(BaseModel):
     corporate_id: str
+    # False leaves qr_code empty; clients fetch /user/{id}/qr instead
+    include_qr: bool = True
 
 class GrantAccessResponse(BaseModel):
     corporate_id: str
     username: str
     subscription_url: str
     hy2_url: str
-    qr_code: str
+    qr_code: Optional[str] = None
+
+class IssueIdsRequest(BaseModel):
+    owners: List[str]
+    actor: str = "api"
+
+class BatchUsersRequest(BaseModel):
+    corporate_ids: List[str]
 
 class UserConfigResponse(BaseModel):
     corporate_id: str
     username: str
     hy2_url: str
     subscription_url: str
-    qr_code: str
+    qr_code: Optional[str] = None
     traffic_stats: dict
+    client_config: Optional[dict] = None
+
+async def _hy2_url(user: dict) -> str:
+    # Rendered for the user's primary node from the stored auth key
+    urls = await fleet.hy2_urls(user)
+    return urls[0] if urls else ""
+
+# Downloads are per user and change when the key or node does: revalidate every time
+DOWNLOAD_CACHE_CONTROL = "private, no-cache"
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # Weak comparison, as RFC 9110 prescribes for If-None-Match
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+async def _conditional(request: Request, etag: str, media_type: str, body, headers: Optional[dict] = None) -> Response:
+    """304 if the client already has `etag`, else the awaited `body()` with cache headers."""
+    headers = {"ETag": etag, "Cache-Control": DOWNLOAD_CACHE_CONTROL, **(headers or {})}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=await body(), media_type=media_type, headers=headers)
+
+async def _existing_grant(user: dict) -> dict:
+    return {
+        "corporate_id": user["corporate_id"],
+        "status": "existing",
+        "username": user["blitz_username"],
+        "subscription_url": user["subscription_url"],
+        "hy2_url": await _hy2_url(user),
+    }
+
+async def _record_grant(corporate_id: str, username: str, hy2_auth_key: str, nodes: List[str]) -> dict:
+    # Rendered locally, no further panel calls
+    hy2_urls = fleet.hy2_urls_for(username, hy2_auth_key, nodes)
+    hy2_url = hy2_urls[0] if hy2_urls else ""
+    subscription_url = await blitz.get_subscription_url(username)
+    await db.add_user(
+        corporate_id=corporate_id,
+        blitz_username=username,
+        subscription_url=subscription_url,
+        hy2_url=hy2_url,
+        hy2_auth_key=hy2_auth_key,
+    )
+    await db.set_user_nodes(corporate_id, nodes)
+    return {
+        "corporate_id": corporate_id,
+        "status": "granted",
+        "username": username,
+        "subscription_url": subscription_url,
+        "hy2_url": hy2_url,
+    }
+
+async def _grant(corporate_id: str) -> dict:
+    """Provision one corporate ID; run through grant_flights so it happens once at a time."""
+    existing_user = await db.get_user(corporate_id)
+    if existing_user:
+        return await _existing_grant(existing_user)
+
+    # Create the Hysteria2 user on the least-loaded node plus failover replicas
+    try:
+        username = f"corp_{corporate_id}"
+        hy2_auth_key, nodes = await fleet.provision(username)
+        return await _record_grant(corporate_id, username, hy2_auth_key, nodes)
+    except (CircuitOpenError, RateLimitedError):
+        raise
+    except Exception as e:
+        logger.error(f"Error granting access: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/access/grant", response_model=GrantAccessResponse)
 async def grant_access(
     request: GrantAccessRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
 ):
+    """
+    Grant access to one corporate ID, or return the existing grant.
+
+    Concurrent grants for the same ID share one provisioning flow. With an
+    Idempotency-Key, the first successful response is stored and replayed
+    to retries with the same key and body.
+    """
     if x_corporate_secret != settings.CORPORATE_SECRET:
         raise HTTPException(status_code=403, detail="Invalid corporate secret")
 
-    corporate_id = request.corporate_id
-    username = f"corp_{corporate_id}"
-    
-    # Check if user already exists in DB
-    existing_user = await db.get_user(corporate_id)
-    if existing_user:
-        # Generate QR code for existing user
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(existing_user.get("hy2_url", ""))
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        qr_code = base64.b64encode(buffer.getvalue()).decode()
-        
-        return GrantAccessResponse(
-            corporate_id=existing_user["corporate_id"],
-            username=existing_user["blitz_username"],
-            subscription_url=existing_user["subscription_url"],
-            hy2_url=existing_user.get("hy2_url", ""),
-            qr_code=qr_code
-        )
+    body = request.model_dump()
+    if idempotency_key is not None:
+        try:
+            idempotency.validate_key(idempotency_key)
+            stored = await idempotency.get(idempotency_key, body)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except IdempotencyConflict as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        if stored is not None:
+            return JSONResponse(stored.body, status_code=stored.status_code,
+                                headers={"Idempotent-Replayed": "true"})
 
-    # Create Hysteria2 user in Blitz
-    try:
-        # Check if user exists in Blitz
-        user = await blitz.get_user(username)
-        if not user:
-            created_user = await blitz.create_user(username)
-            hy2_auth_key = created_user.get("auth_key")
-        else:
-            hy2_auth_key = user.get("auth_key")
-        
-        # Get Hysteria2 configuration
-        hy2_url = await blitz.get_hy2_url(username)
-        subscription_url = await blitz.get_subscription_url(username)
-        if not hy2_auth_key:
-            refreshed = await blitz.get_user(username)
-            hy2_auth_key = (refreshed or {}).get("auth_key", "")
-        
-        # Generate QR code
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(hy2_url)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        qr_code = base64.b64encode(buffer.getvalue()).decode()
-        
-        # Save to DB
-        await db.add_user(
-            corporate_id=corporate_id,
-            blitz_username=username,
-            subscription_url=subscription_url,
-            hy2_url=hy2_url,
-            hy2_auth_key=hy2_auth_key,
-        )
-        
-        return GrantAccessResponse(
-            corporate_id=corporate_id,
-            username=username,
-            subscription_url=subscription_url,
-            hy2_url=hy2_url,
-            qr_code=qr_code
-        )
+    corporate_id = request.corporate_id
+    grant = await grant_flights.run(corporate_id, lambda: _grant(corporate_id))
 
-    except Exception as e:
-        logger.error(f"Error granting access: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    response = GrantAccessResponse(
+        corporate_id=grant["corporate_id"],
+        username=grant["username"],
+        subscription_url=grant["subscription_url"],
+        hy2_url=grant["hy2_url"],
+        # Cached by content and rendered off the event loop
+        qr_code=await qr.png_base64(grant["hy2_url"]) if request.include_qr else None,
+    )
+    if idempotency_key is not None:
+        await idempotency.save(idempotency_key, body, 200, response.model_dump())
+    return response
 
 @app.get("/user/{corporate_id}/config", response_model=UserConfigResponse)
 async def get_user_config(
     corporate_id: str,
+    client: Optional[str] = Query(None, pattern=f"^({'|'.join(TEMPLATE_FILES)})$"),
+    include_qr: bool = Query(True),
     x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
 ):
     if x_corporate_secret != settings.CORPORATE_SECRET:
@@ -158,32 +330,87 @@ async def get_user_config(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Get traffic stats from Blitz
-    try:
-        stats = await blitz.get_user_stats(user["blitz_username"])
-    except Exception as e:
-        logger.error(f"Error getting user stats: {e}")
-        stats = {"upload": 0, "download": 0}
-    
-    # Generate QR code
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(user.get("hy2_url", ""))
-    qr.make(fit=True)
+    # Traffic stats come from the local daily rollups, not a live Blitz call
+    stats = await db.get_user_traffic_summary(corporate_id)
     
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffer = io.BytesIO()
-    img.save(buffer, format="PNG")
-    qr_code = base64.b64encode(buffer.getvalue()).decode()
+    # Everything below is rendered from local data: no Blitz calls
+    hy2_url = await _hy2_url(user)
+    client_config = None
+    primary = next((n for n in await fleet.nodes_for(corporate_id) if n.supports_hy2), None)
+    if client and user.get("hy2_auth_key") and primary:
+        try:
+            client_config = renderer.render(user["blitz_username"], user["hy2_auth_key"], client,
+                                            host=primary.host, port=primary.port)
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+
+    # Cached by content and rendered off the event loop
+    qr_code = await qr.png_base64(hy2_url) if include_qr else None
     
     return UserConfigResponse(
         corporate_id=user["corporate_id"],
             username=user["blitz_username"],
-        hy2_url=user.get("hy2_url", ""),
+        hy2_url=hy2_url,
         subscription_url=user["subscription_url"],
         qr_code=qr_code,
-        traffic_stats=stats
+        traffic_stats=stats,
+        client_config=client_config,
     )
 
+@app.get("/user/{corporate_id}/qr")
+async def get_user_qr(
+    corporate_id: str,
+    request: Request,
+    format: str = Query("png", pattern=f"^({'|'.join(QR_FORMATS)})$"),
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    """The hy2 URL QR code as an image; answers 304 to a matching If-None-Match."""
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+
+    user = await db.get_user(corporate_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    hy2_url = await _hy2_url(user)
+    if not hy2_url:
+        raise HTTPException(status_code=404, detail="User has no hy2 URL")
+
+    # The QR cache key hashes the hy2 URL and render options: a strong validator
+    return await _conditional(request, f'"{qr.key(hy2_url, format)}"', QR_FORMATS[format],
+                              lambda: qr.render(hy2_url, format))
+
+@app.get("/user/{corporate_id}/config/download")
+async def download_user_config(
+    corporate_id: str,
+    request: Request,
+    client: str = Query("hysteria2", pattern=f"^({'|'.join(TEMPLATE_FILES)})$"),
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    """The client config as a JSON file; answers 304 to a matching If-None-Match."""
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+
+    user = await db.get_user(corporate_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    primary = next((n for n in await fleet.nodes_for(corporate_id) if n.supports_hy2), None)
+    if not user.get("hy2_auth_key") or not primary:
+        raise HTTPException(status_code=404, detail="User has no Hysteria2 config")
+    try:
+        # Memoized by ConfigRenderer; hashing the text covers key, server and template version
+        text = renderer.render_text(user["blitz_username"], user["hy2_auth_key"], client,
+                                    host=primary.host, port=primary.port)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    async def body() -> bytes:
+        return text.encode()
+
+    etag = f'"{hashlib.sha256(text.encode()).hexdigest()[:32]}"'
+    filename = f"{user['blitz_username']}_{client}.json"
+    return await _conditional(request, etag, "application/json", body,
+                              {"Content-Disposition": f'attachment; filename="{filename}"'})
+
 @app.post("/user/{corporate_id}/deactivate")
 async def deactivate_user(
     corporate_id: str,
@@ -197,18 +424,231 @@ async def deactivate_user(
         raise HTTPException(status_code=404, detail="User not found")
     
     try:
-        # Deactivate in Blitz
-        await blitz.update_user_status(user["blitz_username"], False)
+        # Deactivate on every node the user is placed on
+        await fleet.set_status(corporate_id, user["blitz_username"], False)
         
         # Deactivate in database
         await db.deactivate_user(corporate_id)
+        await _forget_qr(user)
         
         return {"status": "deactivated", "corporate_id": corporate_id}
         
+    except (CircuitOpenError, RateLimitedError):
+        raise
     except Exception as e:
         logger.error(f"Error deactivating user: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/user/{corporate_id}/subscription", response_class=PlainTextResponse)
+async def get_subscription(
+    corporate_id: str,
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    """Base64 subscription with one hy2:// entry per node the user is placed on."""
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+
+    user = await db.get_user(corporate_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    urls = await fleet.hy2_urls(user)
+    return PlainTextResponse(base64.b64encode("\n".join(urls).encode()).decode())
+
+def _ndjson(items: AsyncIterator[dict]) -> StreamingResponse:
+    async def stream():
+        async for item in items:
+            yield json.dumps(item, default=str) + "\n"
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+async def _grant_batch(corporate_ids: List[str]) -> AsyncIterator[dict]:
+    pending = {}
+    # IDs this batch provisions hold their grant_flights key, so a concurrent
+    # single grant waits for the batch; IDs already in flight are joined
+    flights: Dict[str, asyncio.Future] = {}
+    joined: Dict[str, asyncio.Future] = {}
+    for corporate_id in dict.fromkeys(corporate_ids):
+        running = grant_flights.running(corporate_id)
+        if running is not None:
+            joined[corporate_id] = running
+            continue
+        existing_user = await db.get_user(corporate_id)
+        if existing_user:
+            yield await _existing_grant(existing_user)
+            continue
+        flight = grant_flights.begin(corporate_id)
+        if flight is None:
+            joined[corporate_id] = grant_flights.running(corporate_id)
+            continue
+        flights[corporate_id] = flight
+        pending[f"corp_{corporate_id}"] = corporate_id
+
+    try:
+        async for result in fleet.bulk_provision(list(pending), concurrency=settings.BLITZ_BULK_CONCURRENCY):
+            username = result["username"]
+            corporate_id = pending[username]
+            if not result["ok"]:
+                flights[corporate_id].set_exception(HTTPException(status_code=500, detail=result["error"]))
+                yield {"corporate_id": corporate_id, "status": "error", "error": result["error"]}
+                continue
+            try:
+                item = await _record_grant(corporate_id, username, result["auth_key"], result["nodes"])
+            except Exception as e:
+                logger.error(f"Error granting access to {corporate_id}: {e}")
+                flights[corporate_id].set_exception(HTTPException(status_code=500, detail=str(e)))
+                yield {"corporate_id": corporate_id, "status": "error", "error": str(e)}
+                continue
+            flights[corporate_id].set_result(item)
+            yield item
+    finally:
+        # e.g. the client dropped the stream: release anyone waiting on the rest
+        for flight in flights.values():
+            if not flight.done():
+                flight.set_exception(HTTPException(status_code=500, detail="Batch grant interrupted"))
+
+    for corporate_id, flight in joined.items():
+        try:
+            yield await grant_flights.join(flight)
+        except HTTPException as e:
+            yield {"corporate_id": corporate_id, "status": "error", "error": e.detail}
+        except Exception as e:
+            yield {"corporate_id": corporate_id, "status": "error", "error": str(e)}
+
+@app.post("/access/grant/batch")
+async def grant_access_batch(
+    request: BatchUsersRequest,
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    """
+    Grant access to many corporate IDs at once.
+
+    Streams one NDJSON line per ID as soon as it is done, with status
+    existing, granted or error. QR codes are not included; fetch them per user.
+    """
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+
+    return _ndjson(_grant_batch(request.corporate_ids))
+
+async def _deactivate_batch(corporate_ids: List[str]) -> AsyncIterator[dict]:
+    pending = {}
+    users = {}
+    for corporate_id in dict.fromkeys(corporate_ids):
+        user = await db.get_user(corporate_id)
+        if not user:
+            yield {"corporate_id": corporate_id, "status": "error", "error": "User not found"}
+        else:
+            pending[user["blitz_username"]] = corporate_id
+            users[corporate_id] = user
+
+    async for result in fleet.bulk_set_status(pending, False, concurrency=settings.BLITZ_BULK_CONCURRENCY):
+        corporate_id = pending[result["username"]]
+        if not result["ok"]:
+            yield {"corporate_id": corporate_id, "status": "error", "error": result["error"]}
+            continue
+        await db.deactivate_user(corporate_id)
+        await _forget_qr(users[corporate_id])
+        yield {"corporate_id": corporate_id, "status": "deactivated"}
+
+@app.post("/user/deactivate/batch")
+async def deactivate_users_batch(
+    request: BatchUsersRequest,
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    """Deactivate many users; streams one NDJSON result line per corporate ID."""
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+
+    return _ndjson(_deactivate_batch(request.corporate_ids))
+
+@app.post("/admin/import/{kind}")
+async def bulk_import(
+    kind: str,
+    request: Request,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    """Stream a CSV/NDJSON body into users or id_registry; bad rows are reported, not fatal."""
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+    if kind not in IMPORT_KINDS:
+        raise HTTPException(status_code=404, detail="Unknown import kind")
+
+    return await run_import(db, kind, iter_lines(request.stream()), format, actor="api")
+
+@app.post("/admin/ids/issue")
+async def issue_ids(
+    request: IssueIdsRequest,
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+    if not request.owners:
+        raise HTTPException(status_code=400, detail="No owners given")
+
+    try:
+        issued = await db.issue_ids(request.owners, request.actor)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"issued": [{"id": id_value, "owner": owner} for id_value, owner in issued]}
+
+@app.post("/admin/reconcile")
+async def reconcile(
+    dry_run: bool = Query(True),
+    force: bool = Query(False),
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    """Compare users with every Blitz node; repairs drift unless dry_run (the default).
+
+    force applies plans the mass-restore guard would refuse.
+    """
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+    if any(engine.running for engine in reconcilers.values()):
+        raise HTTPException(status_code=409, detail="Reconciliation already running")
+
+    return {name: await engine.run_once(dry_run=dry_run, force=force) for name, engine in reconcilers.items()}
+
+@app.post("/admin/fleet/rebalance")
+async def rebalance_fleet(
+    dry_run: bool = Query(True),
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    """Move users off nodes loaded above the fleet average; only plans unless dry_run is false."""
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+
+    return await fleet.rebalance(
+        dry_run=dry_run,
+        threshold=settings.FLEET_REBALANCE_THRESHOLD,
+        max_moves=settings.FLEET_REBALANCE_MAX_MOVES,
+        concurrency=settings.BLITZ_BULK_CONCURRENCY,
+    )
+
+@app.get("/metrics")
+async def get_metrics(
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+
+    return {
+        "db_pool": db.pool_stats(),
+        "user_cache": db.user_cache.stats(),
+        "http_pools": http_pool_stats(),
+        "blitz_cache": blitz.cache_stats(),
+        "config_renderer": renderer.stats(),
+        "qr": qr.stats(),
+        "grant_flights": grant_flights.stats(),
+        "idempotency": idempotency.stats(),
+        "circuit_breakers": circuit_breaker_stats(),
+        "rate_limiters": rate_limiter_stats(),
+        "retention": retention.last_report,
+        "traffic_sync": {name: engine.last_report for name, engine in traffic_syncs.items()},
+        "reconcile": {name: engine.last_report for name, engine in reconcilers.items()},
+        "fleet": {"nodes": fleet.stats(), "last_rebalance": fleet.last_rebalance},
+    }
+
 @app.get("/health")
 async def health_check():
     return {
@@ -221,3 +661,5 @@ async def health_check():
 # Include webhook routes
 from webhooks import router as webhook_router
 app.include_router(webhook_router)
+from exports import router as export_router
+app.include_router(export_router)
@@ -2,11 +2,15 @@ import httpx
 from typing import Optional, Dict, Any
 import logging
 
+from http_pool import HttpPool, get_http_pool
+
 logger = logging.getLogger(__name__)
 
 class MarzbanClient:
-    def __init__(self, base_url: str, api_token: str):
+    def __init__(self, base_url: str, api_token: str, *, http: Optional[HttpPool] = None):
         self.base_url = base_url.rstrip('/')
+        # Shared keep-alive client, opened and closed by the app lifespan
+        self.http = http or get_http_pool("marzban")
         self.headers = {
             # Blitz expects exact token match, no Bearer prefix
             "Authorization": f"{api_token}",
@@ -30,24 +34,47 @@ class MarzbanClient:
             "status": "active"
         }
         
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(url, json=payload, headers=self.headers)
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPStatusError as e:
-                logger.error(f"Marzban API Error: {e.response.text}")
-                raise
+        try:
+            response = await self.http.request("POST", url, json=payload, headers=self.headers)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Marzban API Error: {e.response.text}")
+            raise
 
     async def get_user(self, username: str) -> Optional[Dict[str, Any]]:
         url = f"{self.base_url}/api/user/{username}"
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(url, headers=self.headers)
-                if response.status_code == 404:
-                    return None
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPStatusError as e:
-                logger.error(f"Marzban API Error: {e.response.text}")
-                raise
+        try:
+            response = await self.http.request("GET", url, headers=self.headers)
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Marzban API Error: {e.response.text}")
+            raise
+
+    async def set_status(self, username: str, enabled: bool) -> Dict[str, Any]:
+        url = f"{self.base_url}/api/user/{username}"
+        payload = {"status": "active" if enabled else "disabled"}
+        try:
+            response = await self.http.request("PUT", url, json=payload, headers=self.headers)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            logger.error(f"Marzban API Error: {e.response.text}")
+            raise
+
+    async def delete_user(self, username: str) -> bool:
+        url = f"{self.base_url}/api/user/{username}"
+        response = await self.http.request("DELETE", url, headers=self.headers)
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+    async def get_system_stats(self) -> Dict[str, Any]:
+        """Node-wide counters: online_users, incoming_bandwidth, outgoing_bandwidth, ..."""
+        response = await self.http.request("GET", f"{self.base_url}/api/system", headers=self.headers)
+        response.raise_for_status()
+        return response.json()
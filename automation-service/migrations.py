@@ -0,0 +1,568 @@
+import logging
+from typing import Awaitable, Callable, List, NamedTuple, Sequence, Union
+
+import aiosqlite
+
+from db_pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# A step is either a list of SQL statements or a coroutine taking the writer
+MigrationStep = Union[Sequence[str], Callable[[aiosqlite.Connection], Awaitable[None]]]
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    step: MigrationStep
+    # VACUUM and some PRAGMAs cannot run inside a transaction
+    transactional: bool = True
+
+
+BASELINE_SCHEMA = [
+    # Users table - updated for Hysteria2
+    """
+        CREATE TABLE IF NOT EXISTS users (
+            corporate_id TEXT PRIMARY KEY,
+            blitz_username TEXT,
+            hy2_auth_key TEXT,
+            subscription_url TEXT,
+            hy2_url TEXT,
+            telegram_id TEXT UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT 1,
+            last_access TIMESTAMP,
+            auth_attempts INTEGER DEFAULT 0,
+            locked_until TIMESTAMP,
+            total_upload BIGINT DEFAULT 0,
+            total_download BIGINT DEFAULT 0
+        )
+    """,
+    # Authentication logs table
+    """
+        CREATE TABLE IF NOT EXISTS auth_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            corporate_id TEXT,
+            telegram_id TEXT,
+            action TEXT,
+            ip_address TEXT,
+            user_agent TEXT,
+            success BOOLEAN,
+            error_message TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (corporate_id) REFERENCES users(corporate_id)
+        )
+    """,
+    # Webhook events table
+    """
+        CREATE TABLE IF NOT EXISTS webhook_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_type TEXT,
+            corporate_id TEXT,
+            event_data TEXT,
+            processed BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP
+        )
+    """,
+    # Traffic statistics table
+    """
+        CREATE TABLE IF NOT EXISTS traffic_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            corporate_id TEXT,
+            username TEXT,
+            upload_bytes BIGINT,
+            download_bytes BIGINT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (corporate_id) REFERENCES users(corporate_id)
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS monitor_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            component TEXT,
+            level TEXT,
+            message TEXT,
+            details TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS id_registry (
+            id TEXT PRIMARY KEY,
+            owner TEXT,
+            status TEXT CHECK(status IN ('issued','active','revoked','archived')) DEFAULT 'issued',
+            issued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS id_audit (
+            audit_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT,
+            action TEXT,
+            actor TEXT,
+            details TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(id) REFERENCES id_registry(id)
+        )
+    """,
+]
+
+# Secondary indexes for the hot read paths in Database
+HOT_PATH_INDEXES = [
+    # get_user_auth_logs: WHERE corporate_id = ? ORDER BY created_at DESC
+    """
+        CREATE INDEX IF NOT EXISTS idx_auth_logs_corporate_created
+        ON auth_logs (corporate_id, created_at)
+    """,
+    # get_user_traffic_stats: WHERE corporate_id = ? AND timestamp >= ?
+    """
+        CREATE INDEX IF NOT EXISTS idx_traffic_stats_corporate_ts
+        ON traffic_stats (corporate_id, timestamp)
+    """,
+    # get_pending_webhook_events: only unprocessed rows are ever scanned
+    """
+        CREATE INDEX IF NOT EXISTS idx_webhook_events_pending
+        ON webhook_events (created_at) WHERE processed = 0
+    """,
+    # search_ids: ORDER BY issued_at DESC LIMIT ? walks the index and stops early.
+    # get_user_by_telegram_id is already covered by the UNIQUE autoindex on users.
+    """
+        CREATE INDEX IF NOT EXISTS idx_id_registry_issued_at
+        ON id_registry (issued_at)
+    """,
+]
+
+# Pre-aggregated traffic, kept current by a trigger on every raw traffic_stats row
+TRAFFIC_ROLLUPS = [
+    """
+        CREATE TABLE IF NOT EXISTS traffic_hourly (
+            corporate_id TEXT NOT NULL,
+            hour TEXT NOT NULL,
+            upload_bytes BIGINT DEFAULT 0,
+            download_bytes BIGINT DEFAULT 0,
+            samples INTEGER DEFAULT 0,
+            PRIMARY KEY (corporate_id, hour)
+        ) WITHOUT ROWID
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS traffic_daily (
+            corporate_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            upload_bytes BIGINT DEFAULT 0,
+            download_bytes BIGINT DEFAULT 0,
+            samples INTEGER DEFAULT 0,
+            PRIMARY KEY (corporate_id, day)
+        ) WITHOUT ROWID
+    """,
+    """
+        CREATE TRIGGER IF NOT EXISTS trg_traffic_stats_rollup
+        AFTER INSERT ON traffic_stats
+        BEGIN
+            INSERT INTO traffic_hourly (corporate_id, hour, upload_bytes, download_bytes, samples)
+            VALUES (NEW.corporate_id, strftime('%Y-%m-%d %H:00:00', NEW.timestamp),
+                    NEW.upload_bytes, NEW.download_bytes, 1)
+            ON CONFLICT (corporate_id, hour) DO UPDATE SET
+                upload_bytes = upload_bytes + excluded.upload_bytes,
+                download_bytes = download_bytes + excluded.download_bytes,
+                samples = samples + 1;
+
+            INSERT INTO traffic_daily (corporate_id, day, upload_bytes, download_bytes, samples)
+            VALUES (NEW.corporate_id, date(NEW.timestamp), NEW.upload_bytes, NEW.download_bytes, 1)
+            ON CONFLICT (corporate_id, day) DO UPDATE SET
+                upload_bytes = upload_bytes + excluded.upload_bytes,
+                download_bytes = download_bytes + excluded.download_bytes,
+                samples = samples + 1;
+        END
+    """,
+]
+
+
+async def backfill_traffic_rollups(conn: aiosqlite.Connection) -> int:
+    """Rebuild rollups from the raw traffic_stats rows that still exist.
+
+    Only buckets from the oldest remaining raw row onwards are rebuilt, so
+    rollup history older than the raw retention window is preserved.
+    Returns the number of hourly buckets written.
+    """
+    async with conn.execute("SELECT MIN(timestamp) FROM traffic_stats") as cursor:
+        oldest = (await cursor.fetchone())[0]
+    if oldest is None:
+        return 0
+
+    await conn.execute("DELETE FROM traffic_hourly WHERE hour >= strftime('%Y-%m-%d %H:00:00', ?)", (oldest,))
+    await conn.execute("""
+        INSERT INTO traffic_hourly (corporate_id, hour, upload_bytes, download_bytes, samples)
+        SELECT corporate_id, strftime('%Y-%m-%d %H:00:00', timestamp),
+               SUM(upload_bytes), SUM(download_bytes), COUNT(*)
+        FROM traffic_stats
+        GROUP BY 1, 2
+    """)
+    async with conn.execute("SELECT changes()") as cursor:
+        written = (await cursor.fetchone())[0]
+
+    # Daily buckets are derived from hourly ones so partially retained days stay whole
+    await conn.execute("DELETE FROM traffic_daily WHERE day >= date(?)", (oldest,))
+    await conn.execute("""
+        INSERT INTO traffic_daily (corporate_id, day, upload_bytes, download_bytes, samples)
+        SELECT corporate_id, date(hour), SUM(upload_bytes), SUM(download_bytes), SUM(samples)
+        FROM traffic_hourly
+        WHERE hour >= date(?)
+        GROUP BY 1, 2
+    """, (oldest,))
+    return written
+
+
+async def _create_traffic_rollups(conn: aiosqlite.Connection):
+    for statement in TRAFFIC_ROLLUPS:
+        await conn.execute(statement)
+    written = await backfill_traffic_rollups(conn)
+    logger.info(f"Backfilled {written} hourly traffic buckets")
+
+
+# Time-ordered indexes let retention delete the oldest rows in small chunks
+RETENTION_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_auth_logs_created_at ON auth_logs (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_monitor_events_created_at ON monitor_events (created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_traffic_stats_timestamp ON traffic_stats (timestamp)",
+    """
+        CREATE INDEX IF NOT EXISTS idx_webhook_events_processed
+        ON webhook_events (created_at) WHERE processed = 1
+    """,
+]
+
+
+async def _enable_incremental_vacuum(conn: aiosqlite.Connection):
+    for statement in RETENTION_INDEXES:
+        await conn.execute(statement)
+    await conn.commit()
+    async with conn.execute("PRAGMA auto_vacuum") as cursor:
+        mode = (await cursor.fetchone())[0]
+    if mode != 2:
+        # Switching an existing file to INCREMENTAL only takes effect after a full VACUUM
+        logger.info("Switching database to auto_vacuum=INCREMENTAL (one-time VACUUM)")
+        await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await conn.execute("VACUUM")
+
+
+# Trigram full-text index over id_registry for substring search. It is an
+# external-content table keyed by id_registry's implicit rowid; a manual VACUUM
+# may renumber those rowids, so run Database.rebuild_id_search_index() after one.
+ID_SEARCH_INDEX = [
+    """
+        CREATE VIRTUAL TABLE IF NOT EXISTS id_registry_fts USING fts5(
+            id, owner, status,
+            content='id_registry', content_rowid='rowid', tokenize='trigram'
+        )
+    """,
+    """
+        CREATE TRIGGER IF NOT EXISTS trg_id_registry_fts_insert AFTER INSERT ON id_registry
+        BEGIN
+            INSERT INTO id_registry_fts (rowid, id, owner, status)
+            VALUES (NEW.rowid, NEW.id, NEW.owner, NEW.status);
+        END
+    """,
+    """
+        CREATE TRIGGER IF NOT EXISTS trg_id_registry_fts_delete AFTER DELETE ON id_registry
+        BEGIN
+            INSERT INTO id_registry_fts (id_registry_fts, rowid, id, owner, status)
+            VALUES ('delete', OLD.rowid, OLD.id, OLD.owner, OLD.status);
+        END
+    """,
+    """
+        CREATE TRIGGER IF NOT EXISTS trg_id_registry_fts_update AFTER UPDATE OF id, owner, status ON id_registry
+        BEGIN
+            INSERT INTO id_registry_fts (id_registry_fts, rowid, id, owner, status)
+            VALUES ('delete', OLD.rowid, OLD.id, OLD.owner, OLD.status);
+            INSERT INTO id_registry_fts (rowid, id, owner, status)
+            VALUES (NEW.rowid, NEW.id, NEW.owner, NEW.status);
+        END
+    """,
+    # Status keywords match every row of that status, so they use a plain index
+    "CREATE INDEX IF NOT EXISTS idx_id_registry_status_issued ON id_registry (status, issued_at)",
+    "INSERT INTO id_registry_fts (id_registry_fts) VALUES ('rebuild')",
+]
+
+# Lease columns turn webhook_events into a multi-consumer claim queue
+WEBHOOK_LEASES = [
+    "ALTER TABLE webhook_events ADD COLUMN lease_owner TEXT",
+    "ALTER TABLE webhook_events ADD COLUMN lease_expires_at TIMESTAMP",
+    "ALTER TABLE webhook_events ADD COLUMN attempts INTEGER DEFAULT 0",
+    "ALTER TABLE webhook_events ADD COLUMN last_error TEXT",
+    # Leased, retried and dead-lettered events are all outside processed = 1
+    "CREATE INDEX IF NOT EXISTS idx_webhook_events_open ON webhook_events (processed) WHERE processed != 1",
+]
+
+# Last cumulative counters seen per traffic source, so syncs can compute deltas.
+# Kept in the hot file to commit atomically with the users totals they feed.
+TRAFFIC_COUNTERS = [
+    """
+        CREATE TABLE IF NOT EXISTS traffic_counters (
+            source TEXT NOT NULL,
+            username TEXT NOT NULL,
+            tx BIGINT DEFAULT 0,
+            rx BIGINT DEFAULT 0,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (source, username)
+        ) WITHOUT ROWID
+    """,
+]
+
+# Fleet placement: the nodes each user is provisioned on, position 0 first
+# (the primary). Users without rows live on the fleet's default node.
+USER_NODES = [
+    """
+        CREATE TABLE IF NOT EXISTS user_nodes (
+            corporate_id TEXT NOT NULL,
+            node TEXT NOT NULL,
+            position INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (corporate_id, node)
+        ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_user_nodes_node ON user_nodes (node)",
+]
+
+# Responses stored under a client's Idempotency-Key and replayed until they expire
+IDEMPOTENCY_KEYS = [
+    """
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            scope TEXT NOT NULL,
+            idempotency_key TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            status_code INTEGER NOT NULL,
+            response TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (scope, idempotency_key)
+        ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at)",
+]
+
+# Raw traffic samples commit here with the users totals they were added to;
+# Database.flush_traffic_outbox then copies them into telemetry traffic_stats
+# in a separate transaction, so a traffic sync never holds both file locks
+TRAFFIC_OUTBOX = [
+    """
+        CREATE TABLE IF NOT EXISTS traffic_outbox (
+            batch_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            corporate_id TEXT,
+            username TEXT,
+            upload_bytes BIGINT,
+            download_bytes BIGINT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (batch_id, seq)
+        ) WITHOUT ROWID
+    """,
+]
+
+# Append-heavy tables live in a separate telemetry file with its own writer, so
+# bursts of logging and retention deletes never queue behind user/ID writes.
+# The two files are ATTACHed to each other's connections under these aliases.
+HOT_SCHEMA = "hot"
+TELEMETRY_SCHEMA = "telemetry"
+
+# Moved in this order: raw tables first, rollups last (see _move_telemetry_tables)
+TELEMETRY_TABLES = (
+    "auth_logs", "monitor_events", "webhook_events", "id_audit",
+    "traffic_stats", "traffic_hourly", "traffic_daily",
+)
+ROLLUP_TABLES = ("traffic_hourly", "traffic_daily")
+
+# Current shape of the telemetry tables. Foreign keys to users/id_registry are
+# dropped because SQLite cannot reference tables in another file.
+TELEMETRY_BASELINE = [
+    """
+        CREATE TABLE IF NOT EXISTS auth_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            corporate_id TEXT,
+            telegram_id TEXT,
+            action TEXT,
+            ip_address TEXT,
+            user_agent TEXT,
+            success BOOLEAN,
+            error_message TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS webhook_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_type TEXT,
+            corporate_id TEXT,
+            event_data TEXT,
+            processed BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP,
+            lease_owner TEXT,
+            lease_expires_at TIMESTAMP,
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS traffic_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            corporate_id TEXT,
+            username TEXT,
+            upload_bytes BIGINT,
+            download_bytes BIGINT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS monitor_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            component TEXT,
+            level TEXT,
+            message TEXT,
+            details TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS id_audit (
+            audit_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT,
+            action TEXT,
+            actor TEXT,
+            details TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+    *HOT_PATH_INDEXES[:3],
+    *TRAFFIC_ROLLUPS,
+    WEBHOOK_LEASES[-1],
+]
+
+
+# Webhook events retention may purge: processed (1) and dead-lettered (2). The
+# purge query repeats this exact term so the planner can use the partial index.
+WEBHOOK_DONE_CONDITION = "processed IN (1, 2)"
+
+WEBHOOK_PURGE_INDEX = [
+    "DROP INDEX IF EXISTS idx_webhook_events_processed",
+    f"""
+        CREATE INDEX IF NOT EXISTS idx_webhook_events_processed
+        ON webhook_events (created_at) WHERE {WEBHOOK_DONE_CONDITION}
+    """,
+]
+
+# Retention expires hourly rollups oldest first
+ROLLUP_RETENTION_INDEX = [
+    "CREATE INDEX IF NOT EXISTS idx_traffic_hourly_hour ON traffic_hourly (hour)",
+]
+
+# Outbox keys on the copied samples: a copy re-run after a crash skips the
+# samples that already made it across
+TRAFFIC_SAMPLE_KEYS = [
+    "ALTER TABLE traffic_stats ADD COLUMN batch_id TEXT",
+    "ALTER TABLE traffic_stats ADD COLUMN batch_seq INTEGER",
+    """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_traffic_stats_batch
+        ON traffic_stats (batch_id, batch_seq) WHERE batch_id IS NOT NULL
+    """,
+]
+
+
+async def _move_telemetry_tables(conn: aiosqlite.Connection):
+    """Copy telemetry tables from the main file into the attached telemetry file.
+
+    The copy and the DROP commit per file rather than atomically across both,
+    so the step is written to be re-run: raw rows are copied with OR IGNORE on
+    their primary keys, and rollups are copied last with OR REPLACE so they
+    overwrite whatever the telemetry trigger derived from the copied raw rows.
+    """
+    async with conn.execute("SELECT name FROM pragma_database_list WHERE name = ?", (TELEMETRY_SCHEMA,)) as cursor:
+        if await cursor.fetchone() is None:
+            raise RuntimeError(f"Telemetry database must be attached as '{TELEMETRY_SCHEMA}'")
+
+    await conn.execute("BEGIN")
+    for table in TELEMETRY_TABLES:
+        async with conn.execute(f"SELECT name FROM pragma_table_info('{table}', 'main')") as cursor:
+            columns = ", ".join(row[0] for row in await cursor.fetchall())
+        if not columns:
+            continue
+        verb = "INSERT OR REPLACE" if table in ROLLUP_TABLES else "INSERT OR IGNORE"
+        await conn.execute(
+            f"{verb} INTO {TELEMETRY_SCHEMA}.{table} ({columns}) SELECT {columns} FROM main.{table}"
+        )
+        async with conn.execute("SELECT changes()") as cursor:
+            moved = (await cursor.fetchone())[0]
+        logger.info(f"Moved {moved} rows of {table} to the telemetry database")
+    for table in TELEMETRY_TABLES:
+        await conn.execute(f"DROP TABLE IF EXISTS main.{table}")
+    await conn.commit()
+    # Hand the freed pages back to the filesystem (auto_vacuum is INCREMENTAL since v4)
+    await conn.execute("PRAGMA main.incremental_vacuum")
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline schema", BASELINE_SCHEMA),
+    Migration(2, "hot path indexes", HOT_PATH_INDEXES),
+    Migration(3, "traffic rollups", _create_traffic_rollups),
+    Migration(4, "retention indexes and incremental vacuum", _enable_incremental_vacuum, transactional=False),
+    Migration(5, "id registry full-text search", ID_SEARCH_INDEX),
+    Migration(6, "webhook event leases", WEBHOOK_LEASES),
+    # Requires TELEMETRY_MIGRATIONS to have been applied to the attached file first
+    Migration(7, "move telemetry tables to their own file", _move_telemetry_tables, transactional=False),
+    Migration(8, "traffic counter snapshots", TRAFFIC_COUNTERS),
+    Migration(9, "fleet node assignments", USER_NODES),
+    Migration(10, "idempotency keys", IDEMPOTENCY_KEYS),
+    Migration(11, "traffic sample outbox", TRAFFIC_OUTBOX),
+]
+
+TELEMETRY_MIGRATIONS: List[Migration] = [
+    Migration(1, "telemetry schema", TELEMETRY_BASELINE),
+    Migration(2, "retention indexes and incremental vacuum", _enable_incremental_vacuum, transactional=False),
+    Migration(3, "traffic sample batch keys", TRAFFIC_SAMPLE_KEYS),
+    Migration(4, "webhook purge index covers dead letters", WEBHOOK_PURGE_INDEX),
+    Migration(5, "hourly rollup retention index", ROLLUP_RETENTION_INDEX),
+]
+
+
+async def get_schema_version(conn: aiosqlite.Connection) -> int:
+    async with conn.execute("SELECT MAX(version) FROM schema_version") as cursor:
+        row = await cursor.fetchone()
+        return row[0] or 0
+
+
+async def apply_migrations(pool: ConnectionPool, migrations: Sequence[Migration]) -> List[int]:
+    """Apply every migration newer than the recorded schema version, in order.
+
+    Each migration runs in its own transaction together with its version row,
+    so a failed step leaves the database at the previous version. Steps marked
+    non-transactional must be safe to re-run.
+    """
+    async with pool.write() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        current = await get_schema_version(conn)
+
+    applied = []
+    for migration in sorted(migrations, key=lambda m: m.version):
+        if migration.version <= current:
+            continue
+        logger.info(f"Applying migration {migration.version}: {migration.name}")
+        async with pool.write() as conn:
+            if migration.transactional:
+                await conn.execute("BEGIN")
+            if callable(migration.step):
+                await migration.step(conn)
+            else:
+                for statement in migration.step:
+                    await conn.execute(statement)
+            await conn.execute(
+                "INSERT INTO schema_version (version, name) VALUES (?, ?)",
+                (migration.version, migration.name),
+            )
+        applied.append(migration.version)
+    return applied
@@ -2,6 +2,7 @@ import asyncio
 import logging
 import httpx
 
+from circuit_breaker import get_circuit_breaker
 from database import Database
 from config import get_settings
 from telegram_2fa import Telegram2FA
@@ -15,10 +16,22 @@ class HealthMonitor:
         self.notifier = notifier
         self._stop = False
         self._blitz_fail_count = 0
+        # Probe results feed the breaker BlitzClient checks before every call
+        self.blitz_breaker = get_circuit_breaker("blitz")
+        self._tasks = []
 
     async def start(self):
-        asyncio.create_task(self._monitor_blitz())
-        asyncio.create_task(self._monitor_automation())
+        self._tasks = [
+            asyncio.create_task(self._monitor_blitz()),
+            asyncio.create_task(self._monitor_automation()),
+        ]
+
+    async def stop(self):
+        self._stop = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
 
     async def _monitor_blitz(self):
         base = settings.BLITZ_API_URL.rstrip("/")
@@ -28,14 +41,19 @@ class HealthMonitor:
                 try:
                     resp = await client.get(f"{base}/")
                     if resp.status_code == 200:
+                        self.blitz_breaker.record_success()
                         if self._blitz_fail_count:
                             self._blitz_fail_count = 0
                             await self.db.log_monitor_event("blitz", "INFO", "Recovered", "status 200")
                     else:
                         self._blitz_fail_count += 1
+                        self.blitz_breaker.record_failure()
                         await self.db.log_monitor_event("blitz", "WARN", f"Status {resp.status_code}")
                 except Exception as e:
                     self._blitz_fail_count += 1
+                    # Counts toward failure_threshold like any failed call; one
+                    # timed-out probe must not shed every panel call
+                    self.blitz_breaker.record_failure()
                     await self.db.log_monitor_event("blitz", "ERROR", "Unreachable", str(e))
 
                 # Notify admins on sustained failure
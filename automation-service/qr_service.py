@@ -0,0 +1,278 @@
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+import qrcode
+import qrcode.image.svg
+
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 1000
+DEFAULT_WORKERS = 2
+DEFAULT_BOX_SIZE = 10
+DEFAULT_BORDER = 5
+DEFAULT_MAX_AGE_SECONDS = 30 * 86400
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+EXECUTORS = ("thread", "process")
+# Output format -> media type
+FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+def render_qr(payload: str, fmt: str = "png", box_size: int = DEFAULT_BOX_SIZE,
+              border: int = DEFAULT_BORDER) -> bytes:
+    """QR code for `payload` as PNG or SVG bytes. Module level so process pools can pickle it."""
+    if fmt == "svg":
+        qr = qrcode.QRCode(version=1, box_size=box_size, border=border,
+                           image_factory=qrcode.image.svg.SvgPathImage)
+    else:
+        qr = qrcode.QRCode(version=1, box_size=box_size, border=border)
+    qr.add_data(payload)
+    qr.make(fit=True)
+
+    buffer = io.BytesIO()
+    if fmt == "svg":
+        qr.make_image().save(buffer)
+    else:
+        qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class QRService:
+    """Renders QR codes off the event loop and caches them by content.
+
+    The cache key is a hash of the payload and the render options, so a
+    user's QR code is rendered once per hy2 URL however often the page is
+    opened. Hits come from a bounded in-memory LRU, then from an optional
+    directory of image files (content addressed, so entries never go stale);
+    misses render in a thread or process pool. Concurrent misses for the same
+    key share one render.
+
+    Every image encodes a usable auth key, so the directory is bounded: prune()
+    removes files older than `max_age_seconds` and then the oldest ones beyond
+    `max_bytes`, and forget() drops a payload's images once its key is revoked.
+    """
+
+    def __init__(self, cache_size: int = DEFAULT_CACHE_SIZE, cache_dir: str = "",
+                 workers: int = DEFAULT_WORKERS, executor: str = "thread",
+                 box_size: int = DEFAULT_BOX_SIZE, border: int = DEFAULT_BORDER,
+                 max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS, max_bytes: int = DEFAULT_MAX_BYTES):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown QR executor: {executor}")
+        self.cache_size = max(0, cache_size)
+        self.cache_dir = cache_dir
+        self.workers = max(1, workers)
+        self.executor_kind = executor
+        self.box_size = box_size
+        self.border = border
+        # 0 disables the limit
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+
+        self._executor: Optional[Executor] = None
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "renders": 0, "disk_errors": 0,
+                       "forgotten": 0, "pruned": 0}
+
+    def key(self, payload: str, fmt: str = "png") -> str:
+        """Content address of a QR image; also usable as its strong ETag."""
+        options = {"format": fmt, "box_size": self.box_size, "border": self.border}
+        return hashlib.sha256(json.dumps([payload, options], sort_keys=True).encode()).hexdigest()
+
+    def _executor_for_render(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="qr")
+        return self._executor
+
+    def _disk_path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{fmt}")
+
+    def _read_disk(self, key: str, fmt: str) -> Optional[bytes]:
+        try:
+            with open(self._disk_path(key, fmt), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key: str, fmt: str, image: bytes):
+        path = self._disk_path(key, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write and rename so readers never see a half-written file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(image)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _delete_disk(self, key: str, fmt: str) -> bool:
+        try:
+            os.unlink(self._disk_path(key, fmt))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _prune_disk(self) -> Dict[str, int]:
+        now = time.time()
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        deleted = {"files": 0, "bytes": 0}
+        for mtime, size, path in files:
+            expired = self.max_age_seconds and now - mtime > self.max_age_seconds
+            if not expired and (not self.max_bytes or total <= self.max_bytes):
+                # Oldest first: every later file is newer, and the size fits
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            deleted["files"] += 1
+            deleted["bytes"] += size
+        return deleted
+
+    def _remember(self, key: str, image: bytes):
+        if not self.cache_size:
+            return
+        self._cache[key] = image
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: str, payload: str, fmt: str) -> bytes:
+        loop = asyncio.get_running_loop()
+        if self.cache_dir:
+            try:
+                image = await loop.run_in_executor(None, self._read_disk, key, fmt)
+                if image is not None:
+                    self._stats["disk_hits"] += 1
+                    return image
+            except OSError as e:
+                self._stats["disk_errors"] += 1
+                logger.warning(f"QR disk cache read failed: {e}")
+
+        self._stats["renders"] += 1
+        image = await loop.run_in_executor(self._executor_for_render(), render_qr, payload, fmt,
+                                           self.box_size, self.border)
+        if self.cache_dir:
+            try:
+                await loop.run_in_executor(None, self._write_disk, key, fmt, image)
+            except OSError as e:
+                self._stats["disk_errors"] += 1
+                logger.warning(f"QR disk cache write failed: {e}")
+        return image
+
+    async def render(self, payload: str, fmt: str = "png") -> bytes:
+        """The QR code for `payload` as image bytes in `fmt` (see FORMATS)."""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown QR format: {fmt}")
+        key = self.key(payload, fmt)
+        image = self._cache.get(key)
+        if image is not None:
+            self._cache.move_to_end(key)
+            self._stats["hits"] += 1
+            return image
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self._stats["coalesced"] += 1
+        else:
+            self._stats["misses"] += 1
+            future = asyncio.ensure_future(self._load(key, payload, fmt))
+            self._inflight[key] = future
+
+            def _done(f: asyncio.Future):
+                self._inflight.pop(key, None)
+                if not f.cancelled() and f.exception() is None:
+                    self._remember(key, f.result())
+
+            future.add_done_callback(_done)
+        # shield: one cancelled request must not cancel the render others await
+        return await asyncio.shield(future)
+
+    async def png(self, payload: str) -> bytes:
+        return await self.render(payload, "png")
+
+    async def png_base64(self, payload: str) -> str:
+        return base64.b64encode(await self.png(payload)).decode()
+
+    async def forget(self, payload: str) -> int:
+        """Drop every cached image of `payload`, e.g. a hy2 URL whose key was revoked.
+        Returns the number of files deleted."""
+        removed = 0
+        loop = asyncio.get_running_loop()
+        for fmt in FORMATS:
+            key = self.key(payload, fmt)
+            self._cache.pop(key, None)
+            if not self.cache_dir:
+                continue
+            try:
+                removed += await loop.run_in_executor(None, self._delete_disk, key, fmt)
+            except OSError as e:
+                self._stats["disk_errors"] += 1
+                logger.warning(f"QR disk cache delete failed: {e}")
+        self._stats["forgotten"] += removed
+        return removed
+
+    async def prune(self) -> Dict[str, int]:
+        """Apply the age and size limits to the disk cache; returns {files, bytes} deleted."""
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return {"files": 0, "bytes": 0}
+        deleted = await asyncio.get_running_loop().run_in_executor(None, self._prune_disk)
+        self._stats["pruned"] += deleted["files"]
+        return deleted
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "size": len(self._cache),
+            "max_size": self.cache_size,
+            "in_flight": len(self._inflight),
+            "disk_cache": bool(self.cache_dir),
+            "executor": self.executor_kind,
+            "workers": self.workers,
+        }
+
+
+@lru_cache()
+def get_qr_service() -> QRService:
+    settings = get_settings()
+    return QRService(
+        cache_size=settings.QR_CACHE_SIZE,
+        cache_dir=settings.QR_CACHE_DIR,
+        workers=settings.QR_RENDER_WORKERS,
+        executor=settings.QR_RENDER_EXECUTOR,
+        max_age_seconds=settings.QR_CACHE_MAX_AGE_DAYS * 86400,
+        max_bytes=settings.QR_CACHE_MAX_MB * 1024 * 1024,
+    )
@@ -0,0 +1,171 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Lower value goes first
+PRIORITY_DEACTIVATE = 0  # deactivations, suspensions, deletions
+PRIORITY_GRANT = 1       # grants and the lookups they depend on
+PRIORITY_READ = 2        # stats reads, listings, background scans
+PRIORITY_NAMES = {PRIORITY_DEACTIVATE: "deactivate", PRIORITY_GRANT: "grant", PRIORITY_READ: "read"}
+
+DEFAULT_RATE = 0.0  # requests per second; 0 disables limiting
+DEFAULT_BURST = 20
+DEFAULT_MAX_QUEUE = 1000
+
+
+class RateLimitedError(Exception):
+    """Raised instead of queueing a call when the limiter's queue is full."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is rate limited (queue full, retry in {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token bucket with a priority queue for outbound calls to one backend.
+
+    Calls take a token each; the bucket refills at `rate` per second up to
+    `burst`. When it is empty, callers wait in a queue ordered by priority,
+    then arrival, and a single dispatcher hands out tokens as they refill.
+    A burst of grants is thus spread out at `rate` instead of hitting the
+    panel at once, and a deactivation queued behind it goes out next.
+    Deactivations are never rejected; other calls get RateLimitedError once
+    `max_queue` callers are waiting.
+    """
+
+    def __init__(self, name: str, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST,
+                 max_queue: int = DEFAULT_MAX_QUEUE):
+        self.name = name
+        self.rate = max(0.0, rate)
+        self.burst = max(1, burst)
+        self.max_queue = max(0, max_queue)
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        # (priority, sequence, enqueued_at, future)
+        self._queue: List[Tuple[int, int, float, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._stats = {label: {"acquired": 0, "queued": 0, "rejected": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+                       for label in PRIORITY_NAMES.values()}
+
+    def configure(self, rate: Optional[float] = None, burst: Optional[int] = None,
+                  max_queue: Optional[int] = None):
+        self._refill()
+        if rate is not None:
+            self.rate = max(0.0, rate)
+        if burst is not None:
+            self.burst = max(1, burst)
+            self._tokens = min(self._tokens, self.burst)
+        if max_queue is not None:
+            self.max_queue = max(0, max_queue)
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _record(self, priority: int, waited: float):
+        stats = self._stats[PRIORITY_NAMES[priority]]
+        stats["acquired"] += 1
+        waited_ms = waited * 1000
+        stats["wait_ms_total"] += waited_ms
+        stats["wait_ms_max"] = max(stats["wait_ms_max"], waited_ms)
+
+    async def acquire(self, priority: int = PRIORITY_GRANT):
+        """Wait for a token. Raises RateLimitedError if the queue is full."""
+        if priority not in PRIORITY_NAMES:
+            raise ValueError(f"Unknown priority: {priority}")
+        if not self.enabled:
+            return
+        self._refill()
+        # Jumping ahead of queued callers would break priority order
+        if not self._queue and self._tokens >= 1:
+            self._tokens -= 1
+            self._record(priority, 0.0)
+            return
+        if priority != PRIORITY_DEACTIVATE and len(self._queue) >= self.max_queue:
+            self._stats[PRIORITY_NAMES[priority]]["rejected"] += 1
+            raise RateLimitedError(self.name, len(self._queue) / self.rate)
+
+        future = asyncio.get_running_loop().create_future()
+        enqueued_at = time.monotonic()
+        heapq.heappush(self._queue, (priority, next(self._sequence), enqueued_at, future))
+        self._stats[PRIORITY_NAMES[priority]]["queued"] += 1
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        await future
+        self._record(priority, time.monotonic() - enqueued_at)
+
+    async def _dispatch(self):
+        while self._queue:
+            self._refill()
+            while self._queue and self._tokens >= 1:
+                _, _, _, future = heapq.heappop(self._queue)
+                # Callers that gave up (cancelled, timed out) do not use a token
+                if not future.done():
+                    self._tokens -= 1
+                    future.set_result(None)
+            if self._queue:
+                if not self.enabled:
+                    # Limiting switched off while callers waited: release everyone
+                    for _, _, _, future in self._queue:
+                        if not future.done():
+                            future.set_result(None)
+                    self._queue.clear()
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def queue_depth(self) -> Dict[str, int]:
+        depth = {label: 0 for label in PRIORITY_NAMES.values()}
+        for priority, _, _, future in self._queue:
+            if not future.done():
+                depth[PRIORITY_NAMES[priority]] += 1
+        return depth
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        now = time.monotonic()
+        oldest = min((enqueued for _, _, enqueued, future in self._queue if not future.done()), default=None)
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "tokens": round(self._tokens, 2),
+            "queue_depth": self.queue_depth(),
+            "oldest_wait_ms": round((now - oldest) * 1000, 1) if oldest is not None else 0.0,
+            "priorities": {
+                label: {
+                    "acquired": s["acquired"],
+                    "queued": s["queued"],
+                    "rejected": s["rejected"],
+                    "avg_wait_ms": round(s["wait_ms_total"] / s["acquired"], 3) if s["acquired"] else 0.0,
+                    "max_wait_ms": round(s["wait_ms_max"], 3),
+                }
+                for label, s in self._stats.items()
+            },
+        }
+
+
+_limiters: Dict[str, RateLimiter] = {}
+
+
+def get_rate_limiter(name: str) -> RateLimiter:
+    """Process-wide limiter per backend, shared by every client of the same panel."""
+    if name not in _limiters:
+        _limiters[name] = RateLimiter(name)
+    return _limiters[name]
+
+
+def rate_limiter_stats() -> Dict[str, Any]:
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
@@ -0,0 +1,301 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from blitz_client import BlitzClient
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Panel users created by this service; anything else in the panel is left alone
+USERNAME_PREFIX = "corp_"
+MAX_REPORTED_ACTIONS = 1000
+DEFAULT_MAX_RESTORE_FRACTION = 0.25
+
+# Repair kinds. Disabled wins every status conflict: a deactivation that only
+# reached one side is finished, never rolled back.
+ADOPT_LOCAL = "adopt_local"            # panel user with no local row: record it
+UPDATE_LOCAL_KEY = "update_local_key"  # the panel's auth key is the one clients use
+DEACTIVATE_LOCAL = "deactivate_local"  # disabled in the panel, active locally
+DISABLE_REMOTE = "disable_remote"      # inactive locally, enabled in the panel
+RESTORE_REMOTE = "restore_remote"      # active locally, missing from the panel
+
+
+class RepairAction(NamedTuple):
+    kind: str
+    username: str
+    corporate_id: str
+    auth_key: Optional[str] = None
+    enabled: bool = True
+
+
+def _remote_enabled(user: Dict[str, Any]) -> bool:
+    for field in ("enable", "enabled"):
+        if field in user:
+            return bool(user[field])
+    return True
+
+
+def _remote_key(user: Dict[str, Any]) -> Optional[str]:
+    return user.get("auth_key") or user.get("password")
+
+
+def fingerprint(enabled: bool, auth_key: Optional[str]) -> str:
+    """What a user looks like on either side; equal fingerprints need no repair."""
+    return hashlib.sha1(f"{int(bool(enabled))}:{auth_key or ''}".encode()).hexdigest()
+
+
+def diff_user(username: str, local: Dict[str, Any], remote: Dict[str, Any]) -> List[RepairAction]:
+    """Minimal repairs for one user present on both sides."""
+    actions = []
+    corporate_id = local["corporate_id"]
+    remote_enabled = _remote_enabled(remote)
+    if local["is_active"] and not remote_enabled:
+        actions.append(RepairAction(DEACTIVATE_LOCAL, username, corporate_id))
+    elif remote_enabled and not local["is_active"]:
+        actions.append(RepairAction(DISABLE_REMOTE, username, corporate_id))
+    remote_key = _remote_key(remote)
+    if remote_key and remote_key != local["hy2_auth_key"]:
+        actions.append(RepairAction(UPDATE_LOCAL_KEY, username, corporate_id, remote_key,
+                                    local["is_active"] and remote_enabled))
+    return actions
+
+
+class ReconciliationEngine:
+    """Detects and repairs drift between the users table and the Blitz panel.
+
+    A pass loads a compact index of local users, then streams the panel's user
+    list page by page. Users whose local and remote fingerprints match are
+    skipped; the rest are diffed into a minimal repair plan. Local repairs are
+    written in one transaction, panel repairs run with bounded concurrency.
+    Users missing from the panel are only acted on after a complete listing,
+    and a plan that would restore more than `max_restore_fraction` of the
+    local users (or finds an empty panel while local users exist) is refused
+    unless forced: that looks like a bad listing, not lost users.
+
+    With `node` set, only users placed on that fleet node are compared (plus
+    unplaced users for the default node), and adopted users are placed on it.
+
+    `on_revoked` is awaited with the users row as it was before a repair that
+    replaced its auth key or deactivated it, e.g. to drop cached QR codes.
+    """
+
+    def __init__(self, db: Database, blitz: BlitzClient, page_size: int = BlitzClient.DEFAULT_PAGE_SIZE,
+                 concurrency: int = BlitzClient.DEFAULT_BULK_CONCURRENCY, dry_run: bool = False,
+                 interval_seconds: int = 3600, node: Optional[str] = None, default_node: bool = True,
+                 max_restore_fraction: float = DEFAULT_MAX_RESTORE_FRACTION,
+                 on_revoked: Optional[Callable[[Dict[str, Any]], Awaitable[Any]]] = None):
+        self.db = db
+        self.blitz = blitz
+        self.node = node
+        self.default_node = default_node
+        self.page_size = max(1, page_size)
+        self.concurrency = max(1, concurrency)
+        self.dry_run = dry_run
+        self.interval_seconds = interval_seconds
+        self.max_restore_fraction = max_restore_fraction
+        self.on_revoked = on_revoked
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def plan(self) -> Dict[str, Any]:
+        """Compare both sides and return {plan, local_users, remote_users, in_sync}."""
+        local = await self.db.get_user_index(self.node, include_unassigned=self.default_node)
+        # Users placed only on other fleet nodes must not be adopted here
+        known = {u: e["corporate_id"] for u, e in local.items()} if self.node is None \
+            else await self.db.get_username_map()
+        local_ids = set(known.values())
+        fingerprints = {u: fingerprint(e["is_active"], e["hy2_auth_key"]) for u, e in local.items()}
+        plan: List[RepairAction] = []
+        seen = set()
+        in_sync = 0
+
+        async for page in self.blitz.iter_user_pages(self.page_size):
+            for remote in page:
+                username = remote.get("username")
+                if not username or username in seen:
+                    continue
+                seen.add(username)
+                entry = local.get(username)
+                if entry is None:
+                    corporate_id = username[len(USERNAME_PREFIX):]
+                    if (username.startswith(USERNAME_PREFIX) and corporate_id
+                            and username not in known and corporate_id not in local_ids):
+                        plan.append(RepairAction(ADOPT_LOCAL, username, corporate_id,
+                                                 _remote_key(remote), _remote_enabled(remote)))
+                    continue
+                if fingerprints[username] == fingerprint(_remote_enabled(remote), _remote_key(remote)):
+                    in_sync += 1
+                    continue
+                plan.extend(diff_user(username, entry, remote))
+
+        for username, entry in local.items():
+            if username not in seen and entry["is_active"]:
+                plan.append(RepairAction(RESTORE_REMOTE, username, entry["corporate_id"], entry["hy2_auth_key"]))
+
+        return {"plan": plan, "local_users": len(local), "remote_users": len(seen), "in_sync": in_sync}
+
+    async def _restore_remote(self, actions: List[RepairAction]) -> List[Any]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def restore(action: RepairAction):
+            async with semaphore:
+                # Recreated with the stored key so existing client configs keep working
+                return await self.blitz.create_user(action.username, auth_key=action.auth_key)
+
+        return await asyncio.gather(*(restore(a) for a in actions), return_exceptions=True)
+
+    async def apply(self, plan: List[RepairAction]) -> Dict[str, Any]:
+        """Apply a repair plan; returns {applied, failed, errors}."""
+        applied = 0
+        errors: List[Dict[str, str]] = []
+        # username -> users row (corporate_id, blitz_username, hy2_auth_key,
+        # subscription_url, hy2_url, telegram_id, is_active); None keeps a column
+        local_rows: Dict[str, list] = {}
+        # username -> corporate_id of users whose key is replaced or who are deactivated
+        revoked: Dict[str, str] = {}
+
+        def local_row(action: RepairAction, is_active: bool) -> list:
+            row = local_rows.setdefault(action.username, [action.corporate_id, action.username,
+                                                          None, None, None, None, 1])
+            row[6] = int(row[6] and is_active)
+            return row
+
+        def set_key(row: list, auth_key: str):
+            row[2] = auth_key
+            row[4] = self.blitz.renderer.hy2_url(row[1], auth_key)
+
+        disable = [a.username for a in plan if a.kind == DISABLE_REMOTE]
+        if disable:
+            async for result in self.blitz.bulk_set_status(disable, False, concurrency=self.concurrency):
+                if result["ok"]:
+                    applied += 1
+                else:
+                    errors.append({"username": result["username"], "kind": DISABLE_REMOTE,
+                                   "error": result["error"]})
+
+        restore = [a for a in plan if a.kind == RESTORE_REMOTE]
+        for action, result in zip(restore, await self._restore_remote(restore)):
+            if isinstance(result, Exception):
+                errors.append({"username": action.username, "kind": RESTORE_REMOTE, "error": str(result)})
+                continue
+            applied += 1
+            if result.get("auth_key") and result["auth_key"] != action.auth_key:
+                set_key(local_row(action, True), result["auth_key"])
+                revoked[action.username] = action.corporate_id
+
+        for action in plan:
+            if action.kind == ADOPT_LOCAL:
+                row = local_row(action, action.enabled)
+                row[3] = await self.blitz.get_subscription_url(action.username)
+                if action.auth_key:
+                    set_key(row, action.auth_key)
+            elif action.kind == DEACTIVATE_LOCAL:
+                local_row(action, False)
+                revoked[action.username] = action.corporate_id
+            elif action.kind == UPDATE_LOCAL_KEY:
+                set_key(local_row(action, action.enabled), action.auth_key)
+                revoked[action.username] = action.corporate_id
+
+        local_actions = [a for a in plan if a.kind in (ADOPT_LOCAL, DEACTIVATE_LOCAL, UPDATE_LOCAL_KEY)]
+        previous = {}
+        if self.on_revoked is not None:
+            for username, corporate_id in revoked.items():
+                previous[username] = await self.db.get_user(corporate_id)
+        if local_rows:
+            rows = list(local_rows.values())
+            failed = {rows[line][1]: error for line, error in
+                      await self.db.bulk_upsert_users([(i, tuple(row)) for i, row in enumerate(rows)])}
+            for action in local_actions:
+                if action.username in failed:
+                    errors.append({"username": action.username, "kind": action.kind, "error": failed[action.username]})
+                    continue
+                applied += 1
+                if action.kind == ADOPT_LOCAL and self.node is not None:
+                    await self.db.set_user_nodes(action.corporate_id, [self.node])
+            for username, user in previous.items():
+                if user is None or username in failed:
+                    continue
+                try:
+                    await self.on_revoked(user)
+                except Exception as e:
+                    logger.warning(f"Revocation hook failed for {username}: {e}")
+        return {"applied": applied, "failed": len(errors), "errors": errors[:MAX_REPORTED_ACTIONS]}
+
+    def refusal(self, result: Dict[str, Any], drift: Dict[str, int]) -> Optional[str]:
+        """Why a plan must not be applied without force, or None."""
+        local_users, restores = result["local_users"], drift.get(RESTORE_REMOTE, 0)
+        if local_users and not result["remote_users"]:
+            return f"Panel listed no users while {local_users} exist locally"
+        if restores > local_users * self.max_restore_fraction:
+            return f"{restores} of {local_users} local users missing from the panel"
+        return None
+
+    async def run_once(self, dry_run: Optional[bool] = None, force: bool = False) -> Dict[str, Any]:
+        dry_run = self.dry_run if dry_run is None else dry_run
+        async with self._lock:
+            started = time.monotonic()
+            result = await self.plan()
+            plan = result.pop("plan")
+            drift: Dict[str, int] = {}
+            for action in plan:
+                drift[action.kind] = drift.get(action.kind, 0) + 1
+
+            report = {
+                "dry_run": dry_run,
+                **result,
+                "drift": drift,
+                "actions": [{"kind": a.kind, "username": a.username, "corporate_id": a.corporate_id}
+                            for a in plan[:MAX_REPORTED_ACTIONS]],
+                "refused": None,
+                "applied": 0,
+                "failed": 0,
+                "errors": [],
+            }
+            if plan and not dry_run:
+                report["refused"] = None if force else self.refusal(result, drift)
+                if report["refused"]:
+                    logger.error(f"Reconciliation not applied: {report['refused']}")
+                else:
+                    report.update(await self.apply(plan))
+            report["duration_ms"] = round((time.monotonic() - started) * 1000, 1)
+
+        self.last_report = {k: v for k, v in report.items() if k not in ("actions", "errors")}
+        if report["refused"]:
+            await self.db.log_monitor_event("reconcile", "ERROR", f"Refused to apply {len(plan)} repairs",
+                                            json.dumps(self.last_report))
+        elif plan:
+            level = "INFO" if dry_run else "WARN"
+            await self.db.log_monitor_event("reconcile", level, f"Drift found for {len(plan)} repairs",
+                                            json.dumps(self.last_report))
+        logger.info(f"Reconciliation: {result['remote_users']} panel users, {result['in_sync']} in sync, "
+                    f"{len(plan)} repairs{' planned' if dry_run else ''}")
+        return report
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Reconciliation failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def start(self):
+        if self.interval_seconds > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from database import Database
+from migrations import WEBHOOK_DONE_CONDITION
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionPolicy(NamedTuple):
+    table: str
+    time_column: str
+    days: int
+    # Extra SQL condition, e.g. only purge webhook events that were processed
+    extra_where: str = ""
+    # Columns that identify a row; WITHOUT ROWID tables name their primary key
+    key: str = "rowid"
+
+
+def default_policies(auth_logs_days: int, monitor_events_days: int,
+                     traffic_stats_days: int, webhook_events_days: int,
+                     traffic_hourly_days: int) -> List[RetentionPolicy]:
+    """Policies for the append-only tables. A window of 0 days keeps a table forever."""
+    policies = [
+        RetentionPolicy("auth_logs", "created_at", auth_logs_days),
+        RetentionPolicy("monitor_events", "created_at", monitor_events_days),
+        # Rollups keep traffic history, so raw samples can go much earlier
+        RetentionPolicy("traffic_stats", "timestamp", traffic_stats_days),
+        # Hourly detail for a longer horizon; traffic_daily is the permanent history
+        RetentionPolicy("traffic_hourly", "hour", traffic_hourly_days, key="corporate_id, hour"),
+        # Processed and dead-lettered events; pending ones are kept until handled
+        RetentionPolicy("webhook_events", "created_at", webhook_events_days, WEBHOOK_DONE_CONDITION),
+    ]
+    return [p for p in policies if p.days > 0]
+
+
+class RetentionEngine:
+    """Periodically purges expired rows in small chunks and returns pages to the OS.
+
+    Each chunk is its own short write transaction and the engine yields between
+    chunks, so provisioning writes never wait long behind a purge. `pruners`
+    expire data kept outside the database (e.g. the QR disk cache): name ->
+    coroutine function returning {files, bytes} deleted.
+    """
+
+    def __init__(self, db: Database, policies: List[RetentionPolicy], chunk_size: int = 500,
+                 chunk_pause: float = 0.05, max_run_seconds: float = 60.0,
+                 interval_seconds: int = 3600,
+                 pruners: Optional[Dict[str, Callable[[], Awaitable[Dict[str, int]]]]] = None):
+        self.db = db
+        self.policies = policies
+        self.pruners = dict(pruners or {})
+        self.chunk_size = max(1, chunk_size)
+        self.chunk_pause = chunk_pause
+        self.max_run_seconds = max_run_seconds
+        self.interval_seconds = interval_seconds
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def run_once(self) -> Dict[str, Any]:
+        started = time.monotonic()
+        deadline = started + self.max_run_seconds
+        deleted: Dict[str, int] = {}
+        truncated = False
+
+        for policy in self.policies:
+            deleted[policy.table] = 0
+            while True:
+                if time.monotonic() >= deadline:
+                    # Leave the rest for the next run rather than hogging the writer
+                    truncated = True
+                    break
+                count = await self.db.purge_older_than(
+                    policy.table, policy.time_column, policy.days,
+                    self.chunk_size, policy.extra_where, policy.key,
+                )
+                deleted[policy.table] += count
+                if count < self.chunk_size:
+                    break
+                await asyncio.sleep(self.chunk_pause)
+
+        rows = sum(deleted.values())
+        bytes_reclaimed = await self.db.reclaim_space() if rows else 0
+
+        files: Dict[str, Dict[str, int]] = {}
+        for name, prune in self.pruners.items():
+            try:
+                files[name] = await prune()
+            except Exception as e:
+                logger.error(f"Retention pruner {name} failed: {e}")
+
+        report = {
+            "rows_deleted": rows,
+            "rows_by_table": deleted,
+            "bytes_reclaimed": bytes_reclaimed,
+            "files_deleted": files,
+            "truncated": truncated,
+            "duration_ms": round((time.monotonic() - started) * 1000, 1),
+        }
+        self.last_report = report
+        if rows or any(f["files"] for f in files.values()):
+            logger.info(f"Retention run deleted {rows} rows, reclaimed {bytes_reclaimed} bytes")
+            await self.db.log_monitor_event("retention", "INFO", "Purged expired rows", json.dumps(report))
+        return report
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Retention run failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def start(self):
+        if (self.policies or self.pruners) and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
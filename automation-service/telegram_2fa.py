@@ -8,10 +8,10 @@ from typing import Optional
 from datetime import datetime, timedelta
 import secrets
 import re
-import string
 
 from config import get_settings
-from database import Database
+from database import get_database
+from id_index import generate_corporate_id
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -32,7 +32,7 @@ class Telegram2FA:
     def __init__(self):
         self.bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
         self.dp = Dispatcher()
-        self.db = Database(settings.DB_PATH)
+        self.db = get_database(settings.DB_PATH)
         self.verification_codes = {}  # In production, use Redis or database
         self.admin_ids = set([x.strip() for x in settings.ADMIN_TELEGRAM_IDS.split(',') if x.strip()])
 
@@ -40,10 +40,7 @@ class Telegram2FA:
         return str(user_id) in self.admin_ids
 
     def generate_corporate_id(self) -> str:
-        letters = ''.join([c for c in string.ascii_uppercase if c not in 'IO'])
-        prefix = ''.join(secrets.choice(letters) for _ in range(2))
-        digits = ''.join(secrets.choice(string.digits) for _ in range(6))
-        return prefix + digits
+        return generate_corporate_id()
         
     async def start_command(self, message: Message, state: FSMContext):
         """Handle /start command and initiate 2FA process"""
@@ -218,17 +215,27 @@ class Telegram2FA:
         if not self.is_admin(message.from_user.id):
             await message.answer("❌ Доступ запрещен")
             return
-        await message.answer("Введите имя владельца для нового ID:")
+        await message.answer("Введите имя владельца для нового ID (по одному на строку для нескольких):")
         await state.set_state(AdminStates.waiting_for_owner)
 
     async def handle_owner_for_issue(self, message: Message, state: FSMContext):
-        owner = message.text.strip()
-        new_id = self.generate_corporate_id()
-        while await self.db.get_id(new_id):
-            new_id = self.generate_corporate_id()
-        await self.db.create_id(new_id, owner)
-        await self.db.audit_id_action(new_id, "issue", str(message.from_user.id), owner)
-        await message.answer(f"✅ Новый ID выдан: {new_id}\nВладелец: {owner}")
+        # One owner per line issues a whole batch in a single transaction
+        owners = [line.strip() for line in message.text.splitlines() if line.strip()]
+        if not owners:
+            await message.answer("Введите имя владельца для нового ID:")
+            return
+        try:
+            issued = await self.db.issue_ids(owners, str(message.from_user.id))
+        except RuntimeError as e:
+            logger.error(f"ID issuance failed: {e}")
+            await message.answer("❌ Не удалось выдать уникальные ID, попробуйте еще раз")
+            return
+        if len(issued) == 1:
+            new_id, owner = issued[0]
+            await message.answer(f"✅ Новый ID выдан: {new_id}\nВладелец: {owner}")
+        else:
+            text = "\n".join(f"{new_id} | {owner}" for new_id, owner in issued)
+            await message.answer(f"✅ Выдано ID: {len(issued)}\n{text}")
         await state.clear()
 
     async def revoke_id_command(self, message: Message, state: FSMContext):
@@ -260,14 +267,26 @@ class Telegram2FA:
         await state.set_state(AdminStates.waiting_for_search)
 
     async def handle_search_id(self, message: Message, state: FSMContext):
-        query = message.text.strip()
-        rows = await self.db.search_ids(query)
+        text_in = message.text.strip()
+        data = await state.get_data()
+        if text_in == "+" and data.get("search_cursor"):
+            # Next page of the previous query
+            query, cursor = data["search_query"], data["search_cursor"]
+        else:
+            query, cursor = text_in, None
+        page = await self.db.search_ids_page(query, cursor=cursor)
+        rows = page["items"]
         if not rows:
             await message.answer("Ничего не найдено")
+            await state.clear()
+            return
+        text = "\n".join([f"{r['id']} | {r.get('owner','')} | {r.get('status','')}" for r in rows])
+        if page["next_cursor"]:
+            await state.update_data(search_query=query, search_cursor=page["next_cursor"])
+            await message.answer(f"Результаты:\n{text}\n\nОтправьте + для следующей страницы")
         else:
-            text = "\n".join([f"{r['id']} | {r.get('owner','')} | {r.get('status','')}" for r in rows])
             await message.answer(f"Результаты:\n{text}")
-        await state.clear()
+            await state.clear()
 
     async def validate_id_command(self, message: Message, state: FSMContext):
         await message.answer("Введите ID для проверки:")
@@ -278,6 +297,7 @@ class Telegram2FA:
         if not re.match(r"^[A-HJ-NP-Z]{2}\d{6}$", id_value):
             await message.answer("❌ Неверный формат ID. Пример: AB123456")
             return
+        # Always the database: the in-memory index misses IDs written by other processes
         rec = await self.db.get_id(id_value)
         if not rec:
             await message.answer("❌ ID не найден")
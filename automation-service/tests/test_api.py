@@ -0,0 +1,184 @@
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+from fastapi.testclient import TestClient
+
+_tmpdir = tempfile.TemporaryDirectory()
+os.environ.update({
+    "TELEGRAM_BOT_TOKEN": "123456:test-token",
+    "BLITZ_ADMIN_PASSWORD": "test",
+    "CORPORATE_SECRET": "test-secret",
+    "DB_PATH": os.path.join(_tmpdir.name, "users.db"),
+    "QR_CACHE_DIR": os.path.join(_tmpdir.name, "qr"),
+})
+# main sets up logging into ./logs on import; keep it out of the source tree
+_cwd = os.getcwd()
+os.chdir(_tmpdir.name)
+try:
+    import main
+finally:
+    os.chdir(_cwd)
+
+SECRET = {"X-Corporate-Secret": "test-secret"}
+
+
+class StubBlitz:
+    """In-memory Blitz panel that counts user creations."""
+
+    def __init__(self):
+        self.users = {}
+        self.creates = []
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == "POST" and path == "/api/users":
+            body = json.loads(request.content)
+            self.creates.append(body["username"])
+            # Slow enough for overlapping grants to meet while this one is in flight
+            await asyncio.sleep(0.1)
+            self.users[body["username"]] = body
+            return httpx.Response(200, json=body)
+        username = path.rsplit("/", 1)[-1]
+        if request.method == "GET" and username in self.users:
+            return httpx.Response(200, json=self.users[username])
+        return httpx.Response(404, json={"detail": "not found"})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # The real lifespan also starts the bot, the monitor and the sync engines
+    await main.db.connect()
+    await main.db.init_db()
+    main.renderer.load()
+    yield
+    await main.db.close()
+
+
+stub = StubBlitz()
+# Shared by every test in the module; built in setUpModule
+client: Optional[TestClient] = None
+
+
+def setUpModule():
+    global client
+    main.blitz.http.transport = httpx.MockTransport(stub.handler)
+    main.app.router.lifespan_context = lifespan
+    client = TestClient(main.app)
+    client.__enter__()
+
+
+def tearDownModule():
+    client.__exit__(None, None, None)
+    main.qr.close()
+    _tmpdir.cleanup()
+
+
+def grant(corporate_id, include_qr=False):
+    response = client.post("/access/grant", json={"corporate_id": corporate_id, "include_qr": include_qr},
+                           headers=SECRET)
+    response.raise_for_status()
+    return response.json()
+
+
+class TestDownloads(unittest.TestCase):
+    def test_include_qr_false_leaves_the_qr_code_out(self):
+        self.assertIsNone(grant("D1")["qr_code"])
+        self.assertTrue(base64.b64decode(grant("D1", include_qr=True)["qr_code"]).startswith(b"\x89PNG"))
+
+        response = client.get("/user/D1/config", params={"include_qr": "false"}, headers=SECRET)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()["qr_code"])
+        response = client.get("/user/D1/config", headers=SECRET)
+        self.assertTrue(base64.b64decode(response.json()["qr_code"]).startswith(b"\x89PNG"))
+
+    def test_qr_is_revalidated_with_its_etag(self):
+        grant("D2")
+        response = client.get("/user/D2/qr", headers=SECRET)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "image/png")
+        self.assertEqual(response.headers["cache-control"], main.DOWNLOAD_CACHE_CONTROL)
+        self.assertTrue(response.content.startswith(b"\x89PNG"))
+        etag = response.headers["etag"]
+
+        for if_none_match in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+            cached = client.get("/user/D2/qr", headers={**SECRET, "If-None-Match": if_none_match})
+            self.assertEqual(cached.status_code, 304, if_none_match)
+            self.assertEqual(cached.content, b"")
+            self.assertEqual(cached.headers["etag"], etag)
+            self.assertEqual(cached.headers["cache-control"], main.DOWNLOAD_CACHE_CONTROL)
+
+        stale = client.get("/user/D2/qr", headers={**SECRET, "If-None-Match": '"other"'})
+        self.assertEqual(stale.status_code, 200)
+        svg = client.get("/user/D2/qr", params={"format": "svg"}, headers={**SECRET, "If-None-Match": etag})
+        self.assertEqual(svg.status_code, 200)
+        self.assertEqual(svg.headers["content-type"], "image/svg+xml")
+        self.assertNotEqual(svg.headers["etag"], etag)
+
+    def test_config_download_is_revalidated_with_its_etag(self):
+        granted = grant("D3")
+        response = client.get("/user/D3/config/download", headers=SECRET)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/json")
+        self.assertEqual(response.headers["content-disposition"],
+                         f'attachment; filename="{granted["username"]}_hysteria2.json"')
+        self.assertEqual(response.headers["cache-control"], main.DOWNLOAD_CACHE_CONTROL)
+        self.assertIn(stub.users["corp_D3"]["auth_key"], json.dumps(response.json()))
+        etag = response.headers["etag"]
+
+        cached = client.get("/user/D3/config/download", headers={**SECRET, "If-None-Match": etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b"")
+        self.assertEqual(cached.headers["etag"], etag)
+
+        singbox = client.get("/user/D3/config/download", params={"client": "singbox"},
+                             headers={**SECRET, "If-None-Match": etag})
+        self.assertEqual(singbox.status_code, 200)
+        self.assertNotEqual(singbox.headers["etag"], etag)
+
+    def test_downloads_need_the_secret_and_a_user(self):
+        for path in ("/user/D4/qr", "/user/D4/config/download"):
+            self.assertEqual(client.get(path, headers={"X-Corporate-Secret": "wrong"}).status_code, 403)
+            self.assertEqual(client.get(path, headers=SECRET).status_code, 404)
+
+
+class TestConcurrentGrants(unittest.TestCase):
+    def concurrently(self, *calls):
+        # Each call runs on its own thread; TestClient hands them all to the app's event loop
+        with ThreadPoolExecutor(len(calls)) as pool:
+            return [f.result() for f in [pool.submit(call) for call in calls]]
+
+    def test_concurrent_grants_create_the_panel_user_once(self):
+        joined = main.grant_flights.stats()["joined"]
+        responses = self.concurrently(*[lambda: grant("C1")] * 2)
+        self.assertEqual(responses[0]["hy2_url"], responses[1]["hy2_url"])
+        self.assertEqual(stub.creates.count("corp_C1"), 1)
+        self.assertEqual(main.grant_flights.stats()["joined"], joined + 1)
+
+    def test_single_grant_overlapping_a_batch_creates_the_panel_user_once(self):
+        joined = main.grant_flights.stats()["joined"]
+
+        def batch():
+            response = client.post("/access/grant/batch", json={"corporate_ids": ["C2", "C3"]}, headers=SECRET)
+            response.raise_for_status()
+            return {item["corporate_id"]: item for item in map(json.loads, response.text.splitlines())}
+
+        single, batched = self.concurrently(lambda: grant("C2"), batch)
+        self.assertEqual(set(batched), {"C2", "C3"})
+        self.assertEqual(batched["C2"]["status"], "granted")
+        self.assertEqual(batched["C2"]["hy2_url"], single["hy2_url"])
+        self.assertEqual(stub.creates.count("corp_C2"), 1)
+        self.assertEqual(stub.creates.count("corp_C3"), 1)
+        # Whichever came first, the other waited on its flight
+        self.assertEqual(main.grant_flights.stats()["joined"], joined + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,12 @@
+import asyncio
+import json
 import unittest
 
-from blitz_client import BlitzClient
+import httpx
+
+from blitz_client import BlitzClient, parse_batch_endpoints
+from circuit_breaker import CircuitBreaker
+from http_pool import HttpPool
 
 
 class TestBlitzClient(unittest.TestCase):
@@ -12,3 +18,198 @@ class TestBlitzClient(unittest.TestCase):
         c = BlitzClient("http://blitz:8000", "u", "p")
         self.assertEqual(c._public_base_url(), "http://blitz:8000")
 
+
+
+class TestBlitzLookupCache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.calls = []
+        self.users = {}
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            self.calls.append((request.method, request.url.path))
+            # Yield so concurrent callers overlap with the in-flight request
+            await asyncio.sleep(0.01)
+            username = request.url.path.split("/users/")[-1].split("/")[0]
+            if request.method == "POST":
+                body = json.loads(request.content)
+                self.users[body["username"]] = body
+                return httpx.Response(200, json={"username": body["username"]})
+            if request.method == "PUT":
+                self.users[username]["enable"] = json.loads(request.content)["enable"]
+                return httpx.Response(200, json={})
+            if username not in self.users:
+                return httpx.Response(404, json={"detail": "not found"})
+            return httpx.Response(200, json=self.users[username])
+
+        self.pool = HttpPool("test", transport=httpx.MockTransport(handler))
+        self.blitz = BlitzClient("http://blitz:8000/api", "token", http=self.pool,
+                                 breaker=CircuitBreaker("test"), retry_base_delay=0)
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+
+    async def test_concurrent_lookups_share_one_request(self):
+        self.users["corp_A"] = {"username": "corp_A", "auth_key": "k"}
+        results = await asyncio.gather(*(self.blitz.get_user("corp_A") for _ in range(10)))
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(all(r["auth_key"] == "k" for r in results))
+        self.assertEqual(self.blitz.cache_stats()["coalesced"], 9)
+
+    async def test_grant_flow_costs_one_lookup_and_one_create(self):
+        self.assertIsNone(await self.blitz.get_user("corp_B"))
+        created = await self.blitz.create_user("corp_B")
+        url = await self.blitz.get_hy2_url("corp_B")
+        self.assertIn(created["auth_key"], url)
+        self.assertEqual(self.calls, [("GET", "/api/users/corp_B"), ("POST", "/api/users")])
+
+    async def test_writes_invalidate_cached_lookup(self):
+        self.users["corp_C"] = {"username": "corp_C", "auth_key": "k", "enable": True}
+        self.assertTrue((await self.blitz.get_user("corp_C"))["enable"])
+        await self.blitz.update_user_status("corp_C", False)
+        self.assertFalse((await self.blitz.get_user("corp_C"))["enable"])
+        self.assertEqual([m for m, _ in self.calls], ["GET", "PUT", "GET"])
+
+    async def test_cached_user_cannot_be_mutated_by_caller(self):
+        self.users["corp_D"] = {"username": "corp_D", "auth_key": "k"}
+        user = await self.blitz.get_user("corp_D")
+        user["auth_key"] = "changed"
+        self.assertEqual((await self.blitz.get_user("corp_D"))["auth_key"], "k")
+
+
+class TestBlitzBulkOperations(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.calls = []
+        self.users = {}
+        self.failures = {}
+        # Usernames whose POST is applied but answered with a 502
+        self.lost_replies = set()
+        self.batch_endpoints = False
+        self.batch_status = 200
+        self.active = 0
+        self.max_active = 0
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            path = request.url.path[len("/api"):]
+            self.calls.append((request.method, path))
+            if path.startswith("/users/bulk"):
+                if not self.batch_endpoints:
+                    return httpx.Response(404, json={"detail": "Not Found"})
+                if self.batch_status != 200:
+                    return httpx.Response(self.batch_status, json={"detail": "boom"})
+                return httpx.Response(200, json={})
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            try:
+                await asyncio.sleep(0.01)
+            finally:
+                self.active -= 1
+            username = path.split("/users/")[-1].split("/")[0] if "/users/" in path else None
+            if request.method == "POST":
+                username = json.loads(request.content)["username"]
+            statuses = self.failures.get((request.method, username))
+            if statuses:
+                return httpx.Response(statuses.pop(0), json={"detail": "boom"})
+            if request.method == "POST":
+                if username in self.users:
+                    return httpx.Response(409, json={"detail": "already exists"})
+                self.users[username] = json.loads(request.content)
+                if username in self.lost_replies:
+                    return httpx.Response(502, json={"detail": "bad gateway"})
+                return httpx.Response(200, json={"username": username})
+            if username not in self.users:
+                return httpx.Response(404, json={"detail": "not found"})
+            if request.method == "GET":
+                return httpx.Response(200, json=self.users[username])
+            if request.method == "DELETE":
+                del self.users[username]
+            return httpx.Response(200, json={})
+
+        self.pool = HttpPool("test", transport=httpx.MockTransport(handler))
+        self.blitz = BlitzClient("http://blitz:8000/api", "token", http=self.pool,
+                                 breaker=CircuitBreaker("test"), retry_base_delay=0)
+        self.blitz.BULK_RETRY_DELAY = 0
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+
+    async def collect(self, results):
+        return {r["username"]: r async for r in results}
+
+    async def test_bulk_create_only_creates_missing_users(self):
+        self.users["u0"] = {"username": "u0", "auth_key": "old"}
+        names = [f"u{i}" for i in range(20)]
+        results = await self.collect(self.blitz.bulk_create_users(names, concurrency=4))
+        self.assertTrue(all(r["ok"] for r in results.values()))
+        self.assertFalse(results["u0"]["created"])
+        self.assertEqual(results["u0"]["user"]["auth_key"], "old")
+        self.assertTrue(results["u5"]["created"])
+        self.assertEqual(results["u5"]["user"]["auth_key"], self.users["u5"]["auth_key"])
+        self.assertLessEqual(self.max_active, 4)
+        # No batch endpoint is configured, so creates fan out without probing
+        self.assertFalse(any(p.startswith("/users/bulk") for _, p in self.calls))
+        self.assertEqual(sum(1 for m, p in self.calls if m == "POST" and p == "/users"), 19)
+
+    async def test_only_failed_items_are_retried(self):
+        # POST is not retried by _make_request, so these retries are the bulk layer's
+        self.failures = {("POST", "b"): [503], ("POST", "c"): [400]}
+        results = await self.collect(self.blitz.bulk_create_users(["a", "b", "c"]))
+        self.assertEqual((results["a"]["ok"], results["a"]["attempts"]), (True, 1))
+        self.assertEqual((results["b"]["ok"], results["b"]["attempts"]), (True, 2))
+        # Client errors are not retried
+        self.assertEqual((results["c"]["ok"], results["c"]["attempts"]), (False, 1))
+        posts = [p for m, p in self.calls if m == "POST" and p == "/users"]
+        self.assertEqual(len(posts), 4)
+
+    async def test_create_with_a_lost_reply_is_not_posted_again(self):
+        self.lost_replies = {"b"}
+        results = await self.collect(self.blitz.bulk_create_users(["a", "b"]))
+        self.assertTrue(results["b"]["ok"] and results["b"]["created"])
+        self.assertEqual(results["b"]["attempts"], 1)
+        self.assertEqual(results["b"]["user"]["auth_key"], self.users["b"]["auth_key"])
+        self.assertEqual(sum(1 for m, p in self.calls if m == "POST" and p == "/users"), 2)
+
+    async def test_user_created_elsewhere_meanwhile_counts_as_done(self):
+        real_get_user = self.blitz.get_user
+
+        async def lookup_then_create_elsewhere(username):
+            # Missing at the first lookup, created by another caller right after
+            self.blitz.get_user = real_get_user
+            self.users[username] = {"username": username, "auth_key": "theirs"}
+            return None
+
+        self.blitz.get_user = lookup_then_create_elsewhere
+        results = await self.collect(self.blitz.bulk_create_users(["a"]))
+        self.assertTrue(results["a"]["ok"])
+        self.assertEqual(results["a"]["user"]["auth_key"], "theirs")
+        self.assertEqual(sum(1 for m, p in self.calls if m == "POST"), 1)
+
+    async def test_configured_batch_endpoint_is_used(self):
+        self.batch_endpoints = True
+        self.blitz.batch_endpoints = parse_batch_endpoints('{"delete": "/users/bulk/delete"}')
+        results = await self.collect(self.blitz.bulk_delete(["a", "b", "c"]))
+        self.assertTrue(all(r["ok"] and r["deleted"] for r in results.values()))
+        self.assertEqual(self.calls, [("POST", "/users/bulk/delete")])
+
+    async def test_failed_batch_create_does_not_fall_back(self):
+        # The batch may have been partly applied; single creates could duplicate users
+        self.batch_endpoints = True
+        self.batch_status = 500
+        self.blitz.batch_endpoints = {"create": "/users/bulk"}
+        results = await self.collect(self.blitz.bulk_create_users(["a", "b"]))
+        self.assertTrue(all(not r["ok"] and not r["created"] for r in results.values()))
+        self.assertFalse(any(m == "POST" and p == "/users" for m, p in self.calls))
+
+    def test_parse_batch_endpoints(self):
+        self.assertEqual(parse_batch_endpoints(""), {})
+        with self.assertRaises(ValueError):
+            parse_batch_endpoints('{"rename": "/users/bulk/rename"}')
+        with self.assertRaises(ValueError):
+            parse_batch_endpoints('["/users/bulk"]')
+
+    async def test_missing_batch_endpoint_is_remembered(self):
+        self.blitz.batch_endpoints = {"delete": "/users/bulk/delete"}
+        self.users.update({n: {"username": n} for n in ("a", "b")})
+        await self.collect(self.blitz.bulk_delete(["a"]))
+        await self.collect(self.blitz.bulk_delete(["b"]))
+        self.assertEqual(sum(1 for m, p in self.calls if p == "/users/bulk/delete"), 1)
+        self.assertEqual(self.users, {})
@@ -0,0 +1,148 @@
+import asyncio
+import time
+import unittest
+
+import httpx
+
+from blitz_client import BlitzClient
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from http_pool import HttpPool
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_threshold_and_half_opens_after_timeout(self):
+        breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=0.05)
+        for _ in range(2):
+            breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        breaker.before_call()
+        # Only one trial call is let through while half-open
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_trial_success_closes(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(breaker.stats()["consecutive_failures"], 0)
+
+    def test_release_frees_the_trial_slot(self):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+        breaker.trip()
+        breaker.before_call()
+        breaker.release()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+    def test_trip_opens_immediately(self):
+        breaker = CircuitBreaker("test", failure_threshold=100)
+        breaker.trip()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertGreater(breaker.retry_after(), 0)
+
+
+class TestBlitzRetries(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.calls = []
+        self.responses = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            self.calls.append(request.method)
+            status = self.responses.pop(0) if self.responses else 200
+            if status == "drop":
+                raise httpx.ConnectError("connection refused", request=request)
+            if status == "hang":
+                await asyncio.Event().wait()
+            if status == "garbage":
+                return httpx.Response(200, text="<html>maintenance</html>")
+            return httpx.Response(status, json={"username": "u", "auth_key": "k"})
+
+        self.pool = HttpPool("test", transport=httpx.MockTransport(handler))
+        self.breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+        self.blitz = BlitzClient("http://blitz:8000/api", "token", http=self.pool,
+                                 breaker=self.breaker, retry_base_delay=0, cache_ttl=0)
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+
+    async def test_idempotent_call_is_retried(self):
+        self.responses = [503, "drop"]
+        user = await self.blitz.get_user("u")
+        self.assertEqual(user["auth_key"], "k")
+        self.assertEqual(self.calls, ["GET", "GET", "GET"])
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    async def test_post_is_not_retried(self):
+        self.responses = [503]
+        with self.assertRaises(httpx.HTTPStatusError):
+            await self.blitz.create_user("u")
+        self.assertEqual(self.calls, ["POST"])
+
+    async def test_client_errors_do_not_open_breaker(self):
+        self.responses = [400] * 5
+        for _ in range(5):
+            with self.assertRaises(httpx.HTTPStatusError):
+                await self.blitz.update_user_status("u", False)
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    async def test_open_breaker_sheds_calls(self):
+        self.responses = ["drop"] * 3
+        with self.assertRaises(httpx.ConnectError):
+            await self.blitz.get_user("u")
+        self.assertEqual(self.breaker.state, OPEN)
+        calls = len(self.calls)
+        with self.assertRaises(CircuitOpenError):
+            await self.blitz.get_user("u")
+        self.assertEqual(len(self.calls), calls)
+
+    async def test_concurrent_callers_fail_fast_while_open(self):
+        self.breaker.trip()
+        results = await asyncio.gather(*(self.blitz.get_user_stats(f"u{i}") for i in range(50)),
+                                       return_exceptions=True)
+        self.assertTrue(all(isinstance(r, CircuitOpenError) for r in results))
+        self.assertEqual(self.calls, [])
+
+
+    async def test_cancelled_half_open_trial_frees_its_slot(self):
+        self.breaker.configure(reset_timeout=0)
+        self.breaker.trip()
+        self.responses = ["hang"]
+        # Lookups are coalesced and shielded; a status change is cancelled with its caller
+        trial = asyncio.ensure_future(self.blitz.update_user_status("u", False))
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.calls, ["PUT"])
+        trial.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await trial
+
+        # The next caller gets the trial slot and closes the breaker
+        self.assertEqual((await self.blitz.get_user("u"))["auth_key"], "k")
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    async def test_unreadable_reply_counts_as_a_failure(self):
+        self.breaker.configure(failure_threshold=1, reset_timeout=0)
+        self.breaker.trip()
+        self.responses = ["garbage"]
+        with self.assertRaises(ValueError):
+            await self.blitz.get_user("u")
+        self.assertEqual(self.breaker.stats()["failures"], 1)
+        # Re-opened rather than stuck half-open with its slot taken
+        self.assertEqual((await self.blitz.get_user("u"))["auth_key"], "k")
+        self.assertEqual(self.breaker.state, CLOSED)
+
+
+if __name__ == "__main__":
+    unittest.main()
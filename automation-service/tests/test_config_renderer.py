@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+import unittest
+
+from config_renderer import TEMPLATE_FILES, ConfigRenderer, default_templates_dir, speed_mbps
+
+
+class TestConfigRenderer(unittest.TestCase):
+    def setUp(self):
+        self.renderer = ConfigRenderer("vpn.example.com", port=8443, sni="cdn.example.com")
+        self.renderer.load()
+
+    def test_repository_templates_load(self):
+        self.assertTrue(os.path.isdir(default_templates_dir()))
+        self.assertEqual(set(self.renderer.templates), set(TEMPLATE_FILES))
+
+    def test_hy2_url(self):
+        url = self.renderer.hy2_url("corp_A", "key/with+chars")
+        self.assertEqual(
+            url, "hy2://key%2Fwith%2Bchars@vpn.example.com:8443/?sni=cdn.example.com&insecure=0#CorporateVPN_corp_A"
+        )
+
+    def test_render_templates(self):
+        config = self.renderer.render("corp_A", 'k"ey')
+        self.assertEqual(config["server"], "vpn.example.com:8443")
+        self.assertEqual(config["auth"], 'k"ey')
+        self.assertEqual(config["tls"]["sni"], "cdn.example.com")
+        self.assertEqual(config["bandwidth"]["up"], "100 mbps")
+
+        singbox = self.renderer.render("corp_A", "key", "singbox")
+        outbound = singbox["outbounds"][0]
+        self.assertEqual((outbound["server"], outbound["password"]), ("vpn.example.com", "key"))
+        self.assertEqual((outbound["server_port"], outbound["up_mbps"], outbound["down_mbps"]), (8443, 100, 100))
+        self.assertEqual(json.loads(self.renderer.render_text("corp_A", "key", "singbox")), singbox)
+
+        with self.assertRaises(ValueError):
+            self.renderer.render("corp_A", "key", "wireguard")
+
+    def test_singbox_follows_node_port_and_speeds(self):
+        renderer = ConfigRenderer("vpn.example.com", upload_speed="50 mbps", download_speed="1 gbps")
+        outbound = renderer.render("corp_A", "key", "singbox", host="node2.example.com", port=9443)["outbounds"][0]
+        self.assertEqual((outbound["server"], outbound["server_port"]), ("node2.example.com", 9443))
+        self.assertEqual((outbound["up_mbps"], outbound["down_mbps"]), (50, 1000))
+        self.assertEqual((speed_mbps("512 kbps"), speed_mbps("fast")), (1, None))
+
+    def test_output_is_memoized_per_user_and_key(self):
+        first = self.renderer.render("corp_A", "key")
+        self.assertIs(self.renderer.render("corp_A", "key"), first)
+        self.assertIsNot(self.renderer.render("corp_A", "rotated"), first)
+        stats = self.renderer.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+
+    def test_reload_picks_up_template_changes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, TEMPLATE_FILES["hysteria2"])
+            with open(path, "w") as f:
+                f.write('{"server": "{{server}}", "auth": "{{auth_key}}"}')
+            renderer = ConfigRenderer("h", templates_dir=tmp, cache_size=1)
+            old = renderer.load()
+            self.assertEqual(renderer.render("u", "k"), {"server": "h:443", "auth": "k"})
+
+            with open(path, "w") as f:
+                f.write('{"auth": "{{auth_key}}", "v": 2}')
+            self.assertNotEqual(renderer.load(), old)
+            self.assertEqual(renderer.render("u", "k"), {"auth": "k", "v": 2})
+            # Missing templates are reported on use, not at load time
+            with self.assertRaises(ValueError):
+                renderer.render("u", "k", "singbox")
+
+
+if __name__ == "__main__":
+    unittest.main()
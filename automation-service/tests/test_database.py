@@ -1,4 +1,6 @@
+import asyncio
 import os
+import sqlite3
 import tempfile
 import unittest
 
@@ -13,6 +15,7 @@ class TestDatabase(unittest.IsolatedAsyncioTestCase):
         await self.db.init_db()
 
     async def asyncTearDown(self):
+        await self.db.close()
         self.tmpdir.cleanup()
 
     async def test_id_registry_roundtrip(self):
@@ -28,3 +31,226 @@ class TestDatabase(unittest.IsolatedAsyncioTestCase):
         rec = await self.db.get_id("AB123456")
         self.assertEqual(rec["status"], "revoked")
 
+    async def test_pool_reuses_connections(self):
+        await self.db.create_id("AB123456", "tester")
+        for _ in range(10):
+            await self.db.get_id("AB123456")
+        stats = self.db.pool_stats()
+        self.assertTrue(stats["open"])
+        self.assertEqual(stats["readers_total"], 4)
+        self.assertEqual(stats["readers_idle"], 4)
+        self.assertGreaterEqual(stats["reads"], 10)
+
+    async def test_pool_pragmas(self):
+        async with self.db.pool.read() as conn:
+            async with conn.execute("PRAGMA journal_mode") as cursor:
+                self.assertEqual((await cursor.fetchone())[0], "wal")
+            async with conn.execute("PRAGMA synchronous") as cursor:
+                # 1 == NORMAL
+                self.assertEqual((await cursor.fetchone())[0], 1)
+
+    async def test_write_behind_batches_log_inserts(self):
+        for i in range(50):
+            await self.db.log_monitor_event("test", "INFO", f"event {i}")
+        await self.db.flush()
+        stats = self.db.pool_stats()["write_behind"]
+        self.assertEqual(stats["committed"], 50)
+        self.assertLess(stats["batches"], 50)
+        async with self.db.telemetry_pool.read() as conn:
+            async with conn.execute("SELECT COUNT(*) FROM monitor_events") as cursor:
+                self.assertEqual((await cursor.fetchone())[0], 50)
+
+    async def test_durable_log_is_visible_on_return(self):
+        await self.db.log_auth_attempt("C1", "42", "login", "127.0.0.1", "test", True, durable=True)
+        logs = await self.db.get_user_auth_logs("C1")
+        self.assertEqual(len(logs), 1)
+        self.assertEqual(logs[0]["action"], "login")
+
+    async def test_concurrent_traffic_updates_do_not_lose_deltas(self):
+        await self.db.add_user("C1", "corp_C1", "sub", "hy2://", "key")
+        await asyncio.gather(*[self.db.update_traffic_stats("C1", 10, 20) for _ in range(25)])
+        user = await self.db.get_user("C1")
+        self.assertEqual(user["total_upload"], 250)
+        self.assertEqual(user["total_download"], 500)
+        self.assertIsNone(await self.db.update_traffic_stats("missing", 1, 1))
+
+    async def test_bulk_update_traffic_stats(self):
+        for i in range(3):
+            await self.db.add_user(f"C{i}", f"corp_C{i}", "sub", "hy2://", "key")
+        deltas = [(f"C{i % 3}", 1, 2) for i in range(300)] + [("unknown", 5, 5)]
+        updated = await self.db.bulk_update_traffic_stats(deltas, chunk_size=64)
+        self.assertEqual(updated, 300)
+        user = await self.db.get_user("C0")
+        self.assertEqual(user["total_upload"], 100)
+        self.assertEqual(user["total_download"], 200)
+        async with self.db.telemetry_pool.read() as conn:
+            async with conn.execute("SELECT COUNT(*) FROM traffic_stats") as cursor:
+                self.assertEqual((await cursor.fetchone())[0], 300)
+
+    async def raw_sample_count(self):
+        async with self.db.telemetry_pool.read() as conn:
+            async with conn.execute("SELECT COUNT(*) FROM traffic_stats") as cursor:
+                return (await cursor.fetchone())[0]
+
+    async def test_failed_sample_copy_keeps_totals_and_is_retried_once(self):
+        await self.db.add_user("C1", "corp_C1", "sub", "hy2://", "key")
+        async with self.db.telemetry_pool.write() as conn:
+            await conn.execute("""
+                CREATE TRIGGER fail_raw BEFORE INSERT ON traffic_stats BEGIN SELECT RAISE(ABORT, 'disk full'); END
+            """)
+        self.assertEqual((await self.db.update_traffic_stats("C1", 10, 20))["total_upload"], 10)
+        await self.db.bulk_update_traffic_stats([("C1", 1, 2)], counters=[("hysteria", "corp_C1", 1, 2)])
+        self.assertEqual((await self.db.get_user("C1"))["total_upload"], 11)
+        self.assertEqual(await self.db.get_traffic_counters("hysteria"), {"corp_C1": (1, 2)})
+        self.assertEqual(await self.raw_sample_count(), 0)
+
+        async with self.db.telemetry_pool.write() as conn:
+            await conn.execute("DROP TRIGGER fail_raw")
+        async with self.db.pool.read() as conn:
+            async with conn.execute("SELECT * FROM traffic_outbox") as cursor:
+                pending = [tuple(row) for row in await cursor.fetchall()]
+        self.assertEqual(len(pending), 2)
+        self.assertEqual(await self.db.flush_traffic_outbox(), 2)
+        self.assertEqual(await self.db.flush_traffic_outbox(), 0)
+
+        # A crash after the copy but before the outbox delete: the re-run copies nothing
+        async with self.db.pool.write() as conn:
+            await conn.executemany("INSERT INTO traffic_outbox VALUES (?, ?, ?, ?, ?, ?, ?)", pending)
+        self.assertEqual(await self.db.flush_traffic_outbox(), 0)
+        self.assertEqual(await self.raw_sample_count(), 2)
+        self.assertEqual((await self.db.get_user_traffic_stats("C1"))[0]["total_upload"], 11)
+
+    async def test_traffic_updates_do_not_wait_on_the_telemetry_lock(self):
+        await self.db.add_user("C1", "corp_C1", "sub", "hy2://", "key")
+        # Another telemetry writer (write-behind flush, retention chunk) holds its lock
+        blocker = sqlite3.connect(self.db.telemetry_db_path, isolation_level=None)
+        blocker.execute("BEGIN IMMEDIATE")
+        try:
+            sync = asyncio.ensure_future(self.db.bulk_update_traffic_stats([("C1", 5, 6)]))
+            await asyncio.sleep(0.2)
+            self.assertFalse(sync.done())
+            # The totals are committed and the hot writer is free for everyone else
+            self.assertEqual((await self.db.get_user("C1"))["total_upload"], 5)
+            await asyncio.wait_for(self.db.add_user("C2", "corp_C2", "sub", "hy2://", "key"), timeout=1)
+        finally:
+            blocker.commit()
+            blocker.close()
+        self.assertEqual(await sync, 1)
+        self.assertEqual(await self.raw_sample_count(), 1)
+
+    async def test_traffic_rollups_follow_raw_inserts(self):
+        await self.db.add_user("C1", "corp_C1", "sub", "hy2://", "key")
+        await self.db.update_traffic_stats("C1", 100, 200)
+        await self.db.bulk_update_traffic_stats([("C1", 1, 2), ("C1", 3, 4)])
+        daily = await self.db.get_user_traffic_stats("C1")
+        self.assertEqual(len(daily), 1)
+        self.assertEqual(daily[0]["total_upload"], 104)
+        self.assertEqual(daily[0]["total_download"], 206)
+        self.assertEqual(daily[0]["connection_count"], 3)
+        hourly = await self.db.get_user_hourly_traffic("C1")
+        self.assertEqual(sum(row["total_upload"] for row in hourly), 104)
+
+        # A rebuild from raw rows reproduces the incremental result
+        await self.db.backfill_traffic_rollups()
+        self.assertEqual(await self.db.get_user_traffic_stats("C1"), daily)
+
+    async def test_search_ids_ranks_and_paginates(self):
+        for i in range(30):
+            await self.db.create_id(f"AB{i:06d}", f"owner {i}")
+        await self.db.create_id("CD123456", "Ivan Petrov")
+        await self.db.set_id_status("AB000001", "revoked")
+
+        first = await self.db.search_ids_page("AB0000", limit=5)
+        self.assertEqual(len(first["items"]), 5)
+        second = await self.db.search_ids_page("AB0000", limit=5, cursor=first["next_cursor"])
+        self.assertEqual(len(second["items"]), 5)
+        ids = [r["id"] for r in first["items"] + second["items"]]
+        self.assertEqual(len(set(ids)), 10)
+
+        exact = await self.db.search_ids("AB000007")
+        self.assertEqual(exact[0]["id"], "AB000007")
+        self.assertEqual([r["id"] for r in await self.db.search_ids("petr")], ["CD123456"])
+        self.assertEqual([r["id"] for r in await self.db.search_ids("revoked")], ["AB000001"])
+        self.assertEqual(len(await self.db.search_ids("CD")), 1)
+
+    async def test_iter_export_rows_pages_and_resumes(self):
+        async with self.db.telemetry_pool.write() as conn:
+            await conn.executemany(
+                "INSERT INTO auth_logs (corporate_id, action, created_at) VALUES (?, 'login', ?)",
+                [(f"C{i}", f"2026-01-{1 + i // 10:02d} 12:00:00") for i in range(50)],
+            )
+        pages = [rows async for _, rows in self.db.iter_export_rows("auth_logs", batch_size=20)]
+        self.assertEqual([len(p) for p in pages], [20, 20, 10])
+
+        ranged = [row async for _, rows in self.db.iter_export_rows(
+            "auth_logs", since="2026-01-02 00:00:00", until="2026-01-04 00:00:00", batch_size=7)
+            for row in rows]
+        self.assertEqual(len(ranged), 20)
+
+        resumed = [row async for _, rows in self.db.iter_export_rows("auth_logs", after_id=45)
+                   for row in rows]
+        self.assertEqual([row[0] for row in resumed], [46, 47, 48, 49, 50])
+
+    async def test_user_cache_hits_and_invalidation(self):
+        await self.db.add_user("C1", "corp_C1", "sub", "hy2://", "key")
+        await self.db.link_telegram_to_corporate("42", "C1")
+        await self.db.get_user("C1")
+        user = await self.db.get_user_by_telegram_id("42")
+        self.assertEqual(user["corporate_id"], "C1")
+        self.assertGreaterEqual(self.db.user_cache.stats()["hits"], 1)
+
+        await self.db.deactivate_user("C1")
+        self.assertEqual((await self.db.get_user("C1"))["is_active"], 0)
+        self.assertEqual((await self.db.get_user_by_telegram_id("42"))["is_active"], 0)
+
+        await self.db.update_traffic_stats("C1", 5, 6)
+        self.assertEqual((await self.db.get_user("C1"))["total_upload"], 5)
+
+    async def test_issue_ids_batch_uses_index(self):
+        await self.db.create_id("AB123456", "tester")
+        issued = await self.db.issue_ids([f"owner {i}" for i in range(200)], "admin")
+        self.assertEqual(len({id_value for id_value, _ in issued}), 200)
+        self.assertNotIn("AB123456", [id_value for id_value, _ in issued])
+        for id_value, owner in issued[:5]:
+            self.assertIn(id_value, self.db.issued_ids)
+            self.assertEqual((await self.db.get_id(id_value))["owner"], owner)
+
+        # A fresh process rebuilds the index from the registry
+        await self.db.load_issued_ids()
+        self.assertEqual(len(self.db.issued_ids), 201)
+
+    async def test_get_id_sees_ids_written_by_other_processes(self):
+        # Written behind the index's back, as the import CLI does
+        async with self.db.pool.write() as conn:
+            await conn.execute("INSERT INTO id_registry (id, owner, status) VALUES ('CD654321', 'cli', 'issued')")
+        self.assertNotIn("CD654321", self.db.issued_ids)
+        self.assertEqual((await self.db.get_id("CD654321"))["owner"], "cli")
+        self.assertIn("CD654321", self.db.issued_ids)
+
+    async def test_webhook_claim_ack_nack(self):
+        for i in range(5):
+            await self.db.create_webhook_event("user_deactivated", f"C{i}", "{}", durable=True)
+
+        first, second = await asyncio.gather(
+            self.db.claim_webhook_events("worker-1", limit=3),
+            self.db.claim_webhook_events("worker-2", limit=3),
+        )
+        ids_1 = {e["id"] for e in first}
+        ids_2 = {e["id"] for e in second}
+        self.assertEqual(len(ids_1 | ids_2), 5)
+        self.assertFalse(ids_1 & ids_2)
+
+        # Only the lease holder can ack
+        self.assertEqual(await self.db.ack_webhook_events("worker-2", sorted(ids_1)), [])
+        self.assertEqual(await self.db.ack_webhook_events("worker-1", sorted(ids_1)), sorted(ids_1))
+
+        released = await self.db.nack_webhook_events("worker-2", sorted(ids_2), "boom")
+        self.assertEqual(released, sorted(ids_2))
+        retry = await self.db.claim_webhook_events("worker-3", limit=10)
+        self.assertEqual({e["id"] for e in retry}, ids_2)
+        self.assertTrue(all(e["attempts"] == 2 for e in retry))
+
+        # Expired leases past max_attempts are dead-lettered, not re-delivered
+        await self.db.nack_webhook_events("worker-3", sorted(ids_2), "boom", max_attempts=2)
+        self.assertEqual(await self.db.claim_webhook_events("worker-4"), [])
+        self.assertEqual((await self.db.webhook_queue_stats())["dead_lettered"], len(ids_2))
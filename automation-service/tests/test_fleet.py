@@ -0,0 +1,280 @@
+import json
+import os
+import tempfile
+import unittest
+
+import httpx
+
+from blitz_client import BlitzClient
+from circuit_breaker import CircuitBreaker
+from config_renderer import ConfigRenderer
+from database import Database
+from fleet import BlitzNode, Fleet, FleetNode, MarzbanNode, parse_nodes
+from http_pool import HttpPool
+from marzban import MarzbanClient
+
+
+class StubBlitz:
+    """In-memory Blitz panel plus the Hysteria2 /online and /traffic API of its node."""
+
+    def __init__(self, online=0, traffic=0):
+        self.users = {}
+        self.online = online
+        self.traffic = traffic
+        self.calls = []
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        self.calls.append((request.method, path))
+        if path == "/online":
+            return httpx.Response(200, json={"someone": self.online})
+        if path == "/traffic":
+            return httpx.Response(200, json={"someone": {"tx": self.traffic, "rx": 0}})
+        parts = path.split("/")
+        if request.method == "POST" and path == "/api/users":
+            body = json.loads(request.content)
+            self.users[body["username"]] = body
+            return httpx.Response(200, json={"username": body["username"]})
+        if len(parts) >= 4 and parts[3] in self.users:
+            username = parts[3]
+            if request.method == "GET" and len(parts) == 4:
+                return httpx.Response(200, json=self.users[username])
+            if request.method == "PUT" and path.endswith("/status"):
+                self.users[username]["enable"] = json.loads(request.content)["enable"]
+                return httpx.Response(200, json={})
+            if request.method == "DELETE":
+                del self.users[username]
+                return httpx.Response(200, json={})
+        return httpx.Response(404, json={"detail": "not found"})
+
+
+class StubMarzban:
+    def __init__(self, online=0):
+        self.users = {}
+        self.online = online
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if path == "/api/system":
+            return httpx.Response(200, json={"online_users": self.online, "incoming_bandwidth": 0,
+                                             "outgoing_bandwidth": 0})
+        if request.method == "POST" and path == "/api/user":
+            body = json.loads(request.content)
+            self.users[body["username"]] = body
+            return httpx.Response(200, json=body)
+        username = path.split("/")[-1]
+        if username not in self.users:
+            return httpx.Response(404, json={"detail": "not found"})
+        if request.method == "PUT":
+            self.users[username].update(json.loads(request.content))
+        elif request.method == "DELETE":
+            del self.users[username]
+            return httpx.Response(200, json={})
+        return httpx.Response(200, json=self.users[username])
+
+
+class TestFleet(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmpdir.name, "users.db"))
+        await self.db.init_db()
+        self.renderer = ConfigRenderer("vpn.example.com")
+        self.pools = []
+        self.stubs = {"a": StubBlitz(online=10), "b": StubBlitz(online=2), "c": StubBlitz(online=6)}
+        nodes = [self.blitz_node(name, stub) for name, stub in self.stubs.items()]
+        self.fleet = Fleet(nodes, self.db, self.renderer, replicas=2, load_ttl=3600)
+
+    async def asyncTearDown(self):
+        for pool in self.pools:
+            await pool.close()
+        await self.db.close()
+        self.tmpdir.cleanup()
+
+    def pool(self, name, handler):
+        pool = HttpPool(name, transport=httpx.MockTransport(handler))
+        self.pools.append(pool)
+        return pool
+
+    def blitz_node(self, name, stub, **kwargs):
+        client = BlitzClient(f"http://{name}:8000/api", "token", http=self.pool(f"blitz:{name}", stub.handler),
+                             breaker=CircuitBreaker(name), cache_ttl=0, retry_base_delay=0,
+                             renderer=self.renderer)
+        return BlitzNode(name, client, f"{name}.example.com", traffic_url=f"http://{name}:9999",
+                         http=self.pool(f"hysteria:{name}", stub.handler), **kwargs)
+
+    async def grant(self, corporate_id):
+        username = f"corp_{corporate_id}"
+        auth_key, nodes = await self.fleet.provision(username)
+        await self.db.add_user(corporate_id, username, "sub", "", auth_key)
+        await self.db.set_user_nodes(corporate_id, nodes)
+        return auth_key, nodes
+
+    async def test_provision_places_on_least_loaded_nodes_with_shared_key(self):
+        auth_key, nodes = await self.grant("U1")
+        self.assertEqual(nodes, ["b", "c"])
+        self.assertEqual(self.stubs["b"].users["corp_U1"]["auth_key"], auth_key)
+        self.assertEqual(self.stubs["c"].users["corp_U1"]["auth_key"], auth_key)
+        self.assertNotIn("corp_U1", self.stubs["a"].users)
+
+        urls = await self.fleet.hy2_urls(await self.db.get_user("U1"))
+        self.assertEqual(len(urls), 2)
+        self.assertIn(f"{auth_key}@b.example.com:443", urls[0])
+        self.assertIn("@c.example.com:443", urls[1])
+        self.assertTrue(urls[1].endswith("_c"))
+
+    async def test_pending_placements_spread_a_burst(self):
+        self.fleet.replicas = 1
+        self.stubs["b"].online = 5
+        self.stubs["c"].online = 5
+        placed = [(await self.fleet.provision(f"corp_B{i}"))[1][0] for i in range(4)]
+        self.assertEqual(sorted(placed), ["b", "b", "c", "c"])
+
+    async def test_unhealthy_and_drained_nodes_are_skipped(self):
+        self.fleet.nodes["b"].placement = False
+
+        async def down(request):
+            raise httpx.ConnectError("down")
+
+        self.fleet.nodes["c"].http = self.pool("hysteria:down", down)
+        _, nodes = await self.fleet.provision("corp_X")
+        self.assertEqual(nodes, ["a"])
+        self.assertFalse(self.fleet.nodes["c"].healthy)
+
+    async def test_bulk_provision_and_status_cover_every_node(self):
+        usernames = [f"corp_M{i}" for i in range(6)]
+        results = [r async for r in self.fleet.bulk_provision(usernames, concurrency=4)]
+        self.assertEqual(sorted(r["username"] for r in results), usernames)
+        self.assertTrue(all(r["ok"] and len(r["nodes"]) == 2 for r in results))
+        for r in results:
+            corporate_id = r["username"][len("corp_"):]
+            await self.db.add_user(corporate_id, r["username"], "sub", "", r["auth_key"])
+            await self.db.set_user_nodes(corporate_id, r["nodes"])
+            for name in r["nodes"]:
+                self.assertEqual(self.stubs[name].users[r["username"]]["auth_key"], r["auth_key"])
+
+        users = {u: u[len("corp_"):] for u in usernames}
+        results = [r async for r in self.fleet.bulk_set_status(users, False, concurrency=4)]
+        self.assertTrue(all(r["ok"] for r in results))
+        for stub in self.stubs.values():
+            self.assertTrue(all(not u["enable"] for u in stub.users.values()))
+
+    async def test_set_status_reports_failing_node(self):
+        await self.grant("U1")
+        del self.stubs["c"].users["corp_U1"]
+        with self.assertRaises(httpx.HTTPStatusError):
+            await self.fleet.set_status("U1", "corp_U1", False)
+        self.assertFalse(self.stubs["b"].users["corp_U1"]["enable"])
+
+    async def test_unplaced_users_live_on_the_default_node(self):
+        await self.db.add_user("OLD", "corp_OLD", "sub", "", "k")
+        self.assertEqual([n.name for n in await self.fleet.nodes_for("OLD")], ["a"])
+        self.assertEqual(await self.db.assign_default_node("a"), 1)
+        self.assertEqual(await self.db.get_user_nodes("OLD"), ["a"])
+
+    async def test_rebalance_moves_users_off_hot_node(self):
+        self.fleet.replicas = 1
+        # Without session counts nodes are scored by placed users
+        for stub in self.stubs.values():
+            stub.online = 0
+        for node in self.fleet.nodes.values():
+            node.traffic_url = ""
+        for i in range(9):
+            await self.db.add_user(f"H{i}", f"corp_H{i}", "sub", "", f"k{i}")
+            self.stubs["a"].users[f"corp_H{i}"] = {"username": f"corp_H{i}", "auth_key": f"k{i}", "enable": True}
+        await self.db.assign_default_node("a")
+
+        report = await self.fleet.rebalance(dry_run=True, threshold=0.25)
+        self.assertEqual(len(report["moves"]), 6)
+        self.assertEqual(len(self.stubs["a"].users), 9)
+
+        report = await self.fleet.rebalance(dry_run=False, threshold=0.25)
+        self.assertEqual((report["moved"], report["failed"]), (6, 0))
+        self.assertEqual(await self.db.get_node_user_counts(), {"a": 3, "b": 3, "c": 3})
+        self.assertEqual({n: len(s.users) for n, s in self.stubs.items()}, {"a": 3, "b": 3, "c": 3})
+        moved = report["moves"][0]
+        username = f"corp_{moved['corporate_id']}"
+        self.assertEqual(self.stubs[moved["target"]].users[username]["auth_key"],
+                         (await self.db.get_user(moved["corporate_id"]))["hy2_auth_key"])
+
+        report = await self.fleet.rebalance(dry_run=True, threshold=0.25)
+        self.assertEqual(report["moves"], [])
+
+    def marzban_node(self, stub):
+        return MarzbanNode("m", MarzbanClient("http://m:8000", "t", http=self.pool("marzban:m", stub.handler)),
+                           "m.example.com")
+
+    async def test_marzban_node_gets_users_but_no_hy2_entry(self):
+        marzban = StubMarzban(online=0)
+        self.fleet = Fleet([*self.fleet.nodes.values(), self.marzban_node(marzban)], self.db, self.renderer,
+                           replicas=2)
+        _, nodes = await self.grant("U1")
+        # The idle Marzban node is a replica; the primary must serve Hysteria2
+        self.assertEqual(nodes, ["b", "m"])
+        self.assertIn("corp_U1", marzban.users)
+
+        urls = await self.fleet.hy2_urls(await self.db.get_user("U1"))
+        self.assertEqual(len(urls), 1)
+        self.assertIn("@b.example.com", urls[0])
+
+        await self.fleet.set_status("U1", "corp_U1", False)
+        self.assertEqual(marzban.users["corp_U1"]["status"], "disabled")
+        self.assertFalse(self.stubs["b"].users["corp_U1"]["enable"])
+
+    async def test_single_replica_is_never_a_marzban_node(self):
+        marzban = StubMarzban(online=0)
+        self.fleet = Fleet([*self.fleet.nodes.values(), self.marzban_node(marzban)], self.db, self.renderer,
+                           replicas=1)
+        _, nodes = await self.grant("U1")
+        self.assertEqual(nodes, ["b"])
+        self.assertEqual(len(await self.fleet.hy2_urls(await self.db.get_user("U1"))), 1)
+
+        self.fleet.nodes["b"].placement = False
+        self.fleet.nodes["c"].placement = False
+        self.fleet.nodes["a"].placement = False
+        with self.assertRaises(RuntimeError):
+            await self.fleet.provision("corp_U2")
+
+    async def test_rebalance_keeps_users_on_their_node_kind(self):
+        marzban = StubMarzban(online=0)
+        node = self.stubs["a"]
+        self.fleet = Fleet([self.fleet.nodes["a"], self.marzban_node(marzban)], self.db, self.renderer,
+                           replicas=1, load_ttl=3600)
+        self.fleet.nodes["a"].traffic_url = ""
+        for i in range(4):
+            await self.db.add_user(f"H{i}", f"corp_H{i}", "sub", "", f"k{i}")
+            node.users[f"corp_H{i}"] = {"username": f"corp_H{i}", "auth_key": f"k{i}", "enable": True}
+        await self.db.assign_default_node("a")
+
+        report = await self.fleet.rebalance(dry_run=False, threshold=0.25)
+        self.assertEqual(report["moves"], [])
+        self.assertEqual(marzban.users, {})
+
+    def test_parse_nodes(self):
+        self.assertEqual(parse_nodes(""), [])
+        nodes = parse_nodes('[{"name": "a", "api_url": "http://a/api", "host": "a"}]')
+        self.assertEqual(nodes[0]["name"], "a")
+        with self.assertRaises(ValueError):
+            parse_nodes('[{"name": "a", "api_url": "http://a/api", "host": "a"},'
+                        ' {"name": "a", "api_url": "http://b/api", "host": "b"}]')
+        with self.assertRaises(ValueError):
+            parse_nodes('[{"name": "m", "kind": "marzban", "api_url": "http://m", "host": "m"}]')
+        with self.assertRaises(ValueError):
+            parse_nodes('[{"name": "x", "kind": "wireguard", "api_url": "http://x", "host": "x"}]')
+
+
+    def test_node_backend_missing_an_operation_fails_when_built(self):
+        class HalfNode(FleetNode):
+            kind = "half"
+
+            async def get_user(self, username):
+                return None
+
+            async def create_user(self, username, auth_key=None):
+                return {}
+
+        with self.assertRaisesRegex(TypeError, "delete_user.*set_status|set_status.*delete_user"):
+            HalfNode("h", "h.example.com")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+
+import httpx
+
+from blitz_client import BlitzClient
+from circuit_breaker import CircuitBreaker
+from http_pool import HttpPool, http2_available
+
+
+class TestHttpPool(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.seen = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            self.seen.append(request)
+            if request.url.path.endswith("/users/missing"):
+                return httpx.Response(404, json={"detail": "not found"})
+            if request.method == "POST":
+                return httpx.Response(200, json={"username": "created"})
+            return httpx.Response(200, json={"username": request.url.path.rsplit("/", 1)[-1]})
+
+        self.pool = HttpPool("test", transport=httpx.MockTransport(handler))
+        self.blitz = BlitzClient("http://blitz:8000/api", "token", http=self.pool,
+                                 lookup_timeout=2.0, mutate_timeout=7.0, breaker=CircuitBreaker("test"))
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+
+    async def test_requests_share_one_client(self):
+        await self.blitz.get_user("alice")
+        client = self.pool._client
+        await self.blitz.get_user("bob")
+        self.assertIs(self.pool._client, client)
+        stats = self.pool.stats()
+        self.assertEqual(stats["requests"], 2)
+        self.assertEqual(stats["in_flight"], 0)
+
+    async def test_per_operation_timeouts(self):
+        await self.blitz.get_user("alice")
+        await self.blitz.create_user("carol")
+        self.assertEqual(self.seen[0].extensions["timeout"]["read"], 2.0)
+        self.assertEqual(self.seen[1].extensions["timeout"]["read"], 7.0)
+        self.assertEqual(self.seen[1].extensions["timeout"]["connect"], self.pool.connect_timeout)
+
+    async def test_missing_user_is_none(self):
+        self.assertIsNone(await self.blitz.get_user("missing"))
+        self.assertEqual(self.pool.stats()["errors"], 0)
+
+    async def test_closed_pool_does_not_reopen(self):
+        await self.blitz.get_user("alice")
+        await self.pool.close()
+        with self.assertRaises(RuntimeError):
+            await self.blitz.get_user("bob")
+
+    async def test_http2_falls_back_without_h2(self):
+        pool = HttpPool("h2", http2=True)
+        with mock.patch("http_pool.http2_available", return_value=False), \
+                self.assertLogs("http_pool", "WARNING") as logs:
+            await pool.open()
+        try:
+            self.assertIn("h2 package is missing", logs.output[0])
+            self.assertFalse(pool.stats()["http2_active"])
+            self.assertFalse(pool._client._transport._pool._http2)
+        finally:
+            await pool.close()
+
+    @unittest.skipUnless(http2_available(), "h2 is not installed")
+    async def test_http2_is_negotiated_with_h2(self):
+        pool = HttpPool("h2", http2=True)
+        await pool.open()
+        try:
+            self.assertTrue(pool.stats()["http2_active"])
+            self.assertTrue(pool._client._transport._pool._http2)
+        finally:
+            await pool.close()
+        self.assertFalse(pool.stats()["http2_active"])
+
+
+if __name__ == "__main__":
+    unittest.main()
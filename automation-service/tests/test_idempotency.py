@@ -0,0 +1,120 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from database import Database
+from idempotency import IdempotencyConflict, IdempotencyStore, SingleFlight
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_one_flight(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def work(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return f"user-{key}"
+
+        results = await asyncio.gather(*(flights.run(k, lambda k=k: work(k)) for k in ["a"] * 5 + ["b"] * 2))
+        self.assertEqual(results, ["user-a"] * 5 + ["user-b"] * 2)
+        self.assertEqual(sorted(calls), ["a", "b"])
+        self.assertEqual(flights.stats(), {"started": 2, "joined": 5, "in_flight": 0})
+
+        # A finished flight is not reused
+        await flights.run("a", lambda: work("a"))
+        self.assertEqual(calls.count("a"), 2)
+
+    async def test_failure_reaches_every_caller(self):
+        flights = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("panel down")
+
+        results = await asyncio.gather(*(flights.run("a", fail) for _ in range(3)), return_exceptions=True)
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+        self.assertIsNone(flights.running("a"))
+
+    async def test_cancelled_caller_does_not_cancel_the_flight(self):
+        flights = SingleFlight()
+        done = asyncio.Event()
+
+        async def work():
+            await asyncio.sleep(0.02)
+            done.set()
+            return "ok"
+
+        first = asyncio.ensure_future(flights.run("a", work))
+        second = asyncio.ensure_future(flights.run("a", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertEqual(await second, "ok")
+        self.assertTrue(done.is_set())
+
+    async def test_begin_lets_the_caller_resolve(self):
+        flights = SingleFlight()
+        held = flights.begin("a")
+        self.assertIsNone(flights.begin("a"))
+        waiter = asyncio.ensure_future(flights.run("a", lambda: self.fail("must join, not start")))
+        await asyncio.sleep(0)
+        held.set_result("from batch")
+        self.assertEqual(await waiter, "from batch")
+        self.assertIsNone(flights.running("a"))
+
+
+class TestIdempotencyStore(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmpdir.name, "users.db"))
+        await self.db.init_db()
+        self.store = IdempotencyStore(self.db, "access/grant", ttl_seconds=60)
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.tmpdir.cleanup()
+
+    async def test_replays_stored_response(self):
+        request = {"corporate_id": "A1", "include_qr": True}
+        self.assertIsNone(await self.store.get("key-1", request))
+        await self.store.save("key-1", request, 200, {"username": "corp_A1"})
+
+        stored = await self.store.get("key-1", dict(reversed(list(request.items()))))
+        self.assertEqual((stored.status_code, stored.body), (200, {"username": "corp_A1"}))
+        # First response wins
+        await self.store.save("key-1", request, 200, {"username": "other"})
+        self.assertEqual((await self.store.get("key-1", request)).body, {"username": "corp_A1"})
+        self.assertEqual(self.store.stats()["stored"], 1)
+
+    async def test_key_reused_with_other_request_conflicts(self):
+        await self.store.save("key-1", {"corporate_id": "A1"}, 200, {})
+        with self.assertRaises(IdempotencyConflict):
+            await self.store.get("key-1", {"corporate_id": "B2"})
+        # Keys are scoped
+        other = IdempotencyStore(self.db, "other", ttl_seconds=60)
+        self.assertIsNone(await other.get("key-1", {"corporate_id": "B2"}))
+
+    async def test_expired_keys_are_ignored_and_purged(self):
+        expired = IdempotencyStore(self.db, "access/grant", ttl_seconds=-1)
+        await expired.save("old", {"corporate_id": "A1"}, 200, {"n": 1})
+        self.assertIsNone(await self.store.get("old", {"corporate_id": "A1"}))
+
+        # The expired key can be used again, and saving purges expired rows
+        await self.store.save("old", {"corporate_id": "B2"}, 200, {"n": 2})
+        self.assertEqual((await self.store.get("old", {"corporate_id": "B2"})).body, {"n": 2})
+        await expired.save("older", {}, 200, {})
+        await self.store.save("new", {}, 200, {})
+        async with self.db.pool.read() as conn:
+            async with conn.execute("SELECT idempotency_key FROM idempotency_keys ORDER BY 1") as cursor:
+                self.assertEqual([row[0] for row in await cursor.fetchall()], ["new", "old"])
+
+    def test_key_validation(self):
+        IdempotencyStore.validate_key("5f0c-retry")
+        for key in ("", "x" * 256, "bad\nkey"):
+            with self.assertRaises(ValueError):
+                IdempotencyStore.validate_key(key)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+from database import Database
+from importer import run_import
+
+
+async def lines_of(text):
+    for line in text.splitlines():
+        yield line
+
+
+class TestImporter(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmpdir.name, "users.db"))
+        await self.db.init_db()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.tmpdir.cleanup()
+
+    async def test_import_ids_reports_bad_rows(self):
+        body = "id,owner,status\n" + "\n".join(f"AB{i:06d},owner {i},issued" for i in range(250))
+        body += "\nbad-id,nobody,issued\nCD000001,someone,unknown\nCD000002,x"
+        report = await run_import(self.db, "ids", lines_of(body), "csv", chunk_size=100)
+        self.assertEqual(report["rows"], 253)
+        self.assertEqual(report["imported"], 250)
+        self.assertEqual(report["failed"], 3)
+        self.assertEqual((await self.db.get_id("AB000249"))["owner"], "owner 249")
+
+        # Re-importing upserts instead of failing on the primary key
+        report = await run_import(self.db, "ids", lines_of("id,owner,status\nAB000001,new owner,active"))
+        self.assertEqual(report["imported"], 1)
+        rec = await self.db.get_id("AB000001")
+        self.assertEqual((rec["owner"], rec["status"]), ("new owner", "active"))
+
+    async def test_import_users_isolates_constraint_errors(self):
+        body = "\n".join([
+            '{"corporate_id": "C1", "telegram_id": "100"}',
+            '{"corporate_id": "C2", "telegram_id": "100"}',
+            '{"corporate_id": "C3"}',
+            'not json',
+        ])
+        report = await run_import(self.db, "users", lines_of(body), "ndjson")
+        self.assertEqual(report["imported"], 2)
+        self.assertEqual([e["line"] for e in report["errors"]], [2, 4])
+        self.assertEqual((await self.db.get_user("C3"))["blitz_username"], "corp_C3")
+
+    async def test_reimport_without_is_active_keeps_offboarded_users_inactive(self):
+        await run_import(self.db, "users", lines_of("corporate_id,is_active\nC1,1\nC2,1"))
+        await self.db.deactivate_user("C1")
+
+        report = await run_import(self.db, "users", lines_of("corporate_id,telegram_id\nC1,100\nC2,200\nC3,300"))
+        self.assertEqual(report["imported"], 3)
+        self.assertFalse((await self.db.get_user("C1"))["is_active"])
+        self.assertEqual((await self.db.get_user("C1"))["telegram_id"], "100")
+        self.assertTrue((await self.db.get_user("C2"))["is_active"])
+        # New users still start active
+        self.assertTrue((await self.db.get_user("C3"))["is_active"])
+
+        # An explicit column still switches users either way
+        await run_import(self.db, "users", lines_of("corporate_id,is_active\nC1,true\nC2,0"))
+        self.assertTrue((await self.db.get_user("C1"))["is_active"])
+        self.assertFalse((await self.db.get_user("C2"))["is_active"])
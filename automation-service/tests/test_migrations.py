@@ -0,0 +1,151 @@
+import os
+import tempfile
+import unittest
+
+from database import TRAFFIC_DAILY_SQL, TRAFFIC_HOURLY_SQL, Database, purge_sql, search_ids_sql
+from db_pool import ConnectionPool
+from migrations import MIGRATIONS, TELEMETRY_MIGRATIONS, apply_migrations
+from retention import default_policies
+
+
+class TestMigrations(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmpdir.name, "users.db"))
+        await self.db.init_db()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.tmpdir.cleanup()
+
+    async def query_plan(self, sql, params=(), pool=None):
+        async with (pool or self.db.pool).read() as conn:
+            async with conn.execute("EXPLAIN QUERY PLAN " + sql, params) as cursor:
+                rows = await cursor.fetchall()
+        return " | ".join(row[3] for row in rows)
+
+    async def test_schema_version_recorded(self):
+        async with self.db.pool.read() as conn:
+            async with conn.execute("SELECT MAX(version) FROM main.schema_version") as cursor:
+                version = (await cursor.fetchone())[0]
+        self.assertEqual(version, max(m.version for m in MIGRATIONS))
+        async with self.db.telemetry_pool.read() as conn:
+            async with conn.execute("SELECT MAX(version) FROM main.schema_version") as cursor:
+                version = (await cursor.fetchone())[0]
+        self.assertEqual(version, max(m.version for m in TELEMETRY_MIGRATIONS))
+
+    async def test_migrations_are_idempotent(self):
+        applied = await apply_migrations(self.db.pool, MIGRATIONS)
+        self.assertEqual(applied, [])
+        applied = await apply_migrations(self.db.telemetry_pool, TELEMETRY_MIGRATIONS)
+        self.assertEqual(applied, [])
+
+    async def test_telemetry_tables_live_in_their_own_file(self):
+        async with self.db.pool.read() as conn:
+            async with conn.execute("SELECT name FROM main.sqlite_master WHERE type = 'table'") as cursor:
+                hot = {row[0] for row in await cursor.fetchall()}
+        async with self.db.telemetry_pool.read() as conn:
+            async with conn.execute("SELECT name FROM main.sqlite_master WHERE type = 'table'") as cursor:
+                telemetry = {row[0] for row in await cursor.fetchall()}
+        self.assertIn("users", hot)
+        self.assertIn("id_registry", hot)
+        self.assertNotIn("auth_logs", hot)
+        self.assertNotIn("traffic_stats", hot)
+        self.assertIn("auth_logs", telemetry)
+        self.assertIn("traffic_daily", telemetry)
+        self.assertNotIn("users", telemetry)
+
+    async def test_legacy_single_file_is_split(self):
+        legacy_path = os.path.join(self.tmpdir.name, "legacy.db")
+        pool = ConnectionPool(legacy_path, readers=1)
+        await apply_migrations(pool, MIGRATIONS[:6])
+        async with pool.write() as conn:
+            await conn.execute("INSERT INTO users (corporate_id, blitz_username) VALUES ('C1', 'u1')")
+            await conn.executemany(
+                "INSERT INTO traffic_stats (corporate_id, username, upload_bytes, download_bytes) "
+                "VALUES ('C1', 'u1', ?, ?)",
+                [(10, 20), (30, 40)],
+            )
+            await conn.execute("INSERT INTO auth_logs (corporate_id, action) VALUES ('C1', 'login')")
+            await conn.execute("INSERT INTO webhook_events (event_type, corporate_id) VALUES ('x', 'C1')")
+        await pool.close()
+
+        legacy = Database(legacy_path)
+        try:
+            await legacy.init_db()
+            self.assertIsNotNone(await legacy.get_user("C1"))
+            summary = await legacy.get_user_traffic_summary("C1")
+            self.assertEqual((summary["upload"], summary["download"]), (40, 60))
+            self.assertEqual(len(await legacy.get_user_auth_logs("C1")), 1)
+            self.assertEqual(len(await legacy.get_pending_webhook_events()), 1)
+            async with legacy.pool.read() as conn:
+                async with conn.execute("SELECT COUNT(*) FROM main.sqlite_master WHERE name = 'auth_logs'") as cursor:
+                    self.assertEqual((await cursor.fetchone())[0], 0)
+        finally:
+            await legacy.close()
+
+    async def test_auth_logs_plan(self):
+        plan = await self.query_plan(
+            "SELECT * FROM auth_logs WHERE corporate_id = ? ORDER BY created_at DESC LIMIT ?",
+            ("C1", 10),
+            pool=self.db.telemetry_pool,
+        )
+        self.assertIn("idx_auth_logs_corporate_created", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    async def test_traffic_rollup_plans(self):
+        for sql, table in ((TRAFFIC_DAILY_SQL, "traffic_daily"), (TRAFFIC_HOURLY_SQL, "traffic_hourly")):
+            plan = await self.query_plan(sql, ("C1", 30), pool=self.db.telemetry_pool)
+            self.assertIn(f"SEARCH {table} USING PRIMARY KEY", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    async def test_pending_webhook_events_plan(self):
+        plan = await self.query_plan(
+            "SELECT * FROM webhook_events WHERE processed = 0 ORDER BY created_at ASC",
+            pool=self.db.telemetry_pool,
+        )
+        self.assertIn("idx_webhook_events_pending", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    async def test_retention_purge_plans(self):
+        indexes = {
+            "auth_logs": "idx_auth_logs_created_at",
+            "monitor_events": "idx_monitor_events_created_at",
+            "traffic_stats": "idx_traffic_stats_timestamp",
+            "traffic_hourly": "idx_traffic_hourly_hour",
+            "webhook_events": "idx_webhook_events_processed",
+        }
+        for policy in default_policies(30, 30, 30, 30, 30):
+            plan = await self.query_plan(
+                purge_sql(policy.table, policy.time_column, policy.extra_where, policy.key),
+                ("-30 days", 500),
+                pool=self.db.telemetry_pool,
+            )
+            self.assertIn(indexes[policy.table], plan)
+            self.assertNotIn(f"SCAN {policy.table}", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    async def test_user_by_telegram_id_plan(self):
+        plan = await self.query_plan("SELECT * FROM users WHERE telegram_id = ?", ("42",))
+        self.assertIn("USING INDEX", plan)
+        self.assertNotIn("SCAN users", plan)
+
+    async def test_search_ids_fts_plan(self):
+        for after in (None, [2, -1.5, 10]):
+            sql, params = search_ids_sql("petr", after)
+            plan = await self.query_plan(sql, params + [21])
+            self.assertIn("VIRTUAL TABLE INDEX", plan)
+            self.assertNotIn("SCAN r", plan)
+
+    async def test_search_ids_prefix_plan(self):
+        sql, params = search_ids_sql("PE")
+        plan = await self.query_plan(sql, params + [21])
+        self.assertIn("SEARCH id_registry USING INDEX", plan)
+        self.assertNotIn("SCAN id_registry", plan)
+
+    async def test_search_ids_status_plan(self):
+        for after in (None, [0, "2024-01-01 00:00:00", 10]):
+            sql, params = search_ids_sql("issued", after)
+            plan = await self.query_plan(sql, params + [21])
+            self.assertIn("idx_id_registry_status_issued", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
@@ -0,0 +1,152 @@
+import asyncio
+import base64
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+import qr_service
+from qr_service import QRService, render_qr
+
+URL = "hy2://key@vpn.example.com:443/?sni=dl.google.com&insecure=0#CorporateVPN_corp_1"
+
+
+class TestQRService(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.services = []
+
+    async def asyncTearDown(self):
+        for service in self.services:
+            service.close()
+        self.tmpdir.cleanup()
+
+    def disk_path(self, service, payload, fmt="png"):
+        key = service.key(payload, fmt)
+        return os.path.join(self.tmpdir.name, key[:2], f"{key}.{fmt}")
+
+    def service(self, **kwargs):
+        service = QRService(**kwargs)
+        self.services.append(service)
+        return service
+
+    async def test_renders_valid_png_and_caches_it(self):
+        service = self.service()
+        png = await service.png(URL)
+        self.assertEqual(png, render_qr(URL))
+        self.assertEqual(Image.open(io.BytesIO(png)).format, "PNG")
+
+        self.assertIs(await service.png(URL), png)
+        self.assertEqual(base64.b64decode(await service.png_base64(URL)), png)
+        stats = service.stats()
+        self.assertEqual((stats["misses"], stats["hits"], stats["renders"]), (1, 2, 1))
+
+    async def test_key_covers_payload_and_options(self):
+        small = self.service(box_size=4)
+        large = self.service(box_size=10)
+        self.assertNotEqual(small.key(URL), large.key(URL))
+        self.assertNotEqual(large.key(URL, "png"), large.key(URL, "svg"))
+        self.assertNotEqual(large.key(URL), large.key(URL + "x"))
+        self.assertEqual(large.key(URL), self.service().key(URL))
+
+    async def test_renders_off_the_event_loop(self):
+        loop_thread = threading.get_ident()
+        threads = []
+
+        def render(payload, fmt, box_size, border):
+            threads.append(threading.get_ident())
+            return b"png"
+
+        with mock.patch.object(qr_service, "render_qr", render):
+            self.assertEqual(await self.service().png(URL), b"png")
+        self.assertNotEqual(threads, [loop_thread])
+
+    async def test_concurrent_misses_share_one_render(self):
+        service = self.service()
+        results = await asyncio.gather(*(service.png(URL) for _ in range(10)))
+        self.assertEqual(len(set(results)), 1)
+        stats = service.stats()
+        self.assertEqual((stats["renders"], stats["coalesced"]), (1, 9))
+
+    async def test_lru_is_bounded(self):
+        service = self.service(cache_size=2)
+        for i in range(3):
+            await service.png(f"{URL}{i}")
+        await service.png(f"{URL}0")
+        stats = service.stats()
+        self.assertEqual((stats["size"], stats["renders"]), (2, 4))
+
+    async def test_disk_cache_survives_restarts(self):
+        first = self.service(cache_dir=self.tmpdir.name)
+        png = await first.png(URL)
+        key = first.key(URL)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, key[:2], f"{key}.png")))
+
+        second = self.service(cache_dir=self.tmpdir.name)
+        self.assertEqual(await second.png(URL), png)
+        stats = second.stats()
+        self.assertEqual((stats["disk_hits"], stats["renders"]), (1, 0))
+
+    async def test_forget_drops_memory_and_disk_entries(self):
+        service = self.service(cache_dir=self.tmpdir.name)
+        await service.png(URL)
+        await service.render(URL, "svg")
+        self.assertEqual(await service.forget(URL), 2)
+        self.assertEqual(service.stats()["size"], 0)
+        for fmt in ("png", "svg"):
+            self.assertFalse(os.path.exists(self.disk_path(service, URL, fmt)))
+        self.assertEqual(await service.forget(URL), 0)
+
+    async def test_prune_applies_age_then_size_limits(self):
+        service = self.service(cache_dir=self.tmpdir.name, max_age_seconds=3600)
+        for i in range(4):
+            await service.png(f"{URL}{i}")
+        paths = {i: self.disk_path(service, f"{URL}{i}") for i in range(4)}
+        old = time.time() - 7200
+        os.utime(paths[0], (old, old))
+        for i in (1, 2, 3):
+            os.utime(paths[i], (old + 3600 + i * 60,) * 2)
+        size = os.path.getsize(paths[3])
+
+        deleted = await service.prune()
+        self.assertEqual(deleted["files"], 1)
+        self.assertFalse(os.path.exists(paths[0]))
+
+        # Over the size limit the oldest files go first
+        service.max_bytes = size * 2 + os.path.getsize(paths[2]) // 2
+        self.assertEqual((await service.prune())["files"], 1)
+        self.assertEqual([os.path.exists(paths[i]) for i in (1, 2, 3)], [False, True, True])
+        self.assertEqual(service.stats()["pruned"], 2)
+
+    async def test_unwritable_disk_cache_still_serves(self):
+        blocked = os.path.join(self.tmpdir.name, "file")
+        open(blocked, "w").close()
+        service = self.service(cache_dir=blocked)
+        self.assertEqual(await service.png(URL), render_qr(URL))
+        self.assertEqual(service.stats()["disk_errors"], 2)
+
+    async def test_process_pool(self):
+        service = self.service(executor="process", workers=1)
+        self.assertEqual(await service.png(URL), render_qr(URL))
+
+    async def test_svg(self):
+        service = self.service()
+        svg = await service.render(URL, "svg")
+        self.assertTrue(svg.lstrip().startswith(b"<?xml"))
+        self.assertIn(b"<svg", svg)
+        self.assertNotEqual(await service.png(URL), svg)
+        with self.assertRaises(ValueError):
+            await service.render(URL, "gif")
+
+    def test_unknown_executor(self):
+        with self.assertRaises(ValueError):
+            QRService(executor="gpu")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import asyncio
+import time
+import unittest
+
+import httpx
+
+from blitz_client import BlitzClient
+from circuit_breaker import CircuitBreaker
+from http_pool import HttpPool
+from rate_limiter import (
+    PRIORITY_DEACTIVATE, PRIORITY_GRANT, PRIORITY_READ, RateLimitedError, RateLimiter,
+)
+
+
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+    async def test_disabled_limiter_never_waits(self):
+        limiter = RateLimiter("test", rate=0, burst=1)
+        for _ in range(100):
+            await limiter.acquire(PRIORITY_READ)
+        self.assertEqual(limiter.stats()["priorities"]["read"]["acquired"], 0)
+
+    async def test_burst_then_paced(self):
+        limiter = RateLimiter("test", rate=100, burst=3)
+        started = time.monotonic()
+        for _ in range(3):
+            await limiter.acquire()
+        self.assertLess(time.monotonic() - started, 0.01)
+        for _ in range(5):
+            await limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.045)
+        stats = limiter.stats()["priorities"]["grant"]
+        self.assertEqual((stats["acquired"], stats["queued"]), (8, 5))
+        self.assertGreater(stats["max_wait_ms"], 0)
+
+    async def test_deactivations_jump_the_queue(self):
+        limiter = RateLimiter("test", rate=50, burst=1)
+        await limiter.acquire()
+        order = []
+
+        async def call(priority, label):
+            await limiter.acquire(priority)
+            order.append(label)
+
+        tasks = [asyncio.ensure_future(call(PRIORITY_READ, f"read{i}")) for i in range(2)]
+        tasks += [asyncio.ensure_future(call(PRIORITY_GRANT, f"grant{i}")) for i in range(2)]
+        await asyncio.sleep(0)
+        self.assertEqual(limiter.queue_depth(), {"deactivate": 0, "grant": 2, "read": 2})
+        tasks.append(asyncio.ensure_future(call(PRIORITY_DEACTIVATE, "deactivate")))
+        await asyncio.gather(*tasks)
+        self.assertEqual(order, ["deactivate", "grant0", "grant1", "read0", "read1"])
+
+    async def test_full_queue_rejects_all_but_deactivations(self):
+        limiter = RateLimiter("test", rate=10, burst=1, max_queue=1)
+        await limiter.acquire()
+        waiting = asyncio.ensure_future(limiter.acquire(PRIORITY_READ))
+        await asyncio.sleep(0)
+        with self.assertRaises(RateLimitedError):
+            await limiter.acquire(PRIORITY_GRANT)
+        deactivation = asyncio.ensure_future(limiter.acquire(PRIORITY_DEACTIVATE))
+        await asyncio.gather(waiting, deactivation)
+        stats = limiter.stats()["priorities"]
+        self.assertEqual((stats["grant"]["rejected"], stats["deactivate"]["acquired"]), (1, 1))
+
+    async def test_cancelled_waiter_does_not_use_a_token(self):
+        limiter = RateLimiter("test", rate=20, burst=1)
+        await limiter.acquire()
+        gone = asyncio.ensure_future(limiter.acquire())
+        kept = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        gone.cancel()
+        started = time.monotonic()
+        await kept
+        # One refill interval, not two
+        self.assertLess(time.monotonic() - started, 0.09)
+        self.assertEqual(limiter.stats()["queue_depth"]["grant"], 0)
+
+
+class TestBlitzClientPriorities(unittest.IsolatedAsyncioTestCase):
+    def test_priority_by_operation(self):
+        priority = BlitzClient._priority
+        self.assertEqual(priority("PUT", "/users/u/status", {"enable": False}), PRIORITY_DEACTIVATE)
+        self.assertEqual(priority("POST", "/users/bulk/status", {"usernames": ["u"], "enable": False}),
+                         PRIORITY_DEACTIVATE)
+        self.assertEqual(priority("DELETE", "/users/u", None), PRIORITY_DEACTIVATE)
+        self.assertEqual(priority("PUT", "/users/u/status", {"enable": True}), PRIORITY_GRANT)
+        self.assertEqual(priority("POST", "/users", {"username": "u"}), PRIORITY_GRANT)
+        self.assertEqual(priority("GET", "/users/u", None), PRIORITY_GRANT)
+        self.assertEqual(priority("GET", "/users/u/stats", None), PRIORITY_READ)
+        self.assertEqual(priority("GET", "/users?offset=0&limit=500", None), PRIORITY_READ)
+
+    async def test_requests_go_out_in_priority_order(self):
+        sent = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            sent.append((request.method, request.url.path))
+            return httpx.Response(200, json={"upload_bytes": 0, "download_bytes": 0})
+
+        http = HttpPool("test", transport=httpx.MockTransport(handler))
+        limiter = RateLimiter("test", rate=100, burst=1)
+        blitz = BlitzClient("http://blitz:8000/api", "token", http=http, breaker=CircuitBreaker("test"),
+                            cache_ttl=0, limiter=limiter)
+        try:
+            await limiter.acquire()
+            stats = [asyncio.ensure_future(blitz.get_user_stats(f"s{i}")) for i in range(3)]
+            await asyncio.sleep(0)
+            await asyncio.gather(blitz.update_user_status("victim", False), *stats)
+        finally:
+            await http.close()
+        self.assertEqual(sent[0], ("PUT", "/api/users/victim/status"))
+        self.assertEqual(limiter.stats()["priorities"]["read"]["acquired"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import json
+import os
+import tempfile
+import unittest
+
+import httpx
+
+from blitz_client import BlitzClient
+from circuit_breaker import CircuitBreaker
+from database import Database
+from http_pool import HttpPool
+from reconcile import (
+    ADOPT_LOCAL, DEACTIVATE_LOCAL, DISABLE_REMOTE, RESTORE_REMOTE, UPDATE_LOCAL_KEY, ReconciliationEngine,
+)
+
+
+class TestReconciliation(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.panel = {}
+        # Replaces the listing payload when set
+        self.listing = None
+        self.calls = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            self.calls.append((request.method, request.url.path))
+            path = request.url.path
+            if request.method == "GET" and path == "/api/users" and self.listing is not None:
+                return httpx.Response(200, json=self.listing)
+            if request.method == "GET" and path == "/api/users":
+                offset = int(request.url.params["offset"])
+                limit = int(request.url.params["limit"])
+                return httpx.Response(200, json=sorted(self.panel.values(), key=lambda u: u["username"])[offset:offset + limit])
+            if request.method == "POST" and path == "/api/users":
+                body = json.loads(request.content)
+                self.panel[body["username"]] = body
+                return httpx.Response(200, json={"username": body["username"]})
+            if request.method == "PUT" and path.endswith("/status"):
+                self.panel[path.split("/")[3]]["enable"] = json.loads(request.content)["enable"]
+                return httpx.Response(200, json={})
+            return httpx.Response(404, json={"detail": "not found"})
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmpdir.name, "users.db"))
+        await self.db.init_db()
+        self.http = HttpPool("test", transport=httpx.MockTransport(handler))
+        self.blitz = BlitzClient("http://blitz:8000/api", "token", http=self.http,
+                                 breaker=CircuitBreaker("test"), cache_ttl=0, retry_base_delay=0)
+        self.engine = ReconciliationEngine(self.db, self.blitz, page_size=2, concurrency=4)
+
+    async def asyncTearDown(self):
+        await self.http.close()
+        await self.db.close()
+        self.tmpdir.cleanup()
+
+    def remote(self, username, auth_key, enable=True):
+        self.panel[username] = {"username": username, "auth_key": auth_key, "enable": enable}
+
+    async def local(self, corporate_id, auth_key, active=True):
+        await self.db.add_user(corporate_id, f"corp_{corporate_id}", "sub", "hy2", auth_key)
+        if not active:
+            await self.db.deactivate_user(corporate_id)
+
+    async def seed_drift(self):
+        for i in range(5):
+            await self.local(f"OK{i}", f"k{i}")
+            self.remote(f"corp_OK{i}", f"k{i}")
+        # Deactivated in the panel, SQLite write failed
+        await self.local("HALF", "kh")
+        self.remote("corp_HALF", "kh", enable=False)
+        # Deactivated locally, panel call failed
+        await self.local("GONE", "kg", active=False)
+        self.remote("corp_GONE", "kg")
+        # Created in the panel, add_user never ran
+        self.remote("corp_ORPHAN", "ko")
+        # Local row overwritten with a stale key
+        await self.local("KEY", "stale")
+        self.remote("corp_KEY", "fresh")
+        # Panel lost the user
+        await self.local("LOST", "kl")
+        # Not ours
+        self.remote("admin", "x")
+
+    async def test_dry_run_reports_plan_without_writes(self):
+        await self.seed_drift()
+        report = await self.engine.run_once(dry_run=True)
+        self.assertEqual(report["drift"], {DEACTIVATE_LOCAL: 1, DISABLE_REMOTE: 1, ADOPT_LOCAL: 1,
+                                           UPDATE_LOCAL_KEY: 1, RESTORE_REMOTE: 1})
+        self.assertEqual((report["local_users"], report["remote_users"], report["in_sync"]), (9, 10, 5))
+        self.assertEqual(report["applied"], 0)
+        self.assertEqual({m for m, _ in self.calls}, {"GET"})
+        self.assertIsNone(await self.db.get_user("ORPHAN"))
+        self.assertTrue((await self.db.get_user("HALF"))["is_active"])
+
+    async def test_apply_repairs_drift(self):
+        await self.seed_drift()
+        report = await self.engine.run_once(dry_run=False)
+        self.assertEqual((report["applied"], report["failed"]), (5, 0))
+
+        self.assertFalse((await self.db.get_user("HALF"))["is_active"])
+        self.assertFalse(self.panel["corp_GONE"]["enable"])
+        orphan = await self.db.get_user("ORPHAN")
+        self.assertEqual((orphan["hy2_auth_key"], orphan["is_active"]), ("ko", 1))
+        self.assertIn("ko@", orphan["hy2_url"])
+        key = await self.db.get_user("KEY")
+        self.assertEqual((key["hy2_auth_key"], key["subscription_url"]), ("fresh", "sub"))
+        self.assertEqual(self.panel["corp_LOST"]["auth_key"], "kl")
+
+        # The next pass finds nothing to do
+        report = await self.engine.run_once(dry_run=False)
+        self.assertEqual(report["drift"], {})
+        self.assertEqual(report["in_sync"], 10)
+
+    async def test_revoked_users_reach_the_hook(self):
+        await self.seed_drift()
+        revoked = []
+
+        async def on_revoked(user):
+            revoked.append((user["corporate_id"], user["hy2_auth_key"]))
+
+        self.engine.on_revoked = on_revoked
+        await self.engine.run_once(dry_run=False)
+        # The rows as they were: the stale key and the user deactivated in the panel
+        self.assertEqual(sorted(revoked), [("HALF", "kh"), ("KEY", "stale")])
+
+    async def test_key_update_keeps_inactive_user_inactive(self):
+        await self.local("X", "old", active=False)
+        self.remote("corp_X", "new")
+        report = await self.engine.run_once()
+        self.assertEqual(report["drift"], {DISABLE_REMOTE: 1, UPDATE_LOCAL_KEY: 1})
+        user = await self.db.get_user("X")
+        self.assertEqual((user["hy2_auth_key"], user["is_active"]), ("new", 0))
+
+    async def test_failed_listing_plans_nothing(self):
+        await self.local("LOST", "kl")
+        self.engine.blitz.base_url = "http://blitz:8000/missing"
+        with self.assertRaises(httpx.HTTPStatusError):
+            await self.engine.run_once(dry_run=False)
+        self.assertEqual([m for m, _ in self.calls], ["GET"])
+
+    async def test_unrecognised_listing_raises(self):
+        await self.local("LOST", "kl")
+        self.listing = {"detail": "maintenance"}
+        with self.assertRaises(ValueError):
+            await self.engine.run_once(dry_run=False)
+        self.assertEqual([m for m, _ in self.calls], ["GET"])
+
+    async def test_mass_restore_is_refused_unless_forced(self):
+        for i in range(4):
+            await self.local(f"U{i}", f"k{i}")
+        # An empty panel: a bad listing, not four lost users
+        report = await self.engine.run_once(dry_run=False)
+        self.assertEqual(report["drift"], {RESTORE_REMOTE: 4})
+        self.assertIn("no users", report["refused"])
+        self.assertEqual((report["applied"], self.panel), (0, {}))
+
+        # Half the users missing is still above the restore limit
+        for i in range(2):
+            self.remote(f"corp_U{i}", f"k{i}")
+        report = await self.engine.run_once(dry_run=False)
+        self.assertIn("2 of 4", report["refused"])
+        self.assertEqual(len(self.panel), 2)
+
+        report = await self.engine.run_once(dry_run=False, force=True)
+        self.assertIsNone(report["refused"])
+        self.assertEqual((report["applied"], len(self.panel)), (2, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
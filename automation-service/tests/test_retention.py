@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+
+from database import Database
+from retention import RetentionEngine, default_policies
+
+
+class TestRetention(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmpdir.name, "users.db"))
+        await self.db.init_db()
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.tmpdir.cleanup()
+
+    async def count(self, table):
+        async with self.db.telemetry_pool.read() as conn:
+            async with conn.execute(f"SELECT COUNT(*) FROM {table}") as cursor:
+                return (await cursor.fetchone())[0]
+
+    async def test_purges_expired_rows_in_chunks(self):
+        async with self.db.telemetry_pool.write() as conn:
+            await conn.executemany(
+                "INSERT INTO monitor_events (component, level, message, details, created_at) "
+                "VALUES ('test', 'INFO', 'old', ?, datetime('now', '-40 days'))",
+                [("x" * 500,) for _ in range(1200)],
+            )
+            await conn.executemany(
+                "INSERT INTO webhook_events (event_type, processed, created_at) "
+                "VALUES (?, ?, datetime('now', '-40 days'))",
+                [("old_pending", 0), ("old_processed", 1), ("old_dead_letter", 2)],
+            )
+        await self.db.log_monitor_event("test", "INFO", "fresh", durable=True)
+
+        policies = default_policies(auth_logs_days=0, monitor_events_days=30,
+                                    traffic_stats_days=0, webhook_events_days=30,
+                                    traffic_hourly_days=0)
+        engine = RetentionEngine(self.db, policies, chunk_size=250, chunk_pause=0)
+        report = await engine.run_once()
+
+        self.assertEqual(report["rows_by_table"]["monitor_events"], 1200)
+        self.assertEqual(report["rows_by_table"]["webhook_events"], 2)
+        self.assertGreater(report["bytes_reclaimed"], 0)
+        # Only the fresh event and the retention report itself remain
+        await self.db.flush()
+        self.assertEqual(await self.count("monitor_events"), 2)
+        self.assertEqual(await self.count("webhook_events"), 1)
+
+    async def test_hourly_rollups_outlive_raw_samples(self):
+        async with self.db.telemetry_pool.write() as conn:
+            await conn.executemany(
+                "INSERT INTO traffic_stats (corporate_id, username, upload_bytes, download_bytes, timestamp) "
+                "VALUES ('C1', 'corp_C1', 10, 20, datetime('now', ?))",
+                [("-2 hours",), ("-100 days",), ("-500 days",)],
+            )
+
+        policies = default_policies(auth_logs_days=0, monitor_events_days=0, traffic_stats_days=90,
+                                    webhook_events_days=0, traffic_hourly_days=400)
+        report = await RetentionEngine(self.db, policies, chunk_size=1, chunk_pause=0).run_once()
+
+        self.assertEqual(report["rows_by_table"]["traffic_stats"], 2)
+        self.assertEqual(report["rows_by_table"]["traffic_hourly"], 1)
+        self.assertEqual(await self.count("traffic_stats"), 1)
+        self.assertEqual(await self.count("traffic_hourly"), 2)
+        # Daily rollups are never purged
+        self.assertEqual(await self.count("traffic_daily"), 3)
+
+    async def test_pruners_run_with_the_tables(self):
+        calls = []
+
+        async def prune():
+            calls.append("qr")
+            return {"files": 3, "bytes": 300}
+
+        engine = RetentionEngine(self.db, [], pruners={"qr_cache": prune}, chunk_pause=0)
+        report = await engine.run_once()
+        self.assertEqual(calls, ["qr"])
+        self.assertEqual(report["files_deleted"], {"qr_cache": {"files": 3, "bytes": 300}})
@@ -0,0 +1,170 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from blitz_client import BlitzClient
+from circuit_breaker import CircuitBreaker
+from database import Database
+from http_pool import HttpPool
+from traffic_sync import BLITZ_SOURCE, HYSTERIA_SOURCE, TrafficSyncEngine, compute_deltas
+
+
+class StubPanel:
+    """Hysteria2 trafficStats API and Blitz per-user stats on one local port."""
+
+    def __init__(self):
+        self.traffic = {}
+        self.blitz_stats = {}
+        self.traffic_up = True
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append(self.path)
+                if self.path == "/traffic" and stub.traffic_up:
+                    if self.headers.get("Authorization") != "secret":
+                        return self._send(401, {})
+                    return self._send(200, stub.traffic)
+                if self.path.startswith("/api/users/") and self.path.endswith("/stats"):
+                    username = self.path.split("/")[3]
+                    if username in stub.blitz_stats:
+                        return self._send(200, stub.blitz_stats[username])
+                self._send(404, {"detail": "not found"})
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestComputeDeltas(unittest.TestCase):
+    def test_first_sample_is_baseline_and_reset_counts_new_value(self):
+        deltas, resets = compute_deltas(
+            {"a": (100, 200), "b": (500, 500)},
+            {"a": (150, 260), "b": (20, 30), "c": (999, 999)},
+        )
+        self.assertEqual(deltas, {"a": (50, 60), "b": (20, 30)})
+        self.assertEqual(resets, 1)
+
+
+class TestTrafficSync(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.stub = StubPanel()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmpdir.name, "users.db"))
+        await self.db.init_db()
+        for cid in ("A", "B"):
+            await self.db.add_user(cid, f"corp_{cid}", "sub", "hy2", "key")
+        self.http = HttpPool("test")
+        self.blitz = BlitzClient(f"{self.stub.url}/api", "token", http=self.http,
+                                 breaker=CircuitBreaker("test"), cache_ttl=0, retry_attempts=1)
+        self.engine = TrafficSyncEngine(self.db, self.blitz, traffic_url=self.stub.url,
+                                        traffic_secret="secret", http=self.http)
+
+    async def asyncTearDown(self):
+        await self.http.close()
+        await self.db.close()
+        self.stub.stop()
+        self.tmpdir.cleanup()
+
+    async def test_hysteria_counters_become_deltas(self):
+        self.stub.traffic = {"corp_A": {"tx": 1000, "rx": 5000}, "stranger": {"tx": 1, "rx": 1}}
+        report = await self.engine.run_once()
+        self.assertEqual((report["source"], report["users_seen"], report["users_updated"]),
+                         (HYSTERIA_SOURCE, 1, 0))
+
+        self.stub.traffic = {"corp_A": {"tx": 1500, "rx": 7000}, "corp_B": {"tx": 10, "rx": 20}}
+        report = await self.engine.run_once()
+        self.assertEqual(report["users_updated"], 1)
+        self.assertEqual((report["upload_bytes"], report["download_bytes"]), (500, 2000))
+        user = await self.db.get_user("A")
+        self.assertEqual((user["total_upload"], user["total_download"]), (500, 2000))
+
+        # Server restart: counters start again from zero
+        self.stub.traffic = {"corp_A": {"tx": 40, "rx": 60}, "corp_B": {"tx": 15, "rx": 25}}
+        report = await self.engine.run_once()
+        self.assertEqual(report["counter_resets"], 1)
+        user = await self.db.get_user("A")
+        self.assertEqual((user["total_upload"], user["total_download"]), (540, 2060))
+        summary = await self.db.get_user_traffic_summary("B")
+        self.assertEqual((summary["upload"], summary["download"]), (5, 5))
+        # Exactly one request per run against the traffic API
+        self.assertEqual(self.stub.requests.count("/traffic"), 3)
+
+    async def test_falls_back_to_blitz_stats(self):
+        self.stub.traffic_up = False
+        self.stub.blitz_stats = {"corp_A": {"upload_bytes": 100, "download_bytes": 200}}
+        await self.engine.run_once()
+        self.stub.blitz_stats = {"corp_A": {"upload_bytes": 130, "download_bytes": 260}}
+        report = await self.engine.run_once()
+        self.assertEqual(report["source"], BLITZ_SOURCE)
+        self.assertEqual((report["upload_bytes"], report["download_bytes"]), (30, 60))
+        self.assertIn("/api/users/corp_B/stats", self.stub.requests)
+
+    async def test_blitz_fallback_only_asks_about_users_placed_on_the_node(self):
+        self.stub.traffic_up = False
+        await self.db.add_user("C", "corp_C", "sub", "hy2", "key")
+        await self.db.set_user_nodes("A", ["edge"])
+        await self.db.set_user_nodes("B", ["main"])
+
+        edge = TrafficSyncEngine(self.db, self.blitz, traffic_url=self.stub.url, http=self.http, node="edge")
+        await edge.run_once()
+        asked = {path for path in self.stub.requests if path.startswith("/api/users/")}
+        self.assertEqual(asked, {"/api/users/corp_A/stats"})
+
+        # The default node also covers users not placed anywhere yet
+        self.stub.requests.clear()
+        main = TrafficSyncEngine(self.db, self.blitz, traffic_url=self.stub.url, http=self.http,
+                                 node="main", default_node=True)
+        report = await main.run_once()
+        asked = {path for path in self.stub.requests if path.startswith("/api/users/")}
+        self.assertEqual(asked, {"/api/users/corp_B/stats", "/api/users/corp_C/stats"})
+        self.assertEqual(report["source"], BLITZ_SOURCE)
+
+    async def test_alternating_sources_never_double_count(self):
+        # Both sources see the same cumulative counters; each switch re-baselines
+        totals = []
+        for step, traffic_up in enumerate([True, False, True, False, True, True], start=1):
+            tx, rx = 100 + 10 * step, 1000 + 100 * step
+            self.stub.traffic_up = traffic_up
+            self.stub.traffic = {"corp_A": {"tx": tx, "rx": rx}}
+            self.stub.blitz_stats = {"corp_A": {"upload_bytes": tx, "download_bytes": rx}}
+            report = await self.engine.run_once()
+            self.assertEqual(report["source"], HYSTERIA_SOURCE if traffic_up else BLITZ_SOURCE)
+            user = await self.db.get_user("A")
+            totals.append((user["total_upload"], user["total_download"]))
+        # H, B, H, B book nothing (baseline or switch); the last H after H books one interval
+        self.assertEqual(totals, [(0, 0)] * 5 + [(10, 100)])
+        self.assertEqual(await self.db.get_traffic_counters(BLITZ_SOURCE), {})
+
+    async def test_snapshot_survives_restart(self):
+        self.stub.traffic = {"corp_A": {"tx": 100, "rx": 100}}
+        await self.engine.run_once()
+        engine = TrafficSyncEngine(self.db, self.blitz, traffic_url=self.stub.url,
+                                   traffic_secret="secret", http=self.http)
+        self.stub.traffic = {"corp_A": {"tx": 150, "rx": 100}}
+        report = await engine.run_once()
+        self.assertEqual(report["upload_bytes"], 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from blitz_client import BlitzClient
+from database import Database
+from http_pool import HttpPool, get_http_pool
+
+logger = logging.getLogger(__name__)
+
+HYSTERIA_SOURCE = "hysteria"
+BLITZ_SOURCE = "blitz"
+
+# Field names the per-user Blitz stats payload may use, in order of preference
+UPLOAD_FIELDS = ("upload_bytes", "upload", "tx")
+DOWNLOAD_FIELDS = ("download_bytes", "download", "rx")
+
+
+def _first_int(data: Dict[str, Any], fields: Tuple[str, ...]) -> Optional[int]:
+    for field in fields:
+        value = data.get(field)
+        if isinstance(value, (int, float)):
+            return int(value)
+    return None
+
+
+def compute_deltas(previous: Dict[str, Tuple[int, int]], current: Dict[str, Tuple[int, int]]):
+    """Turn cumulative (tx, rx) counters into per-user deltas.
+
+    A user seen for the first time only establishes a baseline, so restarting
+    the service never re-counts old traffic. A counter
+    that went backwards means the server restarted; the new value is the delta.
+    Returns (deltas, resets) where deltas maps username -> (tx, rx).
+    """
+    deltas: Dict[str, Tuple[int, int]] = {}
+    resets = 0
+    for username, (tx, rx) in current.items():
+        if username not in previous:
+            continue
+        prev_tx, prev_rx = previous[username]
+        if tx < prev_tx or rx < prev_rx:
+            resets += 1
+            delta = (tx, rx)
+        else:
+            delta = (tx - prev_tx, rx - prev_rx)
+        if delta != (0, 0):
+            deltas[username] = delta
+    return deltas, resets
+
+
+class TrafficSyncEngine:
+    """Periodically pulls traffic counters for every user and books the deltas.
+
+    The preferred source is the Hysteria2 server's trafficStats API: one GET of
+    `/traffic` returns cumulative counters for every connected user. Without it
+    (or when it fails) the engine falls back to per-user Blitz stats calls
+    under a concurrency limit. All deltas of a run are written by one
+    Database.bulk_update_traffic_stats call together with the new snapshot.
+
+    With `node` set, the Blitz fallback only asks about users placed on that
+    fleet node (plus unplaced users for the default node).
+
+    Only the source of the last run keeps a snapshot: each run drops the other
+    source's, so a run that switches sources starts a new baseline and books
+    nothing. Otherwise traffic already booked from one source would be booked
+    again when the other source's older snapshot is next compared against.
+    """
+
+    def __init__(self, db: Database, blitz: BlitzClient, traffic_url: str = "",
+                 traffic_secret: str = "", interval_seconds: int = 300, concurrency: int = 8,
+                 http: Optional[HttpPool] = None, node: str = "", default_node: bool = False):
+        self.db = db
+        self.blitz = blitz
+        self.traffic_url = traffic_url.rstrip("/")
+        self.traffic_secret = traffic_secret
+        self.interval_seconds = interval_seconds
+        self.concurrency = max(1, concurrency)
+        self.http = http or get_http_pool("hysteria")
+        self.node = node
+        self.default_node = default_node
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _fetch_hysteria(self) -> Dict[str, Tuple[int, int]]:
+        headers = {"Authorization": self.traffic_secret} if self.traffic_secret else {}
+        response = await self.http.request("GET", f"{self.traffic_url}/traffic", headers=headers)
+        response.raise_for_status()
+        # Hysteria2 reports tx as bytes sent by the client (upload) and rx as bytes received
+        return {
+            username: (int(c.get("tx", 0)), int(c.get("rx", 0)))
+            for username, c in response.json().items()
+        }
+
+    async def _fetch_blitz(self, usernames) -> Dict[str, Tuple[int, int]]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        counters: Dict[str, Tuple[int, int]] = {}
+
+        async def fetch(username: str):
+            async with semaphore:
+                try:
+                    stats = await self.blitz.get_user_stats(username)
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code == 404:
+                        return
+                    raise
+            upload = _first_int(stats or {}, UPLOAD_FIELDS)
+            download = _first_int(stats or {}, DOWNLOAD_FIELDS)
+            if upload is not None and download is not None:
+                counters[username] = (upload, download)
+
+        results = await asyncio.gather(*(fetch(u) for u in usernames), return_exceptions=True)
+        failed = [r for r in results if isinstance(r, Exception)]
+        if failed and len(failed) == len(results):
+            raise failed[0]
+        if failed:
+            logger.warning(f"Blitz stats failed for {len(failed)} of {len(results)} users: {failed[0]}")
+        return counters
+
+    async def run_once(self) -> Dict[str, Any]:
+        started = time.monotonic()
+        usernames = await self.db.get_username_map()
+
+        source, other = BLITZ_SOURCE, HYSTERIA_SOURCE
+        current: Optional[Dict[str, Tuple[int, int]]] = None
+        if self.traffic_url:
+            try:
+                current = await self._fetch_hysteria()
+                source, other = HYSTERIA_SOURCE, BLITZ_SOURCE
+            except Exception as e:
+                logger.warning(f"Hysteria2 traffic API failed, falling back to Blitz: {e}")
+        if current is None:
+            placed = usernames
+            if self.node:
+                placed = await self.db.get_user_index(self.node, include_unassigned=self.default_node)
+            current = await self._fetch_blitz(list(placed))
+        # Fleet nodes other than the default keep their own counter snapshots
+        if self.node and not self.default_node:
+            source, other = f"{source}:{self.node}", f"{other}:{self.node}"
+
+        # Only users we know about are tracked; unknown panel users are ignored
+        current = {u: c for u, c in current.items() if u in usernames}
+        previous = await self.db.get_traffic_counters(source)
+        deltas, resets = compute_deltas(previous, current)
+
+        updated = 0
+        if current:
+            updated = await self.db.bulk_update_traffic_stats(
+                [(usernames[u], tx, rx) for u, (tx, rx) in deltas.items()],
+                counters=[(source, u, tx, rx) for u, (tx, rx) in current.items()],
+                drop_sources=[other],
+            )
+
+        report = {
+            "source": source,
+            "users_seen": len(current),
+            "users_updated": updated,
+            "upload_bytes": sum(tx for tx, _ in deltas.values()),
+            "download_bytes": sum(rx for _, rx in deltas.values()),
+            "counter_resets": resets,
+            "duration_ms": round((time.monotonic() - started) * 1000, 1),
+        }
+        self.last_report = report
+        if resets:
+            await self.db.log_monitor_event("traffic_sync", "WARN", "Counter reset detected", json.dumps(report))
+        return report
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Traffic sync failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def start(self):
+        if self.interval_seconds > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
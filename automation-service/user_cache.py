@@ -0,0 +1,94 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+DEFAULT_MAX_SIZE = 10000
+DEFAULT_TTL_SECONDS = 60.0
+
+
+class UserCache:
+    """Bounded LRU+TTL cache of `users` rows, indexed by corporate_id and telegram_id.
+
+    Reads take a `generation` before going to the database and pass it back to
+    `put`; any invalidation in between bumps the generation and the possibly
+    stale row is dropped instead of cached.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.generation = 0
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._by_telegram: Dict[str, str] = {}
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl_seconds > 0
+
+    def _drop(self, corporate_id: str):
+        entry = self._entries.pop(corporate_id, None)
+        if entry is not None:
+            telegram_id = entry[1].get("telegram_id")
+            if telegram_id and self._by_telegram.get(str(telegram_id)) == corporate_id:
+                del self._by_telegram[str(telegram_id)]
+
+    def get(self, corporate_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(corporate_id)
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self._drop(corporate_id)
+            self._stats["misses"] += 1
+            return None
+        self._entries.move_to_end(corporate_id)
+        self._stats["hits"] += 1
+        # Callers get their own copy so they cannot mutate the cached row
+        return dict(user)
+
+    def get_by_telegram_id(self, telegram_id: str) -> Optional[Dict[str, Any]]:
+        corporate_id = self._by_telegram.get(str(telegram_id))
+        if corporate_id is None:
+            self._stats["misses"] += 1
+            return None
+        return self.get(corporate_id)
+
+    def put(self, user: Dict[str, Any], generation: int):
+        if not self.enabled or generation != self.generation:
+            return
+        corporate_id = user["corporate_id"]
+        self._drop(corporate_id)
+        self._entries[corporate_id] = (time.monotonic() + self.ttl_seconds, dict(user))
+        if user.get("telegram_id"):
+            self._by_telegram[str(user["telegram_id"])] = corporate_id
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self._stats["evictions"] += 1
+
+    def invalidate(self, corporate_id: Optional[str] = None, telegram_id: Optional[str] = None):
+        self.generation += 1
+        self._stats["invalidations"] += 1
+        if telegram_id is not None:
+            linked = self._by_telegram.pop(str(telegram_id), None)
+            if linked is not None:
+                self._drop(linked)
+        if corporate_id is not None:
+            self._drop(corporate_id)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+        self._by_telegram.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hit_ratio": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
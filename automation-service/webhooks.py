@@ -1,6 +1,6 @@
-from fastapi import APIRouter, HTTPException, Header, Depends
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from fastapi import APIRouter, HTTPException, Header, Depends, Query
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List
 import logging
 import hmac
 import hashlib
@@ -8,15 +8,19 @@ import json
 from datetime import datetime
 
 from config import get_settings
-from database import Database
-from blitz_client import BlitzClient
+from database import get_database
+from circuit_breaker import CircuitOpenError
+from rate_limiter import RateLimitedError
+from fleet import get_fleet
+from qr_service import get_qr_service
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/webhooks", tags=["webhooks"])
 settings = get_settings()
-db = Database(settings.DB_PATH)
-blitz = BlitzClient(settings.BLITZ_API_URL, settings.BLITZ_SECRET_KEY)
+db = get_database(settings.DB_PATH)
+fleet = get_fleet()
+qr = get_qr_service()
 
 class WebhookEvent(BaseModel):
     event_type: str
@@ -38,6 +42,21 @@ class UserRoleChangedEvent(BaseModel):
     changed_by: str
     effective_date: datetime
 
+class ClaimEventsRequest(BaseModel):
+    consumer: str
+    limit: int = Field(10, ge=1, le=500)
+    visibility_timeout: int = Field(60, ge=1, le=3600)
+
+class AckEventsRequest(BaseModel):
+    consumer: str
+    event_ids: List[int]
+
+class NackEventsRequest(BaseModel):
+    consumer: str
+    event_ids: List[int]
+    error: str = ""
+    retry_delay: int = Field(0, ge=0, le=86400)
+
 def verify_webhook_signature(payload: bytes, signature: str, secret: str) -> bool:
     """Verify webhook signature using HMAC-SHA256"""
     expected_signature = hmac.new(
@@ -71,11 +90,12 @@ async def handle_hr_webhook(
             logger.warning(f"Invalid webhook signature for event {event.event_type}")
             raise HTTPException(status_code=401, detail="Invalid signature")
     
-    # Log webhook event
+    # Log webhook event; durable so it is stored before the HR system gets an answer
     await db.create_webhook_event(
         event_type=event.event_type,
         corporate_id=event.corporate_id,
-        event_data=json.dumps(event.event_data, default=str)
+        event_data=json.dumps(event.event_data, default=str),
+        durable=True
     )
     
     logger.info(f"Received HR webhook: {event.event_type} for user {event.corporate_id}")
@@ -91,6 +111,9 @@ async def handle_hr_webhook(
         else:
             logger.warning(f"Unknown event type: {event.event_type}")
             
+    except (CircuitOpenError, RateLimitedError):
+        # Answered with 503 by the app handler; the event stays queued for retry
+        raise
     except Exception as e:
         logger.error(f"Error processing webhook event {event.event_type}: {e}")
         raise HTTPException(status_code=500, detail="Error processing event")
@@ -108,11 +131,14 @@ async def handle_user_deactivated(corporate_id: str, event_data: Dict[str, Any])
     
     try:
         username = user['blitz_username']
-        await blitz.update_user_status(username, False)
+        await fleet.set_status(corporate_id, username, False)
         logger.info(f"Deactivated Blitz user {username} for corporate_id {corporate_id}")
         
         # Update database
         await db.deactivate_user(corporate_id)
+        # Cached QR codes encode the now revoked auth key
+        for url in await fleet.hy2_urls(user):
+            await qr.forget(url)
         
         # Log the action
         await db.log_auth_attempt(
@@ -185,6 +211,7 @@ async def handle_user_suspended(corporate_id: str, event_data: Dict[str, Any]):
 
 @router.get("/events/pending")
 async def get_pending_webhook_events(
+    limit: int = Query(100, ge=1, le=1000),
     x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
 ):
     """Get pending webhook events for processing"""
@@ -192,9 +219,67 @@ async def get_pending_webhook_events(
     if x_corporate_secret != settings.CORPORATE_SECRET:
         raise HTTPException(status_code=403, detail="Invalid corporate secret")
     
-    events = await db.get_pending_webhook_events()
+    events = await db.get_pending_webhook_events(limit)
     return {"events": events}
 
+@router.post("/events/claim")
+async def claim_webhook_events(
+    request: ClaimEventsRequest,
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    """
+    Lease up to `limit` pending events to one consumer.
+
+    Leased events are hidden from other consumers for `visibility_timeout`
+    seconds; ack them when done or nack them to retry. Expired leases are
+    handed out again until WEBHOOK_MAX_ATTEMPTS is reached.
+    """
+    
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+    
+    events = await db.claim_webhook_events(
+        request.consumer, request.limit, request.visibility_timeout, settings.WEBHOOK_MAX_ATTEMPTS
+    )
+    return {"events": events}
+
+@router.post("/events/ack")
+async def ack_webhook_events(
+    request: AckEventsRequest,
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    """Mark leased events as processed"""
+    
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+    
+    acked = await db.ack_webhook_events(request.consumer, request.event_ids)
+    return {"acked": acked, "rejected": sorted(set(request.event_ids) - set(acked))}
+
+@router.post("/events/nack")
+async def nack_webhook_events(
+    request: NackEventsRequest,
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    """Release leased events for a later retry"""
+    
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+    
+    released = await db.nack_webhook_events(
+        request.consumer, request.event_ids, request.error, request.retry_delay, settings.WEBHOOK_MAX_ATTEMPTS
+    )
+    return {"released": released, "rejected": sorted(set(request.event_ids) - set(released))}
+
+@router.get("/events/stats")
+async def webhook_queue_stats(
+    x_corporate_secret: str = Header(..., alias="X-Corporate-Secret")
+):
+    if x_corporate_secret != settings.CORPORATE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid corporate secret")
+    
+    return await db.webhook_queue_stats()
+
 @router.post("/events/{event_id}/process")
 async def mark_event_processed(
     event_id: int,
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from db_pool import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_BATCH_MS = 50
+DEFAULT_QUEUE_SIZE = 10000
+
+# Queue item: (sql, params, future). A None sql is a flush marker.
+_Item = Tuple[Optional[str], Optional[Sequence[Any]], Optional[asyncio.Future]]
+
+
+class WriteBehindQueue:
+    """Batches append-only INSERTs into one transaction per N rows or M ms.
+
+    Callers enqueue and return immediately; a single flusher task drains the
+    queue through the pool writer. Passing `durable=True` makes the caller wait
+    until its row has been committed.
+    """
+
+    def __init__(self, pool: ConnectionPool, batch_size: int = DEFAULT_BATCH_SIZE,
+                 batch_ms: int = DEFAULT_BATCH_MS, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.pool = pool
+        self.batch_size = max(1, batch_size)
+        self.batch_ms = max(0, batch_ms)
+        self.queue_size = max(1, queue_size)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        self._stats = {
+            "enqueued": 0,
+            "committed": 0,
+            "failed": 0,
+            "batches": 0,
+            "largest_batch": 0,
+            "backpressure_waits": 0,
+        }
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def enqueue(self, sql: str, params: Sequence[Any], durable: bool = False):
+        """Queue one INSERT. Blocks while the queue is full (backpressure)."""
+        if self._closing:
+            raise RuntimeError("Write-behind queue is closed")
+        self._ensure_started()
+
+        future = asyncio.get_running_loop().create_future() if durable else None
+        if self._queue.full():
+            self._stats["backpressure_waits"] += 1
+        await self._queue.put((sql, tuple(params), future))
+        self._stats["enqueued"] += 1
+        if future is not None:
+            await future
+
+    async def enqueue_many(self, sql: str, rows: Sequence[Sequence[Any]], durable: bool = False):
+        """Queue many rows for one statement; with `durable` wait until all are committed."""
+        for params in rows:
+            await self.enqueue(sql, params)
+        if durable:
+            await self.flush()
+
+    async def flush(self):
+        """Wait until everything queued before this call has been committed."""
+        if self._task is None or self._task.done():
+            return
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((None, None, future))
+        await future
+
+    async def close(self):
+        """Flush outstanding rows and stop the flusher task."""
+        if self._task is None:
+            return
+        self._closing = True
+        try:
+            await self.flush()
+        finally:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._queue = None
+            self._closing = False
+
+    async def _collect(self) -> List[_Item]:
+        batch = [await self._queue.get()]
+        if batch[0][0] is None:
+            return batch
+        deadline = time.monotonic() + self.batch_ms / 1000
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            if item[0] is None:
+                # A flush marker closes the batch early
+                break
+        # Anything already sitting in the queue rides along for free
+        while len(batch) < self.batch_size and not self._queue.empty() and batch[-1][0] is not None:
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            rows = [item for item in batch if item[0] is not None]
+            error: Optional[BaseException] = None
+            if rows:
+                try:
+                    await self._write(rows)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    error = e
+                    logger.error(f"Write-behind batch of {len(rows)} rows failed, retrying row by row: {e}")
+                    await self._write_individually(rows)
+            for sql, _, future in batch:
+                if future is None or future.done():
+                    continue
+                if sql is None or error is None:
+                    future.set_result(None)
+
+    async def _write(self, rows: List[_Item]):
+        async with self.pool.write() as conn:
+            # Consecutive rows for the same statement go through one executemany
+            start = 0
+            while start < len(rows):
+                sql = rows[start][0]
+                end = start
+                while end < len(rows) and rows[end][0] == sql:
+                    end += 1
+                await conn.executemany(sql, [params for _, params, _ in rows[start:end]])
+                start = end
+        self._stats["committed"] += len(rows)
+        self._stats["batches"] += 1
+        self._stats["largest_batch"] = max(self._stats["largest_batch"], len(rows))
+
+    async def _write_individually(self, rows: List[_Item]):
+        for sql, params, future in rows:
+            try:
+                async with self.pool.write() as conn:
+                    await conn.execute(sql, params)
+                self._stats["committed"] += 1
+                if future is not None and not future.done():
+                    future.set_result(None)
+            except Exception as e:
+                self._stats["failed"] += 1
+                logger.error(f"Dropping write-behind row after failure: {e}")
+                if future is not None and not future.done():
+                    future.set_exception(e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": self.queue_size,
+            "batch_size": self.batch_size,
+            "batch_ms": self.batch_ms,
+        }